@@ -0,0 +1,149 @@
+"""
+Builds synthetic maps for benchmarking. The same arguments always give the same map.
+
+Example: python -m benchmarks.generate 100k out/ --format sspm --markers --custom-fields --audio --cover
+"""
+import argparse
+import io
+import os
+import struct
+import sys
+
+import numpy as np
+
+from src.core import FORMATS, FORMAT_EXTS, NoteStore, RawDataLevel, SSPMLevel, VulnusLevel
+
+FORMAT_KEYS = {extension[2:]: level_class for level_class, extension in zip(FORMATS, FORMAT_EXTS)}
+# Used when saving, generated maps don't have timing of their own
+METADATA = (150, 0, (4, 4), 0.5)
+AUDIO_BYTES_PER_NOTE = 512  # Roughly what a dense map's song weighs in Ogg Vorbis
+
+
+def parse_count(text) -> int:
+    """Read a note count like 1000, 10k or 1.5M."""
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale != 1 else text) * scale)
+
+
+def generate_notes(count, seed=0, length=None) -> NoteStore:
+    """
+    Notes 5 to 250 ms apart, with about one in ten sharing a time with the note before it,
+    or stretched to fit length milliseconds if it's given.
+    About two thirds sit on the 3x3 grid, the rest are anywhere from -0.5 to 2.5 in steps of 0.01.
+    """
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(5, 250, count, dtype=np.int64)
+    gaps[rng.random(count) < 0.1] = 0
+    times = np.cumsum(gaps) - gaps[0]
+    if length is not None and count > 1 and times[-1]:
+        times = times * length // times[-1]
+    grid = rng.random(count) < 2 / 3
+    xs = np.where(grid, rng.integers(0, 3, count), np.round(rng.uniform(-0.5, 2.5, count), 2))
+    ys = np.where(grid, rng.integers(0, 3, count), np.round(rng.uniform(-0.5, 2.5, count), 2))
+    return NoteStore.from_arrays(times, xs, ys, ~grid)
+
+
+def generate_audio(size, seed=0) -> bytes:
+    """
+    An Ogg page with a Vorbis identification header, then random bytes. Levels only check the codec in the first page
+    to pass audio through, so this is never decoded, and saving doesn't need ffmpeg.
+    """
+    # Version, channels, sample rate, bitrates (maximum, nominal, minimum), block sizes and the framing bit
+    packet = b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 2, 44100, 0, 128000, 0, 0xB8, 1)
+    # A first page (0x02) holding only that packet, its checksum left at 0 for now
+    page = bytearray(b"OggS" + struct.pack("<BBqIII", 0, 0x02, 0, seed & 0xFFFFFFFF, 0, 0)
+                     + bytes((1, len(packet))) + packet)
+    page[22:26] = struct.pack("<I", ogg_crc(page))
+    return bytes(page) + np.random.default_rng(seed).bytes(max(size - len(page), 0))
+
+
+def ogg_crc(data) -> int:
+    """The checksum of an Ogg page: CRC-32 with polynomial 0x04C11DB7, not reflected, starting from 0."""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        crc &= 0xFFFFFFFF
+    return crc
+
+
+def generate_cover(seed=0) -> bytes:
+    from PIL import Image
+    pixels = np.random.default_rng(seed).integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    with io.BytesIO() as output:
+        Image.fromarray(pixels, "RGB").save(output, "png")
+        return output.getvalue()
+
+
+def generate_level(level_class, count, markers=False, custom_fields=False, audio=False, cover=False, seed=0,
+                   length=None):
+    """
+    A level of the given class. Markers and custom fields only apply to SSPM levels,
+    and Vulnus levels always get audio, since the game can't play them without it.
+    """
+    notes = generate_notes(count, seed, length)
+    kwargs = {}
+    if level_class is SSPMLevel:
+        kwargs["song_name"] = f"Benchmark song {seed}"
+        if markers:
+            rng = np.random.default_rng(seed + 1)
+            end = int(notes.times[-1]) if len(notes) else 0
+            kwargs["marker_types"] = {"ssp_note": [0x7], "bench_flash": [0x2, 0x6], "bench_text": [0x9]}
+            # About one custom marker for every 100 notes
+            marker_count = max(count // 100, 1)
+            kwargs["markers"] = {
+                "bench_flash": [{"time": int(t), "fields": [int(c), float(d)]} for t, c, d in zip(
+                    np.sort(rng.integers(0, end + 1, marker_count)), rng.integers(0, 65536, marker_count),
+                    rng.random(marker_count))],
+                "bench_text": [{"time": int(t), "fields": [f"Section {i}"]} for i, t in enumerate(
+                    np.sort(rng.integers(0, end + 1, max(marker_count // 10, 1))))],
+            }
+        if custom_fields:
+            kwargs["custom_fields"] = {
+                "bpm": (150.0, 6), "time_signature_num": (4, 2), "time_signature_den": (4, 2), "offset": (0, 3),
+                "swing": (0.5, 6), "bench_tags": (["synthetic", "benchmark"], 12, 9), "bench_seed": (seed, 4),
+            }
+    level = level_class(f"Benchmark {count}", [f"Mapper {seed}"], notes, None, None, 1, id=f"benchmark_{count}_{seed}",
+                        **kwargs)
+    if level_class is VulnusLevel:
+        level.difficulty = "Hard"
+    if (audio or level_class is VulnusLevel) and level_class is not RawDataLevel:
+        level.set_audio_data(generate_audio(count * AUDIO_BYTES_PER_NOTE, seed))
+    if cover and level_class is not RawDataLevel:
+        level.set_cover_data(generate_cover(seed))
+    return level
+
+
+def output_path(directory, level_class, count):
+    if level_class is VulnusLevel:
+        # Vulnus maps keep their audio and metadata next to the difficulty, so each gets a folder
+        return os.path.join(directory, f"benchmark_{count}", f"benchmark_{count}.json")
+    return os.path.join(directory, f"benchmark_{count}{FORMAT_EXTS[FORMATS.index(level_class)][1:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic maps for benchmarking.")
+    parser.add_argument("counts", nargs="+", help="note counts, like 1000, 10k or 1M")
+    parser.add_argument("output", help="directory to write the maps to")
+    parser.add_argument("-f", "--format", default="sspm", choices=FORMAT_KEYS)
+    parser.add_argument("--markers", action="store_true", help="add custom markers (SSPM only)")
+    parser.add_argument("--custom-fields", action="store_true", help="add extra custom fields (SSPM only)")
+    parser.add_argument("--audio", action="store_true", help="add a placeholder song")
+    parser.add_argument("--cover", action="store_true", help="add a random cover")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    level_class = FORMAT_KEYS[args.format]
+    for count in map(parse_count, args.counts):
+        level = generate_level(level_class, count, args.markers, args.custom_fields, args.audio, args.cover, args.seed)
+        path = output_path(args.output, level_class, count)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        level.save(path, *METADATA)
+        print(f"Wrote {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
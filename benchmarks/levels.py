@@ -0,0 +1,178 @@
+"""
+Times loading and saving synthetic maps in every format, and writes the results as JSON so runs can be compared.
+
+Example:
+    python -m benchmarks.levels --sizes 1k 100k 1M --output before.json
+    python -m benchmarks.levels --sizes 1k 100k 1M --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.generate import FORMAT_KEYS, METADATA, generate_level, output_path, parse_count
+from src.core import VulnusLevel
+
+DEFAULT_SIZES = ("1k", "10k", "100k", "1M")
+# "bare" is only notes, "full" adds whatever else the format can hold
+VARIANTS = {
+    "bare": {},
+    "full": {"markers": True, "custom_fields": True, "audio": True, "cover": True},
+}
+OPERATIONS = ("save", "load", "round_trip")
+
+
+def commit_id():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def file_size(path, level_class):
+    if level_class is VulnusLevel:
+        # The audio, cover and metadata are part of the map too
+        directory = os.path.dirname(path)
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return os.path.getsize(path)
+
+
+def load_fully(level_class, path):
+    """Load a map, then read its assets, so lazy loading doesn't hide their cost."""
+    level, _ = level_class.load(path)
+    level.audio_data, level.cover_data
+    return level
+
+
+def prepare(operation, level_class, count, options, directory):
+    """
+    Set up one operation on a fresh map, and return a function that runs it.
+    Generating the map, and saving the one to load, happens here so it isn't measured.
+    """
+    level = generate_level(level_class, count, **options)
+    path = output_path(directory, level_class, count)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if operation == "save":
+        return lambda: level.save(path, *METADATA)
+    level.save(path, *METADATA)
+    del level
+    if operation == "load":
+        return lambda: load_fully(level_class, path)
+    copy_path = output_path(os.path.join(directory, "copy"), level_class, count)
+    os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+    return lambda: load_fully(level_class, path).save(copy_path, *METADATA)
+
+
+def run_timed(run) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def run_traced(run) -> int:
+    """The most memory allocated at once while running, not counting what was allocated before."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(format_name, count, variant, operation, repeat, memory):
+    level_class = FORMAT_KEYS[format_name]
+    options = VARIANTS[variant]
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(prefix="sspy-bench-") as directory:
+                times.append(run_timed(prepare(operation, level_class, count, options, directory)))
+                size = file_size(output_path(directory, level_class, count), level_class)
+        peak = None
+        if memory:
+            with tempfile.TemporaryDirectory(prefix="sspy-bench-") as directory:
+                peak = run_traced(prepare(operation, level_class, count, options, directory))
+    best = min(times)
+    return {
+        "format": format_name, "notes": count, "variant": variant, "operation": operation,
+        "seconds": best, "median_seconds": float(np.median(times)), "runs": repeat,
+        "notes_per_second": count / best if best else None, "file_bytes": size,
+        "mb_per_second": size / best / 1e6 if best else None, "peak_bytes": peak,
+    }
+
+
+def result_key(result):
+    return result["format"], result["notes"], result["variant"], result["operation"]
+
+
+def compare(results, baseline_file, key=result_key, metric="seconds"):
+    """Print how each result's time compares to the same benchmark in an earlier run."""
+    with open(baseline_file) as f:
+        baseline = {key(result): result for result in json.load(f)["results"]}
+    print(f"\nCompared to {baseline_file} (time ratio, below 1 is faster):")
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        ratio = result[metric] / old[metric] if old[metric] else float("nan")
+        flag = "  /!\\ slower" if ratio > 1.1 else ""
+        print(f"  {' '.join(map(str, key(result))):<40} {old[metric]:9.4f} -> {result[metric]:9.4f}"
+              f"  x{ratio:.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading and saving maps in every format.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="note counts, like 1000, 10k or 10M")
+    parser.add_argument("--formats", nargs="+", default=list(FORMAT_KEYS), choices=FORMAT_KEYS)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--operations", nargs="+", default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per benchmark, the fastest one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slower) peak memory measurement")
+    parser.add_argument("-o", "--output", help="where to write the results (default: print them)")
+    parser.add_argument("--compare", help="results from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    for format_name in args.formats:
+        for count in map(parse_count, args.sizes):
+            for variant in args.variants:
+                for operation in args.operations:
+                    result = benchmark(format_name, count, variant, operation, max(args.repeat, 1), not args.no_memory)
+                    results.append(result)
+                    peak = "" if result["peak_bytes"] is None else f", peak {result['peak_bytes'] / 1e6:.1f} MB"
+                    print(f"{format_name:>5} {count:>9} {variant:>5} {operation:>10}: {result['seconds']:.4f}s "
+                          f"({result['notes_per_second']:,.0f} notes/s, {result['mb_per_second']:.1f} MB/s{peak})")
+                    sys.stdout.flush()
+    report = {
+        "commit": commit_id(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare is not None:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
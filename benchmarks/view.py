@@ -0,0 +1,182 @@
+"""
+Times drawing the level view, without a window or a GPU: frames are drawn into a stub draw list that only counts calls.
+Levels are generated at several note densities, and drawn at several approach rates, window widths and timeline zooms.
+
+Example:
+    python -m benchmarks.view --output before.json
+    python -m benchmarks.view --output after.json --compare before.json
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import platform
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from benchmarks.generate import generate_level
+from benchmarks.levels import commit_id, compare
+from src.core import SSPMLevel
+from src.view import LevelView
+from src.waveform import WaveformPyramid
+
+LENGTH = 180_000  # Three minutes, in milliseconds
+AUDIO_RATE = 44100
+
+
+class StubDrawList:
+    """Stands in for imgui's draw list, counting the calls made to it instead of drawing anything."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def add_rect(self, *_, **__):
+        self.calls["add_rect"] += 1
+
+    def add_rect_filled(self, *_, **__):
+        self.calls["add_rect_filled"] += 1
+
+    def add_line(self, *_, **__):
+        self.calls["add_line"] += 1
+
+    def add_text(self, *_, **__):
+        self.calls["add_text"] += 1
+
+    def add_circle_filled(self, *_, **__):
+        self.calls["add_circle_filled"] += 1
+
+    def add_polyline(self, *_, **__):
+        self.calls["add_polyline"] += 1
+
+    def add_image(self, *_, **__):
+        self.calls["add_image"] += 1
+
+
+class TextureView(LevelView):
+    """Caches like the editor does, rasterizing into textures, except that uploading them is skipped."""
+    uses_textures = True
+
+    def __init__(self):
+        super().__init__()
+        self.uploads = 0
+
+    def upload_image(self, name, image) -> int:
+        self.uploads += 1
+        return 1
+
+
+def make_view(density, approach_rate, zoom, waveform, cursor, textures, seed=0):
+    """A view of a three minute level with density notes per second, some markers, and optionally a song."""
+    view = TextureView() if textures else LevelView()
+    view.level = generate_level(SSPMLevel, int(density * LENGTH / 1000), markers=True, seed=seed, length=LENGTH)
+    view.times_to_display = view.level.get_notes()
+    view.approach_rate = approach_rate
+    view.timeline_zoom = zoom
+    view.cursor = cursor
+    view.timings = np.arange(0, LENGTH, 2000, dtype=np.int64)
+    if waveform:
+        # Noise stands in for a decoded song, stereo like the editor assumes
+        view.draw_audio = True
+        samples = np.random.default_rng(seed).integers(-32768, 32768, LENGTH * AUDIO_RATE // 1000 * 2, dtype=np.int16)
+        view.waveform = WaveformPyramid.build(samples, 2, AUDIO_RATE)
+    return view
+
+
+def draw_frames(view, width, frames):
+    """Draw frames scrolling through the whole level, returning how long they took and the calls they made."""
+    draw_list = StubDrawList()
+    height = width * 9 // 16
+    # Draw a frame first, so the cursor spline and other caches are built before timing starts
+    timeline_start, timeline_width = view.timeline_view(max(view.level.get_end() + 1000, view.approach_rate, 1))
+    view.draw_level(draw_list, 0, 0, width, height, timeline_width, timeline_start=timeline_start)
+    view.draw_overlay(draw_list, 0, 0, width, height, (1, 1))
+    view.notes_changed = False
+    draw_list.calls.clear()
+    rects = 0
+    times = np.linspace(0, view.level.get_end(), frames).astype(np.int64)
+    start = time.perf_counter()
+    for frame_time in times.tolist():
+        view.frame_timer.begin_frame()
+        view.time = frame_time
+        view.rects_drawn = 0
+        timeline_start, timeline_width = view.timeline_view(
+            max(view.level.get_end() + 1000, view.time + view.approach_rate, 1))
+        view.frame_timer.phase("level view")
+        view.draw_level(draw_list, 0, 0, width, height, timeline_width, timeline_start=timeline_start)
+        view.draw_overlay(draw_list, 0, 0, width, height, (1, 1))
+        view.frame_timer.end_frame()
+        rects += view.rects_drawn
+    return time.perf_counter() - start, draw_list.calls, rects
+
+
+def benchmark(density, approach_rate, width, zoom, frames, waveform, cursor, textures):
+    view = make_view(density, approach_rate, zoom, waveform, cursor, textures)
+    seconds, calls, rects = draw_frames(view, width, frames)
+    phases, durations, _ = view.frame_timer.history(frames)
+    return {
+        "density": density, "approach_rate": approach_rate, "width": width, "zoom": zoom,
+        "seconds": seconds, "frames": frames, "fps": frames / seconds, "ms_per_frame": seconds * 1000 / frames,
+        "calls_per_frame": sum(calls.values()) / frames,
+        "calls": {name: count / frames for name, count in sorted(calls.items())},
+        "rects_per_frame": rects / frames,
+        "phases_ms": {phase: float(duration) for phase, duration in zip(phases, durations.mean(axis=0))},
+    }
+
+
+def result_key(result):
+    return result["density"], result["approach_rate"], result["width"], result.get("zoom", 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark drawing the level view into a stub draw list.")
+    parser.add_argument("--densities", nargs="+", type=float, default=(2, 8, 20), help="notes per second")
+    parser.add_argument("--approach-rates", nargs="+", type=int, default=(500, 1100, 3000), help="in milliseconds")
+    parser.add_argument("--widths", nargs="+", type=int, default=(800, 1920), help="window widths in pixels")
+    parser.add_argument("--zooms", nargs="+", type=float, default=(1,), help="timeline zooms, 1 shows the whole level")
+    parser.add_argument("-f", "--frames", type=int, default=300, help="frames to draw per benchmark")
+    parser.add_argument("--no-waveform", action="store_true", help="don't draw the song's waveform")
+    parser.add_argument("--no-cursor", action="store_true", help="don't draw the cursor")
+    parser.add_argument("--no-textures", action="store_true", help="draw everything as shapes, like without a GPU")
+    parser.add_argument("-o", "--output", help="where to write the results (default: print them)")
+    parser.add_argument("--compare", help="results from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    cursor = not args.no_cursor
+    if cursor and importlib.util.find_spec("scipy") is None:
+        print("/!\\ scipy isn't installed, so the cursor won't be drawn.")
+        cursor = False
+    results = []
+    for density, approach_rate, width, zoom in itertools.product(args.densities, args.approach_rates, args.widths,
+                                                                  args.zooms):
+        result = benchmark(density, approach_rate, width, zoom, args.frames, not args.no_waveform, cursor,
+                           not args.no_textures)
+        results.append(result)
+        print(f"{density:>5g} notes/s, AR {approach_rate:>5}, {width:>5}px, x{zoom:<4g}: {result['fps']:8.1f} FPS "
+              f"({result['ms_per_frame']:.2f} ms, {result['calls_per_frame']:.0f} draw calls per frame)")
+        sys.stdout.flush()
+    report = {
+        "commit": commit_id(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "waveform": not args.no_waveform,
+        "cursor": cursor,
+        "textures": not args.no_textures,
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare is not None:
+        compare(results, args.compare, result_key, "ms_per_frame")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Converts maps between formats without opening the editor.
+This never imports SDL, imgui or OpenGL, so it works on headless machines too.
+
+Example: python convert.py old_maps/ "more_maps/**/*.txt" --to sspm --output converted/
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from src.core import FORMATS, FORMAT_EXTS, VulnusLevel, convert_difficulty, format_of
+
+# Used when a map doesn't store its own BPM, offset, time signature and swing
+DEFAULT_METADATA = (120, 0, (4, 4), 0.5)
+TARGETS = {extension[2:]: level_class for level_class, extension in zip(FORMATS, FORMAT_EXTS)}
+TARGETS_BY_CLASS = {level_class: name for name, level_class in TARGETS.items()}
+
+
+def find_maps(patterns):
+    """Every map file in the given files, directories and globs, in order and without duplicates."""
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = (path for extension in FORMAT_EXTS for path in Path(pattern).rglob(extension))
+        elif os.path.exists(pattern):
+            paths = (Path(pattern),)
+        else:
+            paths = (Path(path) for path in glob.glob(pattern, recursive=True))
+        for path in sorted(paths):
+            # Vulnus metadata sits next to the difficulties, but isn't a map itself
+            if path.is_file() and format_of(path) is not None and path.name != "meta.json":
+                found[path.resolve()] = path
+    return list(found.values())
+
+
+def destination_for(source: Path, target, output):
+    directory = source.parent if output is None else Path(output)
+    if target is VulnusLevel:
+        # Vulnus maps keep their audio and metadata next to the difficulty, so each gets a folder
+        if source.suffix == ".json":
+            return directory / source.parent.name / source.name
+        return directory / source.stem / f"{source.stem}.json"
+    return directory / f"{source.stem}.{TARGETS_BY_CLASS[target]}"
+
+
+def convert_file(source, destination, target, verbose=False):
+    """Convert a single map. Runs in a worker process."""
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        level, metadata = format_of(source).load(source)
+        if metadata is None:
+            metadata = DEFAULT_METADATA
+        if not isinstance(level, target):
+            new_level = target(level.name, level.authors, level.notes, None, None,
+                               convert_difficulty(level.difficulty, target))
+            new_level.share_assets(level)
+            level = new_level
+        Path(destination).parent.mkdir(parents=True, exist_ok=True)
+        level.save(str(destination), *metadata)
+    return destination
+
+
+def convert_files(conversions, target, verbose=False):
+    """
+    Convert maps one after another, for maps that share files, like the difficulties of a Vulnus map
+    sharing its meta.json. Runs in a worker process.
+    Returns each map's destination, or the exception it failed with.
+    """
+    results = []
+    for source, destination in conversions:
+        try:
+            results.append(convert_file(source, destination, target, verbose))
+        except Exception as e:
+            if verbose:
+                traceback.print_exc()
+            results.append(e)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert maps between formats, without opening the editor.")
+    parser.add_argument("inputs", nargs="+", help="map files, directories to search, or glob patterns")
+    parser.add_argument("-t", "--to", required=True, choices=TARGETS, help="the format to convert to")
+    parser.add_argument("-o", "--output", help="directory to write to (default: next to each map)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="how many maps to convert at once")
+    parser.add_argument("--overwrite", action="store_true", help="replace files that already exist")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of each conversion")
+    args = parser.parse_args(argv)
+
+    target = TARGETS[args.to]
+    sources = find_maps(args.inputs)
+    if not sources:
+        print("No maps found!")
+        return 1
+    failed = 0
+    done = 0
+    # Vulnus maps written to the same folder share its meta.json and audio, so they're converted by the same job
+    groups = {}
+    destinations = set()
+    for source in sources:
+        destination = destination_for(source, target, args.output)
+        problem = None
+        if destination.resolve() in destinations:
+            problem = f"another map is already being converted to {destination}"
+        elif destination.exists() and not args.overwrite:
+            problem = f"{destination} already exists, pass --overwrite to replace it"
+        if problem is not None:
+            done += 1
+            failed += 1
+            print(f"[{done}/{len(sources)}] /!\\ {source}: {problem}")
+            continue
+        destinations.add(destination.resolve())
+        key = destination.parent.resolve() if target is VulnusLevel else destination.resolve()
+        groups.setdefault(key, []).append((str(source), str(destination)))
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        jobs = {pool.submit(convert_files, conversions, target, args.verbose): conversions
+                for conversions in groups.values()}
+        for job in as_completed(jobs):
+            try:
+                results = job.result()
+            except Exception as e:  # The worker itself died
+                results = [e] * len(jobs[job])
+            for (source, _), result in zip(jobs[job], results):
+                done += 1
+                if isinstance(result, Exception):
+                    failed += 1
+                    print(f"[{done}/{len(sources)}] /!\\ {source}: {result.__class__.__name__}: {result}")
+                else:
+                    print(f"[{done}/{len(sources)}] {source} -> {result}")
+            sys.stdout.flush()
+    print(f"Converted {done - failed} of {len(sources)} maps.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import argparse
 import ctypes
 import sys
 import traceback
@@ -8,6 +9,8 @@ import sdl2.sdlimage
 from imgui.integrations.sdl2 import SDL2Renderer
 import OpenGL.GL as gl
 import src.loop as loop
+from src.profiling import FrameTimer
+from src.replay import InputRecorder, InputReplayer
 from pathlib import Path
 import os
 from tkinter import Tk  # this is only for the file dialog
@@ -16,7 +19,18 @@ from tkinter import Tk  # this is only for the file dialog
 import src.style as imgui_style
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="A map editor for Sound Space.")
+    parser.add_argument("map", nargs="?", help="a map to open")
+    replay = parser.add_mutually_exclusive_group()
+    replay.add_argument("--record", metavar="FILE", help="record everything that's input to the editor, to replay later")
+    replay.add_argument("--replay", metavar="FILE",
+                        help="replay a recording as fast as possible, then save how long its frames took")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     window, gl_ctx = init()
     imgui.create_context()
     style = imgui.get_style()
@@ -24,6 +38,14 @@ def main():
     impl = SDL2Renderer(window)
     impl.refresh_font_texture()
     editor = loop.Editor()
+    editor.startup_file = args.map
+    if args.record is not None:
+        editor.input = InputRecorder(args.record, args.map)
+    elif args.replay is not None:
+        editor.input = InputReplayer(args.replay)
+        if args.map is None:
+            editor.startup_file = editor.input.startup_file()
+        editor.frame_timer = FrameTimer(max(editor.input.frames, 1))  # Keep every frame for the profile
     root = Tk()
     root.withdraw()
     try:
@@ -39,6 +61,7 @@ def main():
         if sys.gettrace() is not None:  # only reraise if not being debugged
             raise
     finally:
+        editor.input.close()
         impl.shutdown()
         sdl2.SDL_GL_DeleteContext(gl_ctx)
         sdl2.SDL_DestroyWindow(window)
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def adjust_swing(beat, swing):
+    """Move a beat to where it lands with swing applied. A swing of 0.5 is straight."""
+    b = (beat % 2)
+    s = swing
+    if b < (2 * s):
+        return (beat - b) + (((2 - 2 * s) / (2 * s)) * b)
+    else:
+        return (beat - b) + (((2 * s) / (2 - 2 * s)) * (b - 2 * s) + 2 - 2 * s)
+
+
+def snap_time(time, bpm, offset, time_signature, beat_divisor) -> int:
+    """Snap a time in milliseconds to the nearest 1/beat_divisor of a beat."""
+    ms_per_beat = (60000 / bpm) * (4 / time_signature[1])
+    step = (ms_per_beat) / beat_divisor
+    return int((round(time / step) * (step)) - ((ms_per_beat - offset) % ms_per_beat))
+
+
+def spline(nodes, count):
+    """Place count notes along a cubic spline through nodes, which maps times to positions."""
+    # scipy takes a while to import, so only do it once a spline is actually needed
+    from scipy.interpolate import CubicSpline
+    nodes = [(key, *value) for key, value in sorted(nodes.items())]
+    nodes = np.array(nodes, dtype=np.float64)
+    notes = {}
+    start = min(nodes[:, 0])
+    end = max(nodes[:, 0])
+    cs = CubicSpline(nodes[:, 0], nodes[:, 1:])
+    for time in np.linspace(start, end, count):
+        notes[time] = cs(time)
+    return notes
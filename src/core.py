@@ -0,0 +1,22 @@
+"""
+Everything needed to load, edit and save levels, without the editor.
+Importing this doesn't pull in SDL, imgui, OpenGL, scipy, Pillow or pydub, so scripts start quickly:
+
+    from src.core import SSPMLevel
+    level, metadata = SSPMLevel.load("map.sspm")
+
+Audio and covers are still decoded on demand, which is when Pillow and pydub get imported.
+"""
+from src.beats import adjust_swing, snap_time, spline
+from src.level import (DIFFICULTIES, FORMATS, FORMAT_EXTS, FORMAT_NAMES, Level, RawDataLevel, SSPMLevel, VulnusLevel,
+                       VulnusMapSet, convert_difficulty, format_of)
+from src.notes import NOTE_DTYPE, NoteStore
+from src.timings import import_timings
+
+__all__ = [
+    "adjust_swing", "snap_time", "spline",
+    "DIFFICULTIES", "FORMATS", "FORMAT_EXTS", "FORMAT_NAMES", "Level", "RawDataLevel", "SSPMLevel", "VulnusLevel",
+    "VulnusMapSet", "convert_difficulty", "format_of",
+    "NOTE_DTYPE", "NoteStore",
+    "import_timings",
+]
@@ -1,31 +1,239 @@
-import glob
+from __future__ import annotations
+
+import copy
 import json
+import mmap
 import os
 import struct
+import subprocess
+import tempfile
+import threading
 import uuid
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import cache
 from io import BytesIO
 from itertools import chain
+from operator import itemgetter
 from pathlib import Path
 from hashlib import sha1
+from typing import TYPE_CHECKING
 
 import numpy as np
-from PIL import Image
-from pydub import AudioSegment
 
+from src.notes import NoteStore
+
+# Pillow and pydub are only imported once an image or some audio needs decoding, so scripts that only touch notes load fast
+if TYPE_CHECKING:
+    from PIL import Image
+    from pydub import AudioSegment
+
+
+def decode_audio(data) -> AudioSegment:
+    from pydub import AudioSegment
+    with BytesIO(data) as buf:
+        # HACK: if i don't do this, it plays horribly clipped and way too loud. it's a simpleaudio bug :/
+        return AudioSegment.from_file(buf).set_sample_width(2)
+
+
+def decode_cover(data) -> Image.Image:
+    from PIL import Image
+    with BytesIO(data) as buf:
+        with Image.open(buf) as im:
+            return im.copy()
+
+
+def audio_format(data):
+    """Guess an encoded audio file's format from its signature. "ogg" is only Ogg Vorbis, Opus is "opus"."""
+    if data is None:
+        return None
+    if data[:4] == b"OggS":
+        # The first packet names the codec, right after the first page's segment table
+        start = 27 + data[26] if len(data) >= 27 else len(data)
+        if data[start:start + 7] == b"\x01vorbis":
+            return "ogg"
+        if data[start:start + 8] == b"OpusHead":
+            return "opus"
+        return None
+    if data[:3] == b"ID3" or (data[:1] == b"\xff" and data[1:2] and data[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "wav"
+    if data[:4] == b"fLaC":
+        return "flac"
+    return None
+
+
+def is_png(data):
+    return data is not None and data[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+@contextmanager
+def atomic_write(filename, mode="wb"):
+    """
+    Write to a temporary file next to filename, and only move it into place once it's complete.
+    If saving gets interrupted, the old file is left untouched.
+    """
+    path = Path(filename)
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temp, os.stat(filename).st_mode)
+        except FileNotFoundError:
+            os.chmod(temp, 0o644)
+        os.replace(temp, filename)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+class HashingWriter:
+    """Passes writes through to a file, hashing them on the way."""
+
+    def __init__(self, output, hash=None):
+        self.output = output
+        self.hash = sha1() if hash is None else hash
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.output.write(data)
+
+    def digest(self) -> bytes:
+        return self.hash.digest()
+
+
+def encode_audio(audio: AudioSegment, output, format="ogg", progress=None):
+    """Encode audio with ffmpeg, streaming its output straight into a file object."""
+    from pydub.utils import get_encoder_name
+    sample_format = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}[audio.sample_width]
+    command = [get_encoder_name(), "-y", "-loglevel", "error",
+               "-f", sample_format, "-ar", str(audio.frame_rate), "-ac", str(audio.channels), "-i", "pipe:0",
+               "-f", format, "pipe:1"]
+    with subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        # Feed ffmpeg from another thread, or both pipes can fill up and deadlock
+        def feed():
+            data = memoryview(audio.raw_data)
+            chunk_size = 1 << 20
+            try:
+                for start in range(0, len(data), chunk_size):
+                    process.stdin.write(data[start:start + chunk_size])
+                    if progress is not None:
+                        progress(min(start + chunk_size, len(data)) / len(data))
+            except BrokenPipeError:
+                pass  # ffmpeg died, reported below
+            finally:
+                process.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        while chunk := process.stdout.read(1 << 16):
+            output.write(chunk)
+        feeder.join()
+        error = process.stderr.read()
+    if process.returncode != 0:
+        raise Exception(f"Error while saving: ffmpeg couldn't encode the audio!\n{error.decode('utf-8', errors='ignore')}")
+
+
+class ByteCursor:
+    """
+    Reads little-endian values out of a buffer (bytes, memoryview or mmap) without copying it.
+    Use it as a context manager over an mmap, so the view is released before the map is closed.
+    """
+    _FORMATS = {name: struct.Struct("<" + code) for name, code in (
+        ("u8", "B"), ("u16", "H"), ("u32", "I"), ("u64", "Q"), ("i32", "i"), ("i64", "q"), ("f32", "f"), ("f64", "d")
+    )}
+
+    def __init__(self, data, start=0, end=None):
+        self.view = memoryview(data)[start:end]
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def release(self):
+        self.view.release()
+
+    def __len__(self):
+        return len(self.view)
+
+    def remaining(self):
+        return len(self.view) - self.pos
+
+    def _unpack(self, name):
+        fmt = self._FORMATS[name]
+        if self.pos + fmt.size > len(self.view):
+            raise EOFError(f"Tried to read a {name} past the end of the data!")
+        value = fmt.unpack_from(self.view, self.pos)[0]
+        self.pos += fmt.size
+        return value
+
+    def u8(self) -> int:
+        return self._unpack("u8")
+
+    def u16(self) -> int:
+        return self._unpack("u16")
+
+    def u32(self) -> int:
+        return self._unpack("u32")
+
+    def u64(self) -> int:
+        return self._unpack("u64")
+
+    def i32(self) -> int:
+        return self._unpack("i32")
+
+    def i64(self) -> int:
+        return self._unpack("i64")
+
+    def f32(self) -> float:
+        return self._unpack("f32")
+
+    def f64(self) -> float:
+        return self._unpack("f64")
+
+    def skip(self, length):
+        self.bytes(length)
+
+    def bytes(self, length) -> memoryview:
+        """A view of the next bytes. Copy it with bytes() if it needs to outlive the buffer."""
+        if self.pos + length > len(self.view):
+            raise EOFError(f"Tried to read {length} bytes with only {self.remaining()} left!")
+        out = self.view[self.pos:self.pos + length]
+        self.pos += length
+        return out
 
-def read_line(file):
-    out = bytearray(b"")
-    while (f := file.read(1)) != b"\n":
-        out.append(int.from_bytes(f, "little"))
-    return out.decode("utf-8", errors='ignore')
+    def string(self, length_size=2) -> str:
+        """A UTF-8 string, prefixed by its length in bytes."""
+        length = self.u16() if length_size == 2 else self.u32()
+        return str(self.bytes(length), "utf-8", errors="ignore")
+
+    def line(self) -> str:
+        """A UTF-8 string, terminated by a newline."""
+        # Search in small windows, since lines are short and the buffer might be a whole file
+        start = self.pos
+        while start < len(self.view):
+            newline = self.view[start:start + 256].tobytes().find(b"\n")
+            if newline != -1:
+                return str(self.bytes(start + newline + 1 - self.pos)[:-1], "utf-8", errors="ignore")
+            start += 256
+        raise EOFError("Tried to read a line past the end of the data!")
 
 
 class Level(ABC):
     def __init__(self,
                  name: str = "Unnamed",
                  authors: list[str] = [],
-                 notes: dict[int, list[tuple[int, int]]] = None,
+                 notes: NoteStore = None,
                  cover: Image.Image = None,
                  audio: AudioSegment = None,
                  difficulty: int | str = -1,
@@ -33,7 +241,12 @@ class Level(ABC):
         self.id = id if id is not None else str(uuid.uuid1())
         self.name = name
         self.authors = authors
-        self.notes = notes if notes is not None else {}
+        self.notes = notes if notes is not None else NoteStore()
+        self._cover_loader = None
+        self._audio_loader = None
+        self._cover_data = None
+        self._audio_data = None
+        self._dirty_assets = set()  # Assets changed since the level was last loaded or saved
         self.cover = cover
         self.audio = audio
         self.difficulty = difficulty
@@ -41,12 +254,101 @@ class Level(ABC):
     def __str__(self):
         return f"{self.__class__.__name__}(author: {self.authors}, cover: {self.cover}, difficulty: {self.difficulty}, id: {self.id}, name: {self.name}, notes: ({len(self.notes)} notes), level_name: {self.level_name})"
 
+    # The audio and cover can be given as loaders instead, so they're only decoded when they're used.
+    # Their original encoded bytes are kept too, so saving doesn't have to re-encode them if they haven't changed.
+    @property
+    def audio(self) -> AudioSegment:
+        if self._audio_loader is not None:
+            self._audio, self._audio_loader = self._audio_loader(), None
+        return self._audio
+
+    @audio.setter
+    def audio(self, value):
+        self._audio, self._audio_loader, self._audio_data = value, None, None
+        self._dirty_assets.add("audio")
+
+    @property
+    def audio_data(self) -> bytes:
+        """The encoded file the audio came from, or None if the audio was changed since."""
+        if callable(self._audio_data):
+            self._audio_data = self._audio_data()
+        return self._audio_data
+
+    def set_audio_data(self, data, audio: AudioSegment = None):
+        """Set the audio from an encoded file. data can also be a function that reads the file."""
+        self._audio, self._audio_data = audio, data
+        self._audio_loader = (lambda: decode_audio(self.audio_data)) if audio is None else None
+        self._dirty_assets.add("audio")
+
+    def has_audio(self):
+        return self._audio is not None or self._audio_loader is not None
+
+    @property
+    def cover(self) -> Image.Image:
+        if self._cover_loader is not None:
+            self._cover, self._cover_loader = self._cover_loader(), None
+        return self._cover
+
+    @cover.setter
+    def cover(self, value):
+        self._cover, self._cover_loader, self._cover_data = value, None, None
+        self._dirty_assets.add("cover")
+
+    @property
+    def cover_data(self) -> bytes:
+        """The encoded file the cover came from, or None if the cover was changed since."""
+        if callable(self._cover_data):
+            self._cover_data = self._cover_data()
+        return self._cover_data
+
+    def set_cover_data(self, data, cover: Image.Image = None):
+        """Set the cover from an encoded file. data can also be a function that reads the file."""
+        self._cover, self._cover_data = cover, data
+        self._cover_loader = (lambda: decode_cover(self.cover_data)) if cover is None else None
+        self._dirty_assets.add("cover")
+
+    def has_cover(self):
+        return self._cover is not None or self._cover_loader is not None
+
+    def share_assets(self, level):
+        """Use another level's audio and cover, without decoding or re-encoding them."""
+        self._audio, self._audio_loader, self._audio_data = level._audio, level._audio_loader, level._audio_data
+        self._cover, self._cover_loader, self._cover_data = level._cover, level._cover_loader, level._cover_data
+        self._dirty_assets |= {"audio", "cover"}
+
+    def link_assets(self, level):
+        """
+        Use another level's audio and cover. Whatever's still waiting to be read or decoded is shared too,
+        so it only happens once between the two. They're considered changed if they're changed in the other level.
+        """
+        # Memoize the pending loaders, and hand the same ones to both levels
+        for name in ("_audio_loader", "_audio_data", "_cover_loader", "_cover_data"):
+            value = getattr(level, name)
+            if callable(value) and not hasattr(value, "cache_info"):
+                setattr(level, name, cache(value))
+        self._audio, self._audio_loader, self._audio_data = level._audio, level._audio_loader, level._audio_data
+        self._cover, self._cover_loader, self._cover_data = level._cover, level._cover_loader, level._cover_data
+        self._dirty_assets = (self._dirty_assets - {"audio", "cover"}) | (level._dirty_assets & {"audio", "cover"})
+
+    def snapshot(self):
+        """A copy of the level that can be saved on another thread while this one keeps being edited."""
+        level = copy.copy(self)
+        level.notes = self.notes.copy()
+        level.authors = list(self.authors)
+        level._dirty_assets = set(self._dirty_assets)
+        level._snapshot_of = (self._audio, self._audio_data, self._cover, self._cover_data)
+        return level
+
+    def adopt_save(self, snapshot):
+        """Called once a snapshot of this level has been saved, to catch up on what's on disk now."""
+        pass
+
     def get_end(self):
-        times_to_display = self.get_notes()
-        return (np.max(times_to_display) if times_to_display.shape[0] > 0 else 1000)
+        end = self.notes.end()
+        return end if end is not None else 1000
 
     def get_notes(self):
-        return np.sort(np.array(tuple(self.notes.keys()), dtype=np.int32))
+        return self.notes.unique_times()
 
     @classmethod
     @abstractmethod
@@ -54,7 +356,7 @@ class Level(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def save(self, *_):
+    def save(self, *_, progress=None):
         raise NotImplementedError
 
 
@@ -72,9 +374,13 @@ def write_sspm2_variable(output, var, custom_type, arr_type=None):
     elif custom_type == 6:
         output.write(struct.pack("d", var))
     elif custom_type == 7:
-        # Position
-        output.write(b"\x01")  # eh
-        output.write(struct.pack("ff", float(var[0]), float(var[1])))
+        # Position, stored as two bytes when it's on the grid
+        x, y = float(var[0]), float(var[1])
+        if on_sspmv2_grid(x, y):
+            output.write(bytes((0, int(x), int(y))))
+        else:
+            output.write(b"\x01")
+            output.write(struct.pack("ff", x, y))
     elif custom_type == 8:
         output.write(len(var).to_bytes(2, "little"))
         output.write(var)
@@ -92,7 +398,7 @@ def write_sspm2_variable(output, var, custom_type, arr_type=None):
         arr_start = output.tell()
         output.write(len(var).to_bytes(2, "little"))
         for v in var:
-            write_sspm2_variable(output, arr_type, v)
+            write_sspm2_variable(output, v, arr_type)
         arr_end = output.tell()
         output.seek(arr_start - 4)
         output.write((arr_end - arr_start).to_bytes(4, "little"))
@@ -101,51 +407,241 @@ def write_sspm2_variable(output, var, custom_type, arr_type=None):
         raise Exception(f"Error while saving SSPMv2: Field type {hex(custom_type)} isn't defined!")
 
 
-def read_sspmv2_variable(f, custom_type=None):
+def read_sspmv2_variable(cursor: ByteCursor, custom_type=None):
     if custom_type is None:
-        custom_type = ord(f.read(1))
+        custom_type = cursor.u8()
     if custom_type == 0:
         return [None, custom_type]
     elif custom_type == 1:
-        return [ord(f.read(1)), custom_type]
+        return [cursor.u8(), custom_type]
     elif custom_type == 2:
-        return [int.from_bytes(f.read(2), "little"), custom_type]
+        return [cursor.u16(), custom_type]
     elif custom_type == 3:
-        return [int.from_bytes(f.read(4), "little"), custom_type]
+        return [cursor.u32(), custom_type]
     elif custom_type == 4:
-        return [int.from_bytes(f.read(8), "little", signed=True), custom_type]
+        return [cursor.i64(), custom_type]
     elif custom_type == 5:
-        return [struct.unpack("f", f.read(4))[0], custom_type]
+        return [cursor.f32(), custom_type]
     elif custom_type == 6:
-        return [struct.unpack("d", f.read(8))[0], custom_type]
+        return [cursor.f64(), custom_type]
     elif custom_type == 7:
         # Position
-        is_quantum = ord(f.read(1))
-        if is_quantum:
-            return [list(struct.unpack("ff", f.read(8))), custom_type]
+        if cursor.u8():
+            return [[cursor.f32(), cursor.f32()], custom_type]
         else:
-            return [list(struct.unpack("BB", f.read(2))), custom_type]
+            return [[cursor.u8(), cursor.u8()], custom_type]
     elif custom_type == 8:
-        return [f.read(int.from_bytes(f.read(2), "little")), custom_type]
+        return [bytes(cursor.bytes(cursor.u16())), custom_type]
     elif custom_type == 9:
-        return [f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore'), custom_type]
+        return [cursor.string(), custom_type]
     elif custom_type == 10:
-        return [f.read(int.from_bytes(f.read(4), "little")), custom_type]
+        return [bytes(cursor.bytes(cursor.u32())), custom_type]
     elif custom_type == 11:
-        return [f.read(int.from_bytes(f.read(4), "little")).decode("utf-8", errors='ignore'), custom_type]
+        return [cursor.string(4), custom_type]
     elif custom_type == 12:
         # Array
-        values = []
-        c_type = ord(f.read(1))
-        f.read(4)  # array bit length, don't need this
-        arr_length = int.from_bytes(f.read(2), "little")
-        for _ in arr_length:
-            values.append(read_sspmv2_variable(f, c_type)[0])
+        c_type = cursor.u8()
+        cursor.skip(4)  # array bit length, don't need this
+        values = [read_sspmv2_variable(cursor, c_type)[0] for _ in range(cursor.u16())]
         return [values, custom_type, c_type]
     else:
         raise Exception(f"Error while loading SSPMv2: Field type {hex(custom_type)} isn't defined!")
 
 
+def decode_sspmv2_markers(block, marker_amt, marker_types):
+    """
+    Decode a whole SSPMv2 marker block at once.
+    Notes are decoded in bulk with numpy, and only custom markers go through read_sspmv2_variable.
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    # Fast path: every marker is a note, and they all use the same position encoding
+    for record_size, quantum in ((14, True), (8, False)):
+        if buf.size >= record_size * marker_amt:
+            records = buf[:record_size * marker_amt].reshape(marker_amt, record_size)
+            if not np.any(records[:, 4]) and np.all((records[:, 5] != 0) == quantum):
+                return _decode_sspmv2_notes(buf, np.arange(marker_amt) * record_size), {}
+    # Otherwise, the notes are found with numpy a span of the block at a time,
+    # and only custom markers (and notes right after them, up to the next span) are read one by one
+    marker_ids = tuple(marker_types.keys())
+    advance = _sspmv2_note_advance(buf)
+    lane_stops, lane_counts = _sspmv2_note_walk(advance, _sspmv2_span_starts(buf.size))
+    lane_stops, lane_counts = lane_stops.tolist(), lane_counts.tolist()
+    runs = []  # Where each run of notes the walks went through starts
+    note_offsets = []
+    markers = {}
+    found = 0
+    pos = 0
+    steps = advance.tobytes()  # Faster to index one by one
+    with ByteCursor(block) as cursor:
+        while found < marker_amt:
+            span, start = divmod(pos, SSPMV2_WALK_SPAN)
+            if pos < buf.size and start < 14 and lane_counts[span * 14 + start]:
+                runs.append(pos)
+                found += lane_counts[span * 14 + start]
+                pos = lane_stops[span * 14 + start]
+                continue
+            if pos < buf.size and steps[pos]:
+                note_offsets.append(pos)
+                found += 1
+                pos += steps[pos]
+                continue
+            cursor.pos = pos
+            time = cursor.u32()
+            m_type = cursor.u8()
+            found += 1
+            if m_type == 0:
+                note_offsets.append(pos)
+                cursor.skip(8 if cursor.u8() else 2)
+                pos = cursor.pos
+                continue
+            marker_id = marker_ids[m_type]
+            marker = {"time": time, "fields": []}
+            for v_type in marker_types[marker_id]:
+                marker["fields"].append(read_sspmv2_variable(cursor, v_type)[0])
+            if marker_id in markers:
+                markers[marker_id].append(marker)
+            else:
+                markers[marker_id] = [marker]
+            pos = cursor.pos
+    # Walk the runs that were used again, this time keeping where each note is
+    trail = _sspmv2_note_walk(advance, np.array(runs, dtype=np.int64), keep=True)
+    offsets = np.sort(np.concatenate((trail[trail >= 0], np.array(note_offsets, dtype=np.int64))))
+    # The last run can go on past the last marker
+    return _decode_sspmv2_notes(buf, offsets[:offsets.size - max(found - marker_amt, 0)]), markers
+
+
+SSPMV2_WALK_SPAN = 512  # Bytes of the marker block each walk goes through
+
+
+def _sspmv2_note_advance(buf):
+    """How far it is from each byte of a marker block to the next record, if a note starts there, otherwise 0."""
+    size = buf.size
+    advance = np.zeros(size + SSPMV2_WALK_SPAN + 14, dtype=np.uint8)
+    if size >= 8:
+        notes = advance[:size - 7]
+        np.equal(buf[4:size - 3], 0, out=notes)
+        notes *= 8 + 6 * (buf[5:size - 2] != 0).view(np.uint8)
+        # Quantum notes cut off by the end of the block
+        tail = advance[max(size - 13, 0):size - 7]
+        tail[tail == 14] = 0
+    return advance
+
+
+def _sspmv2_span_starts(size):
+    """
+    Every byte a walk can start from: the first 14 of each span. A record is at most 14 bytes long,
+    so whatever came before, the records run into each span at one of those.
+    """
+    return (np.arange(0, size, SSPMV2_WALK_SPAN)[:, None] + np.arange(14)).ravel()
+
+
+def _sspmv2_note_walk(advance, starts, keep=False):
+    """
+    Follows note records from each of starts at once, up to the end of the span it starts in,
+    or to anything that isn't a note.
+    Returns where each walk stopped and how many notes it went through,
+    or with keep, the start of each of those notes (-1 past where a walk stopped), one walk per column.
+    """
+    pos = starts.copy()
+    ends = (starts // SSPMV2_WALK_SPAN + 1) * SSPMV2_WALK_SPAN
+    counts = np.zeros(starts.size, dtype=np.int32)
+    trail = np.full((SSPMV2_WALK_SPAN // 8 + 1, starts.size), -1, dtype=np.int64) if keep else None
+    for step in range(SSPMV2_WALK_SPAN // 8 + 1):
+        moves = advance[pos]
+        moves[pos >= ends] = 0
+        if not moves.any():
+            break
+        moving = moves > 0
+        if keep:
+            np.copyto(trail[step], pos, where=moving)
+        counts += moving
+        pos += moves
+    return trail if keep else (pos, counts)
+
+
+# A note's marker record: time, marker type (always 0), then either a quantum or a grid position
+SSPMV2_NOTE_RECORD = np.dtype([("time", "<u4"), ("type", "u1"), ("quantum", "u1"), ("x", "<f4"), ("y", "<f4")])
+SSPMV2_GRID_NOTE_RECORD = np.dtype([("time", "<u4"), ("type", "u1"), ("quantum", "u1"), ("x", "u1"), ("y", "u1")])
+
+
+def on_sspmv2_grid(x, y):
+    """Whether a position can be stored in the compact form, i.e. it lies exactly on the 3x3 grid. Works on arrays too."""
+    return (x == np.round(x)) & (y == np.round(y)) & (x >= 0) & (x <= 2) & (y >= 0) & (y <= 2)
+
+
+def encode_sspmv2_markers(notes: NoteStore, markers, marker_types) -> bytes:
+    """
+    Encode a whole SSPMv2 marker block at once.
+    Notes are packed into preallocated buffers with numpy, using the compact record for notes on the grid,
+    and custom markers are merged in by time.
+    """
+    if len(notes) and notes.times[0] < 0:
+        raise Exception("Error while saving SSPMv2: There are notes before the start of the map!")
+    type_indices = {marker_type: i for i, marker_type in enumerate(marker_types)}
+    # Custom markers are encoded one at a time, since there's usually only a few of them
+    custom_times = []
+    custom_records = []
+    for marker_type, marker_list in markers.items():
+        if marker_type == "ssp_note":
+            continue
+        var_types = marker_types[marker_type]
+        header = type_indices[marker_type].to_bytes(1, "little")
+        for marker in marker_list:
+            with BytesIO() as output:
+                output.write(int(marker["time"]).to_bytes(4, "little"))
+                output.write(header)
+                for var, var_type in zip(marker["fields"], var_types):
+                    write_sspm2_variable(output, var, var_type)
+                custom_records.append(output.getvalue())
+            custom_times.append(int(marker["time"]))
+    xs, ys = notes.data["x"], notes.data["y"]
+    grid = on_sspmv2_grid(xs, ys)
+    quantum_records = np.zeros(np.count_nonzero(~grid), dtype=SSPMV2_NOTE_RECORD)
+    quantum_records["time"] = notes.times[~grid]
+    quantum_records["quantum"] = 1
+    quantum_records["x"] = xs[~grid]
+    quantum_records["y"] = ys[~grid]
+    grid_records = np.zeros(np.count_nonzero(grid), dtype=SSPMV2_GRID_NOTE_RECORD)
+    grid_records["time"] = notes.times[grid]
+    grid_records["x"] = xs[grid]
+    grid_records["y"] = ys[grid]
+    if not custom_records:
+        if not grid_records.size:
+            return quantum_records.tobytes()
+        if not quantum_records.size:
+            return grid_records.tobytes()
+    # Merge everything by time, with custom markers first when they share a time with a note
+    times = np.concatenate((np.array(custom_times, dtype=np.int64), notes.times))
+    note_lengths = np.where(grid, SSPMV2_GRID_NOTE_RECORD.itemsize, SSPMV2_NOTE_RECORD.itemsize)
+    lengths = np.concatenate((np.array([len(record) for record in custom_records], dtype=np.int64), note_lengths))
+    order = np.argsort(times, kind="stable")
+    starts = np.empty_like(lengths)
+    starts[order] = np.cumsum(lengths[order]) - lengths[order]
+    output = np.empty(int(lengths.sum()), dtype=np.uint8)
+    note_starts = starts[len(custom_records):]
+    for records, mask in ((quantum_records, ~grid), (grid_records, grid)):
+        size = records.dtype.itemsize
+        output[note_starts[mask][:, None] + np.arange(size)] = records.view(np.uint8).reshape(-1, size)
+    for start, record in zip(starts[:len(custom_records)].tolist(), custom_records):
+        output[start:start + len(record)] = np.frombuffer(record, dtype=np.uint8)
+    return output.tobytes()
+
+
+def _decode_sspmv2_notes(buf, offsets):
+    if offsets.size and offsets[-1] + (14 if buf[offsets[-1] + 5] else 8) > buf.size:
+        raise EOFError("Error while loading SSPMv2: Marker data ended early!")
+    times = buf[offsets[:, None] + np.arange(4)].copy().view("<u4").ravel()
+    quantum = buf[offsets + 5] != 0
+    xs = np.empty(offsets.size, dtype=np.float64)
+    ys = np.empty(offsets.size, dtype=np.float64)
+    q_offsets = offsets[quantum]
+    positions = buf[q_offsets[:, None] + np.arange(6, 14)].copy().view("<f4").reshape(-1, 2)
+    xs[quantum], ys[quantum] = positions[:, 0], positions[:, 1]
+    b_offsets = offsets[~quantum]
+    xs[~quantum], ys[~quantum] = buf[b_offsets + 6], buf[b_offsets + 7]
+    return NoteStore.from_arrays(times, xs, ys, quantum)
+
+
 def repr_sspmv2_variable(var, custom_type):
     if custom_type == 0:
         return "null (?!)"
@@ -176,6 +672,95 @@ def wstr(output, string, length=2):
     output.write(string.encode("utf-8", errors='ignore'))
 
 
+class SSPMv2Reader:
+    """
+    Reads an SSPMv2 file through the offset table in its header.
+    Only the header and the strings after it are read up front, every other section is read when it's asked for.
+    """
+    SECTIONS = ("custom_data", "audio", "cover", "marker_definitions", "markers")
+
+    def __init__(self, file):
+        self.file = file
+        with open(file, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def _read_header(self):
+        with ByteCursor(self._map) as cursor:
+            assert cursor.bytes(4) == b"SS+m", "Invalid file signature! Your level might be corrupted, or in the wrong format."
+            version = cursor.u16()
+            assert version == 2, f"Expected an SSPMv2 file, got version {version}"
+            assert cursor.u32() == 0, "Reserved bits were not 0."
+            self.hash = bytes(cursor.bytes(20))
+            self.end, self.note_count, self.marker_count = cursor.u32(), cursor.u32(), cursor.u32()
+            self.difficulty = cursor.u8() - 1
+            self.rating = cursor.u16()
+            self.has_audio, self.has_cover, self.modchart = bool(cursor.u8()), bool(cursor.u8()), bool(cursor.u8())
+            # Each section is stored as an (offset, length) pair
+            self.sections = {name: (cursor.u64(), cursor.u64()) for name in self.SECTIONS}
+            cursor.pos = 128
+            self.id, self.name, self.song_name = cursor.string(), cursor.string(), cursor.string()
+            self.authors = [cursor.string() for _ in range(cursor.u16())]
+            self.strings_end = cursor.pos
+
+    def _section_cursor(self, name) -> ByteCursor:
+        offset, length = self.sections[name]
+        if offset + length > len(self._map):
+            raise EOFError(f"Error while loading SSPMv2: The {name} section goes past the end of the file!")
+        return ByteCursor(self._map, offset, offset + length)
+
+    def section(self, name) -> bytes:
+        offset, length = self.sections[name]
+        if offset + length > len(self._map):
+            raise EOFError(f"Error while loading SSPMv2: The {name} section goes past the end of the file!")
+        return self._map[offset:offset + length]
+
+    def strings(self) -> bytes:
+        """The raw ID, name, song name and authors, as stored after the header."""
+        return self._map[128:self.strings_end]
+
+    def custom_fields(self) -> dict:
+        fields = {}
+        if self.sections["custom_data"][0] == 0:
+            return fields
+        with self._section_cursor("custom_data") as cursor:
+            for _ in range(cursor.u16()):
+                custom_id = cursor.string()
+                # Arrays also keep their element type, so they can be written back
+                fields[custom_id] = tuple(read_sspmv2_variable(cursor))
+        return fields
+
+    def marker_types(self) -> dict:
+        marker_types = {}
+        with self._section_cursor("marker_definitions") as cursor:
+            for i in range(cursor.u8()):
+                # Each marker is a pseudo-struct
+                marker_id = cursor.string()
+                assert i != 0 or marker_id == "ssp_note", "Error while loading SSPMv2: First defined marker wasn't a note!"
+                marker_types[marker_id] = [cursor.u8() for _ in range(cursor.u8())]
+                cursor.skip(1)
+        return marker_types
+
+    def markers(self, marker_types=None):
+        if marker_types is None:
+            marker_types = self.marker_types()
+        return decode_sspmv2_markers(self.section("markers"), self.marker_count, marker_types)
+
+
 class SSPMLevel(Level):
     def __init__(self, *args,
                  custom_fields={
@@ -187,183 +772,188 @@ class SSPMLevel(Level):
                  },
                  song_name="Unnamed", marker_types={"ssp_note": [0x7]}, markers={}, modchart=False, rating=0, **kwargs):
         self.song_name = song_name
-        self.custom_fields = custom_fields
-        self.marker_types = marker_types
-        self.markers = markers
+        # Copy these so levels don't end up sharing the default dicts
+        self.custom_fields = dict(custom_fields)
+        self.marker_types = dict(marker_types)
+        self.markers = dict(markers)
         self.modchart = modchart
         self.rating = rating
+        self._saved = None  # What the file on disk holds, see _record_saved
         super().__init__(*args, **kwargs)
 
     @classmethod
     def load(cls, file):
         with open(file, "rb") as f:
-            assert f.read(
-                4) == b"SS+m", "Invalid file signature! Your level might be corrupted, or in the wrong format."
+            signature = f.read(4)
             version = int.from_bytes(f.read(2), "little")
-            if version == 1:
-                print("Converting map from SSPMv1...")
-                f.read(2)  # "Reserved bits aren't 0. Is this a modchart?"
-                read_line(f)
-                song_name = read_line(f)
-                song_author = read_line(f)
-                f.read(4)  # MS length, not needed
-                note_count = int.from_bytes(f.read(4), "little")
-                difficulty = int.from_bytes(f.read(1), "little") - 1
-                cover = None
-                if f.read(1) == b"\x02":
-                    data_length = int.from_bytes(f.read(8), "little")
-                    image_data = f.read(data_length)
-                    with BytesIO(image_data) as io:
-                        with Image.open(io) as im:
-                            cover = im.copy()
-                audio = None
-                if f.read(1) == b"\x01":
-                    data_length = int.from_bytes(f.read(8), "little")
-                    audio_data = f.read(data_length)
-                    with BytesIO(audio_data) as io:
-                        audio = AudioSegment.from_file(io).set_sample_width(
-                            2)  # HACK: if i don't do this, it plays horribly clipped and way too loud. it's a simpleaudio bug :/
-                notes = {}
-                for _ in range(note_count):
-                    timing = int.from_bytes(f.read(4), "little")
-                    if f.read(1) == b"\x00":
-                        x = int.from_bytes(f.read(1), "little")
-                        y = int.from_bytes(f.read(1), "little")
-                    else:
-                        x, y = struct.unpack("ff", f.read(8))  # nice
-                    if timing in notes:
-                        notes[timing].append((x, y))
-                    else:
-                        notes[timing] = [(x, y)]
-                metadata = True
-                try:
-                    assert f.read(4) == b"SSPy"
-                    bpm = struct.unpack("d", f.read(8))[0]
-                    offset = int.from_bytes(f.read(4), "little")
-                    time_signature = struct.unpack("HH", f.read(4))
-                    swing = struct.unpack("d", f.read(8))[0]
-                except (EOFError, AssertionError):
-                    metadata = False
-                return cls(song_name, [song_author], notes, cover, audio, difficulty, None), \
-                    (bpm, offset, time_signature, swing) if metadata else None
-            elif version == 2:
-                assert f.read(4) == b"\x00\x00\x00\x00", "Reserved bits were not 0."
-                f.read(20)  # skip past the hash, not needed
-                f.read(4)  # ending pos
-                f.read(4)  # num of notes
-                marker_amt = int.from_bytes(f.read(4), "little")  # num of markers
-                difficulty = int.from_bytes(f.read(1), "little") - 1
-                rating = int.from_bytes(f.read(2), "little")
-                has_audio = bool(ord(f.read(1)))
-                has_cover = bool(ord(f.read(1)))
-                modchart = bool(ord(f.read(1)))  # is modchart?
-                f.read(24)  # custom data offset/len and audio offset, dont need
-                audio_bitlen = int.from_bytes(f.read(8), "little")
-                f.read(8)  # cover offset, again don't need
-                cover_bitlen = int.from_bytes(f.read(8), "little")
-                f.read(32)
-                song_id = f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore')
-                name = f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore')
-                song_name = f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore')
-                authors = []
-                for _ in range(int.from_bytes(f.read(2), "little")):
-                    authors.append(f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore'))
-                fields = {}
-                for _ in range(int.from_bytes(f.read(2), "little")):
-                    custom_id = f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore')
-                    value, f_type = read_sspmv2_variable(f)
-                    fields[custom_id] = (value, f_type)
-                metadata = False
-                if "bpm" in fields and "offset" in fields and "time_signature_num" in fields and "time_signature_den" in fields and "swing" in fields:
-                    metadata = True
-                    bpm = fields["bpm"][0]
-                    offset = fields["offset"][0]
-                    time_signature = [fields["time_signature_num"][0], fields["time_signature_den"][0]]
-                    swing = fields["swing"][0]
-                audio = None
-                if has_audio:
-                    with BytesIO(f.read(audio_bitlen)) as buf:
-                        audio = AudioSegment.from_file(buf).set_sample_width(2)
-                cover = None
-                if has_cover:
-                    with BytesIO(f.read(cover_bitlen)) as buf:
-                        with Image.open(buf) as im:
-                            cover = im.copy()
-                marker_types = {}
-                for i in range(ord(f.read(1))):
-                    # Each marker is a pseudo-struct
-                    marker_id = f.read(int.from_bytes(f.read(2), "little")).decode("utf-8", errors='ignore')
-                    marker_types[marker_id] = []
-                    assert i != 0 or marker_id == "ssp_note", "Error while loading SSPMv2: First defined marker wasn't a note!"
-                    for _ in range(ord(f.read(1))):
-                        marker_types[marker_id].append(ord(f.read(1)))
-                    f.read(1)
-                notes = {}
-                markers = {}
-                for i in range(marker_amt):
-                    time = int.from_bytes(f.read(4), "little")
-                    m_type = ord(f.read(1))
-                    if m_type == 0:
-                        if time in notes:
-                            notes[time].append(read_sspmv2_variable(f, 7)[0])
-                        else:
-                            notes[time] = [read_sspmv2_variable(f, 7)[0]]
-                    else:
-                        marker = {"time": time, "fields": []}
-                        marker_id = tuple(marker_types.keys())[m_type]
-                        for v_type in marker_types[marker_id]:
-                            marker["fields"].append(read_sspmv2_variable(f, v_type)[0])
-                        if m_type in markers:
-                            markers[marker_id].append(marker)
-                        else:
-                            markers[marker_id] = [marker]
-
-                return cls(name, authors, notes, cover, audio, difficulty, song_id, song_name=song_name,
-                           custom_fields=fields, marker_types=marker_types, markers=markers,
-                           modchart=modchart, rating=rating), \
-                    (bpm, offset, time_signature, swing) if metadata else None
-            else:
-                raise Exception(f"Unknown version: {version}")
-
-    def save(self, filename, bpm, offset, time_signature, swing):
-        with open(filename, "wb+") as output:
-            self.custom_fields["bpm"] = bpm, 6
-            self.custom_fields["swing"] = swing, 6
-            self.custom_fields["time_signature_num"] = time_signature[0], 2
-            self.custom_fields["time_signature_den"] = time_signature[1], 2
-            self.custom_fields["offset"] = offset, 3
-            output.write(b"SS+m\x02\x00\x00\x00\x00\x00")  # File signature, version, reserved space
-            output.write(b"\x00" * 20)  # Reserve something for the hash, come back later
-            output.write(int(self.get_end()).to_bytes(4, "little"))
-            output.write(len(self.notes).to_bytes(4, "little"))
-            output.write((len(self.notes) + sum([len(m) for m in self.markers.values()])).to_bytes(4, "little"))
-            output.write((self.difficulty + 1).to_bytes(1, "little"))
-            output.write(self.rating.to_bytes(2, "little"))
-            output.write((self.audio is not None).to_bytes(1, "little"))  # bool is a subclass of int
-            output.write((self.cover is not None).to_bytes(1, "little"))
-            output.write(self.modchart.to_bytes(1, "little"))
-            cdata_loc = output.tell()
-            output.write(b"\x00" * 8)  # Reserve space for custom data len
-            output.write(b"\x00" * 8)  # Reserve space for custom data ptr
-            audio_loc = output.tell()
-            output.write(b"\x00" * 8)  # Reserve space for audio len
-            output.write(b"\x00" * 8)  # Reserve space for audio ptr
-            cover_loc = output.tell()
-            output.write(b"\x00" * 8)  # Reserve space for cover len
-            output.write(b"\x00" * 8)  # Reserve space for cover ptr
-            mkdef_loc = output.tell()
-            output.write(b"\x00" * 8)  # Reserve space for marker definitions len
-            output.write(b"\x00" * 8)  # Reserve space for marker definitions ptr
-            markr_loc = output.tell()
-            output.write(b"\x00" * 8)  # Reserve space for marker len
-            output.write(b"\x00" * 8)  # Reserve space for marker ptr
+        assert signature == b"SS+m", "Invalid file signature! Your level might be corrupted, or in the wrong format."
+        if version == 1:
+            return cls._load_v1(file)
+        elif version == 2:
+            return cls._load_v2(file)
+        else:
+            raise Exception(f"Unknown version: {version}")
+
+    @classmethod
+    def _load_v1(cls, file):
+        print("Converting map from SSPMv1...")
+        with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, ByteCursor(m) as cursor:
+            cursor.pos = 8  # Skip the signature, version and reserved bits
+            cursor.line()
+            song_name = cursor.line()
+            song_author = cursor.line()
+            cursor.skip(4)  # MS length, not needed
+            note_count = cursor.u32()
+            difficulty = cursor.u8() - 1
+            cover_data = None
+            if cursor.u8() == 2:
+                cover_data = bytes(cursor.bytes(cursor.u64()))
+            audio_data = None
+            if cursor.u8() == 1:
+                audio_data = bytes(cursor.bytes(cursor.u64()))
+            times, xs, ys, quantum = [], [], [], []
+            for _ in range(note_count):
+                times.append(cursor.u32())
+                if cursor.u8() == 0:
+                    xs.append(cursor.u8())
+                    ys.append(cursor.u8())
+                    quantum.append(False)
+                else:
+                    xs.append(cursor.f32())  # nice
+                    ys.append(cursor.f32())
+                    quantum.append(True)
+            notes = NoteStore.from_arrays(times, xs, ys, quantum)
+            metadata = None
+            try:
+                assert cursor.bytes(4) == b"SSPy"
+                metadata = cursor.f64(), cursor.u32(), (cursor.u16(), cursor.u16()), cursor.f64()
+            except (EOFError, AssertionError):
+                pass
+        level = cls(song_name, [song_author], notes, None, None, difficulty, None)
+        if cover_data is not None:
+            level.set_cover_data(cover_data)
+        if audio_data is not None:
+            level.set_audio_data(audio_data)
+        return level, metadata
+
+    @classmethod
+    def _load_v2(cls, file):
+        with SSPMv2Reader(file) as reader:
+            fields = reader.custom_fields()
+            marker_types = reader.marker_types()
+            notes, markers = reader.markers(marker_types)
+            level = cls(reader.name, reader.authors, notes, None, None, reader.difficulty, reader.id,
+                        song_name=reader.song_name, custom_fields=fields, marker_types=marker_types,
+                        markers=markers, modchart=reader.modchart, rating=reader.rating)
+            level._record_saved(file, reader.sections, reader.strings(), reader.section("custom_data"), reader.hash)
+            # The audio and cover are only read once something asks for them
+            if reader.has_audio:
+                level.set_audio_data(level._lazy_section("audio"))
+            if reader.has_cover:
+                level.set_cover_data(level._lazy_section("cover"))
+            level._dirty_assets.clear()
+        metadata = False
+        if "bpm" in fields and "offset" in fields and "time_signature_num" in fields and "time_signature_den" in fields and "swing" in fields:
+            metadata = True
+            bpm = fields["bpm"][0]
+            offset = fields["offset"][0]
+            time_signature = [fields["time_signature_num"][0], fields["time_signature_den"][0]]
+            swing = fields["swing"][0]
+        return level, (bpm, offset, time_signature, swing) if metadata else None
+
+    def _lazy_section(self, name):
+        """Get a function that reads a section from the file this level was saved to, as long as it hasn't changed."""
+        def load():
+            saved = self._saved
+            with SSPMv2Reader(saved["path"]) as reader:
+                if (reader.stat.st_size, reader.stat.st_mtime_ns) != saved["stat"]:
+                    raise Exception(f"{Path(saved['path']).name} changed on disk before its {name} could be loaded!")
+                return reader.section(name)
+
+        return load
+
+    def _record_saved(self, file, sections, strings, custom_data, hash):
+        """Remember what's in the file on disk, so the next save can tell which sections changed."""
+        stat = os.stat(file)
+        self._saved = {
+            "path": os.path.realpath(file),
+            "stat": (stat.st_size, stat.st_mtime_ns),
+            "sections": dict(sections),
+            "header": self._header_fields(),
+            "strings": strings,
+            "custom_data": custom_data,
+            "hash": hash,
+            "marker_types": copy.deepcopy(self.marker_types),
+            "markers": copy.deepcopy(self.markers),
+            "notes": (self.notes, self.notes.version)
+        }
+        self._dirty_assets.clear()
+
+    def snapshot(self):
+        level = super().snapshot()
+        level.custom_fields = copy.deepcopy(self.custom_fields)
+        level.marker_types = copy.deepcopy(self.marker_types)
+        level.markers = copy.deepcopy(self.markers)
+        if self._saved is not None and self._saved["notes"][0] is self.notes:
+            level._saved = self._saved | {"notes": (level.notes, self._saved["notes"][1])}
+        return level
+
+    def adopt_save(self, snapshot):
+        if snapshot._saved is None or snapshot._saved["notes"][0] is not snapshot.notes:
+            return
+        self._saved = snapshot._saved | {"notes": (self.notes, snapshot._saved["notes"][1])}
+        audio, audio_data, cover, cover_data = snapshot._snapshot_of
+        # Only catch up on assets that weren't changed while the snapshot was being saved
+        if self._audio is audio and self._audio_data is audio_data:
+            self._audio_data = self._lazy_section("audio") if callable(snapshot._audio_data) else snapshot._audio_data
+            self._dirty_assets.discard("audio")
+        if self._cover is cover and self._cover_data is cover_data:
+            self._cover_data = self._lazy_section("cover") if callable(snapshot._cover_data) else snapshot._cover_data
+            self._dirty_assets.discard("cover")
+
+    def _header_fields(self):
+        return self.difficulty, self.rating, self.modchart
+
+    def dirty_sections(self) -> set:
+        """Which sections of the file on disk are out of date. "metadata" covers the header and the strings after it."""
+        saved = self._saved
+        if saved is None:
+            return {"metadata", *SSPMv2Reader.SECTIONS}
+        dirty = set(self._dirty_assets)
+        if self._header_fields() != saved["header"] or self._encode_strings() != saved["strings"]:
+            dirty.add("metadata")
+        if self._encode_custom_data() != saved["custom_data"]:
+            dirty.add("custom_data")
+        if self.marker_types != saved["marker_types"]:
+            dirty.add("marker_definitions")
+        if (dirty & {"marker_definitions"} or self.markers != saved["markers"]
+                or saved["notes"][0] is not self.notes or saved["notes"][1] != self.notes.version):
+            dirty.add("markers")
+        return dirty
+
+    def _header(self, sections, has_audio, has_cover, hash=b"\x00" * 20) -> bytes:
+        marker_count = len(self.notes) + sum([len(m) for m in self.markers.values()])
+        return b"".join((
+            b"SS+m\x02\x00\x00\x00\x00\x00",  # File signature, version, reserved space
+            hash,
+            struct.pack("<IIIBHBBB", int(self.get_end()), len(self.notes), marker_count, self.difficulty + 1,
+                        self.rating, has_audio, has_cover, self.modchart),
+            # Offset and length of every section
+            struct.pack("<10Q", *chain.from_iterable(sections[name] for name in SSPMv2Reader.SECTIONS))
+        ))
+
+    def _encode_strings(self) -> bytes:
+        with BytesIO() as output:
             wstr(output, self.id)
             wstr(output, self.name)
             wstr(output, self.song_name)
             output.write(len(self.authors).to_bytes(2, "little"))
             for author in self.authors:
                 wstr(output, author)
-            cdata_ptr = output.tell()
+            return output.getvalue()
+
+    def _encode_custom_data(self) -> bytes:
+        with BytesIO() as output:
             output.write(len(self.custom_fields).to_bytes(2, "little"))
             for field in self.custom_fields:
                 wstr(output, field)
@@ -371,32 +961,10 @@ class SSPMLevel(Level):
                 field_type = field[1].to_bytes(1, "little")
                 output.write(field_type)
                 write_sspm2_variable(output, *field)
-            cdata_end = output.tell()
-            output.seek(cdata_loc)
-            output.write(cdata_ptr.to_bytes(8, "little"))
-            output.write((cdata_end - cdata_ptr).to_bytes(8, "little"))
-            output.seek(cdata_end)
-            if self.audio is not None:
-                audio_ptr = output.tell()
-                with BytesIO() as audio_buf:
-                    self.audio.export(audio_buf, "ogg")
-                    output.write(audio_buf.getvalue())
-                audio_end = output.tell()
-                output.seek(audio_loc)
-                output.write(audio_ptr.to_bytes(8, "little"))
-                output.write((audio_end - audio_ptr).to_bytes(8, "little"))
-                output.seek(audio_end)
-            if self.cover is not None:
-                cover_ptr = output.tell()
-                with BytesIO() as cover_buf:
-                    self.cover.save(cover_buf, "png")
-                    output.write(cover_buf.getvalue())
-                cover_end = output.tell()
-                output.seek(cover_loc)
-                output.write(cover_ptr.to_bytes(8, "little"))
-                output.write((cover_end - cover_ptr).to_bytes(8, "little"))
-                output.seek(cover_end)
-            mkdef_ptr = output.tell()
+            return output.getvalue()
+
+    def _encode_marker_definitions(self) -> bytes:
+        with BytesIO() as output:
             output.write(len(self.marker_types).to_bytes(1, "little"))
             for m_type in self.marker_types:
                 wstr(output, m_type)
@@ -405,99 +973,240 @@ class SSPMLevel(Level):
                 for t in m_type:
                     output.write(t.to_bytes(1, "little"))
                 output.write(b"\x00")
-            mkdef_end = output.tell()
-            output.seek(mkdef_loc)
-            output.write(mkdef_ptr.to_bytes(8, "little"))
-            output.write((mkdef_end - mkdef_ptr).to_bytes(8, "little"))
-            output.seek(mkdef_end)
-            markr_ptr = output.tell()
-            markers = self.markers.copy()
-            markers["ssp_note"] = []
-            for note in self.notes:
-                for pos in self.notes[note]:
-                    markers["ssp_note"].append({"time": note, "fields": [pos]})
-            markers_sortable = []
-            for marker_type, marker_list in markers.items():
-                for marker in marker_list:
-                    markers_sortable.append(marker | {"type": tuple(self.marker_types.keys()).index(marker_type)})
-            for marker in sorted(markers_sortable, key=lambda x: x["time"]):
-                output.write(int(marker["time"]).to_bytes(4, "little"))
-                output.write(marker["type"].to_bytes(1, "little"))
-                for i, var in enumerate(marker["fields"]):
-                    var_type = tuple(self.marker_types.values())[marker["type"]][i]
-                    write_sspm2_variable(output, var, var_type)
-            markr_end = output.tell()
-            output.seek(markr_loc)
-            output.write(markr_ptr.to_bytes(8, "little"))
-            output.write((markr_end - markr_ptr).to_bytes(8, "little"))
+            return output.getvalue()
+
+    def _encode_markers(self) -> bytes:
+        return encode_sspmv2_markers(self.notes, self.markers, self.marker_types)
+
+    def save(self, filename, bpm, offset, time_signature, swing, progress=None):
+        if progress is None:
+            progress = lambda _: None
+        self.custom_fields["bpm"] = bpm, 6
+        self.custom_fields["swing"] = swing, 6
+        self.custom_fields["time_signature_num"] = time_signature[0], 2
+        self.custom_fields["time_signature_den"] = time_signature[1], 2
+        self.custom_fields["offset"] = offset, 3
+        if self._can_save_in_place(filename):
+            dirty = self.dirty_sections()
+            if not dirty or (not dirty & {"audio", "cover"} and self._save_in_place(filename, dirty)):
+                progress(1)
+                return
+        self._save_full(filename, progress)
+        progress(1)
+
+    def _can_save_in_place(self, filename):
+        saved = self._saved
+        if saved is None or os.path.realpath(filename) != saved["path"]:
+            return False
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == saved["stat"]
+
+    def _save_in_place(self, filename, dirty) -> bool:
+        """
+        Update an existing file without touching its audio and cover.
+        New sections are written to space that isn't in use and synced to disk first, and the header is patched last,
+        so the file stays readable if this gets interrupted.
+        Returns False if the file's layout doesn't allow it.
+        """
+        sections = dict(self._saved["sections"])
+        blobs = [sections[name] for name in ("audio", "cover") if sections[name][1]]
+        if not blobs:
+            return False  # Nothing big to skip, so a full save is just as cheap
+        blob_start = min(offset for offset, _ in blobs)
+        blob_end = max(offset + length for offset, length in blobs)
+        strings = self._encode_strings()
+        custom_data = self._encode_custom_data()
+        head_end = 128 + len(strings)
+        if head_end > blob_start:
+            return False
+        tail = []
+        if head_end + len(custom_data) <= blob_start:
+            head = strings + custom_data
+            sections["custom_data"] = (head_end, len(custom_data))
+        else:
+            head = strings
+            tail.append(("custom_data", custom_data))
+        if tail or dirty & {"marker_definitions", "markers"}:
+            tail.append(("marker_definitions", self._encode_marker_definitions()))
+            tail.append(("markers", self._encode_markers()))
+        hash = self._saved["hash"]
+        with open(filename, "r+b") as output:
+            if tail:
+                # Anything past the audio and cover that the current header points to is still in use
+                in_use = [(offset, offset + length) for name, (offset, length) in self._saved["sections"].items()
+                          if offset >= blob_end]
+                tail_size = sum(len(data) for _, data in tail)
+                if not in_use or min(start for start, _ in in_use) - blob_end >= tail_size:
+                    pos = blob_end
+                else:
+                    pos = max(end for _, end in in_use)
+                output.seek(pos)
+                for name, data in tail:
+                    sections[name] = (pos, len(data))
+                    if name == "markers":
+                        hashing = HashingWriter(output)
+                        hashing.write(data)
+                        hash = hashing.digest()
+                    else:
+                        output.write(data)
+                    pos += len(data)
+                tail_end = pos
+                output.flush()
+                os.fsync(output.fileno())
+            output.seek(0)
+            # Everything new is in place, so point the header at it
+            output.write(self._header(sections, bool(sections["audio"][1]), bool(sections["cover"][1]), hash) + head)
+            if tail:
+                output.truncate(max(blob_end, tail_end))
+            output.flush()
+            os.fsync(output.fileno())
+        self._record_saved(filename, sections, strings, custom_data, hash)
+        return True
+
+    def _save_full(self, filename, progress):
+        # Read lazily loaded assets now, since they might be read from the file that's about to be overwritten
+        has_audio, audio_data = self.has_audio(), self.audio_data
+        has_cover, cover_data = self.has_cover(), self.cover_data
+        strings = self._encode_strings()
+        custom_data = self._encode_custom_data()
+        sections = {name: (0, 0) for name in SSPMv2Reader.SECTIONS}
+        with atomic_write(filename) as output:
+            output.write(b"\x00" * 128)  # Reserve space for the header, come back later
+            output.write(strings)
+            sections["custom_data"] = (output.tell(), len(custom_data))
+            output.write(custom_data)
+            progress(0.05)
+            if has_audio:
+                audio_ptr = output.tell()
+                encoded_audio = audio_format(audio_data) not in ("ogg", "mp3")
+                if encoded_audio:
+                    encode_audio(self.audio, output, "ogg", lambda p: progress(0.05 + p * 0.8))
+                else:
+                    output.write(audio_data)  # Unchanged since it was loaded, no need to re-encode it
+                sections["audio"] = (audio_ptr, output.tell() - audio_ptr)
+            progress(0.85)
+            if has_cover:
+                cover_ptr = output.tell()
+                if is_png(cover_data):
+                    output.write(cover_data)
+                else:
+                    self.cover.save(output, "png")
+                sections["cover"] = (cover_ptr, output.tell() - cover_ptr)
+            progress(0.9)
+            marker_definitions = self._encode_marker_definitions()
+            sections["marker_definitions"] = (output.tell(), len(marker_definitions))
+            output.write(marker_definitions)
+            # The header's hash is the SHA-1 of the marker section, computed as it's written
+            markers = self._encode_markers()
+            sections["markers"] = (output.tell(), len(markers))
+            hashing = HashingWriter(output)
+            hashing.write(markers)
+            output.seek(0)
+            output.write(self._header(sections, has_audio, has_cover, hashing.digest()))
+        self._record_saved(filename, sections, strings, custom_data, hashing.digest())
+        if has_audio and encoded_audio:
+            # Now that it's been encoded, later saves can copy it as-is
+            self.set_audio_data(self._lazy_section("audio"), self._audio)
+        if has_cover and not is_png(cover_data):
+            self.set_cover_data(self._lazy_section("cover"), self._cover)
+        self._dirty_assets.clear()
+
+
+def parse_raw_notes(data) -> NoteStore:
+    """
+    Parse the notes of a raw data string (everything after the ID), as x|y|time entries separated by commas.
+    Well-formed strings are converted in one go. Otherwise, invalid entries are skipped and reported together.
+    """
+    raw = np.frombuffer(data.encode("utf-8"), dtype=np.uint8)
+    separators = raw[(raw == ord(",")) | (raw == ord("|"))]
+    # Every entry has two pipes, and entries are separated by commas
+    if data and np.array_equal(separators, np.resize(np.frombuffer(b"||,", dtype=np.uint8), separators.size)) \
+            and separators.size % 3 == 2:
+        try:
+            values = np.array(data.replace("|", ",").split(","), dtype=np.float64).reshape(-1, 3)
+            if np.isfinite(values).all() and np.all(values[:, 2] == np.round(values[:, 2])):
+                return NoteStore.from_arrays(values[:, 2].astype(np.int32), values[:, 0], values[:, 1])
+        except ValueError:
+            pass
+    rows = []
+    invalid = []
+    for entry in data.split(",") if data else ():
+        try:
+            x, y, timing = entry.split("|")
+            x, y, timing = float(x), float(y), int(timing)
+            if not (np.isfinite(x) and np.isfinite(y)):
+                raise ValueError
+            rows.append((x, y, timing))
+        except ValueError:
+            invalid.append(entry)
+    if invalid:
+        shown = ", ".join(repr(entry) for entry in invalid[:10])
+        print(f"/!\\ Skipped {len(invalid)} invalid note{'s' * (len(invalid) != 1)}: {shown}{', ...' * (len(invalid) > 10)}")
+    values = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return NoteStore.from_arrays(values[:, 2].astype(np.int32), values[:, 0], values[:, 1])
+
+
+def raw_coords(values) -> np.ndarray:
+    """Coordinates as Python numbers, with whole ones as ints so they're written without a trailing .0"""
+    whole = values == np.round(values)
+    coords = values.astype(object)
+    coords[whole] = values[whole].astype(np.int64).astype(object)
+    return coords
 
 
 class RawDataLevel(Level):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    SAVE_CHUNK_SIZE = 65536  # Notes written per chunk
+
     @classmethod
     def load(cls, file):
         with open(file) as f:
-            notes = {}
             data_string = f.read()
-            for note in data_string.split(",")[1:]:
-                try:
-                    x, y, timing = note.split("|")
-                    x, y = float(x), float(y)
-                    try:
-                        notes[int(timing)].append((x, y))
-                    except KeyError:
-                        notes[int(timing)] = [(x, y)]
-                except ValueError:
-                    print(f"/!\\ Invalid note! {note}")
-            return cls(notes=notes), None
-
-    def save(self, filename, *_):
-        with open(filename, "w+") as f:
-            output = []
-            for timing, notes in dict(sorted(self.notes.items())).items():
-                for note in notes:
-                    x = 2 - note[0]
-                    y = 2 - note[1]
-                    x = int(x) if int(x) == x else x
-                    y = int(y) if int(y) == y else y
-                    output.append(f"{2 - x}|{2 - y}|{timing}")
-            f.write(self.id + "," + ",".join(output))
+        return cls(notes=parse_raw_notes(data_string.split(",", 1)[1] if "," in data_string else "")), None
+
+    def save(self, filename, *_, progress=None):
+        with atomic_write(filename, "w") as f:
+            f.write(self.id + ",")
+            count = len(self.notes)
+            for start in range(0, count, self.SAVE_CHUNK_SIZE):
+                chunk = self.notes.data[start:start + self.SAVE_CHUNK_SIZE]
+                if start:
+                    f.write(",")
+                f.write(",".join(map(
+                    "{}|{}|{}".format, raw_coords(chunk["x"]), raw_coords(chunk["y"]), chunk["time"].tolist()
+                )))
+                if progress is not None:
+                    progress(min(start + self.SAVE_CHUNK_SIZE, count) / count)
 
 
 class VulnusLevel(Level):
     def __init__(self, *args, **kwargs):
+        self._saved = None  # Which folder the map's files are in, see _record_saved
         super().__init__(*args, **kwargs)
 
     @classmethod
     def load(cls, file):
-        assert Path("meta.json").exists(), "Metadata file not found!"
-        with open("meta.json", "r") as meta:
+        directory = Path(file).parent
+        assert (directory / "meta.json").exists(), "Metadata file not found!"
+        with open(directory / "meta.json", "r") as meta:
             m_data = json.load(meta)  # Raises json.JSONDecodeError, caught outside
         try:
             assert m_data["_version"] == 1, "Unsupported version!"
             song_name = f'{m_data["_artist"]} - {m_data["_title"]}'
-            audio = AudioSegment.from_file(m_data["_music"])
-            cover = [Path(name).name for name in glob.glob("./cover*")]
-            if len(cover):
-                assert len(cover) < 2, "Multiple covers found! (?????)"
-                with open(cover[0], "rb") as im:
-                    with Image.open(im) as i:
-                        cover = i.copy()
-            else:
-                cover = None
+            music = m_data.get("_music")  # Maps saved without audio don't have any
+            assert music is None or (directory / music).exists(), f"Music file {music} not found!"
+            covers = [path.name for path in directory.glob("cover*")]
+            assert len(covers) < 2, "Multiple covers found! (?????)"
             with open(file, "r") as m:
                 level = json.load(m)
             difficulty = level["_name"]
-            notes = {}
-            for note in level["_notes"]:
-                timing = int(note["_time"] * 1000)
-                position = (1 - note["_x"], note["_y"] + 1)
-                if timing in notes:
-                    notes[timing].append(position)
-                else:
-                    notes[timing] = [position]
+            values = np.array(list(map(itemgetter("_time", "_x", "_y"), level["_notes"])), dtype=np.float64).reshape(-1, 3)
+            notes = NoteStore.from_arrays(np.round(values[:, 0] * 1000), 1 - values[:, 1], values[:, 2] + 1)
             metadata = "_sspy" in m_data
             if metadata:
                 bpm = m_data["_sspy"]["bpm"]
@@ -506,40 +1215,195 @@ class VulnusLevel(Level):
                 swing = m_data["_sspy"]["swing"]
         except KeyError as e:
             raise KeyError(f"Error while loading: JSON key {e} not found!")
-        return cls(song_name, m_data["_mappers"], notes, cover, audio, difficulty), (
-            bpm, offset, time_signature, swing) if metadata else None
+        level = cls(song_name, m_data["_mappers"], notes, None, None, difficulty)
+        # The audio and cover are only read once something asks for them
+        if music is not None:
+            level.set_audio_data((directory / music).read_bytes)
+        if covers:
+            level.set_cover_data((directory / covers[0]).read_bytes)
+        level._record_saved(directory)
+        return level, (bpm, offset, time_signature, swing) if metadata else None
 
-    def save(self, filename, bpm, offset, time_signature, swing):
-        if self.audio is not None:
-            print("Exporting audio...")
-            with open("audio.wav", "wb+") as f:
-                self.audio.export(f, format="wav")
-        print("Exporting metadata...")
+    def _record_saved(self, directory):
+        """Remember which folder holds the audio and cover, so the next save into it can skip them."""
+        self._saved = os.path.realpath(directory)
+        self._dirty_assets.clear()
+
+    def adopt_save(self, snapshot):
+        self._saved = snapshot._saved
+        audio, audio_data, cover, cover_data = snapshot._snapshot_of
+        # Only catch up on assets that weren't changed while the snapshot was being saved
+        if self._audio is audio and self._audio_data is audio_data:
+            self._audio_data = snapshot._audio_data
+            self._dirty_assets.discard("audio")
+        if self._cover is cover and self._cover_data is cover_data:
+            self._cover_data = snapshot._cover_data
+            self._dirty_assets.discard("cover")
+
+    def save(self, filename, bpm, offset, time_signature, swing, progress=None):
+        if progress is None:
+            progress = lambda _: None
+        directory = Path(filename).parent
+        same_place = self._saved == os.path.realpath(directory)
         try:  # Load an existing metadata file
-            with open("meta.json", "r") as f:
-                metadata = json.load(f)
-            metadata["_difficulties"].append(f"{filename}.json")
+            with open(directory / "meta.json", "r") as f:
+                old_metadata = json.load(f)
         except FileNotFoundError:
-            metadata = {"_difficulties": [f"{filename}.json"]}
-        metadata_temp = {"_artist": (self.name.split(" - "))[0], "_title": (self.name.split(" - "))[1],
-                         "_mappers": self.authors, "_music": "audio.wav", "_version": 1, "_sspy": {
+            old_metadata = {}
+        # Other difficulties might have changed the music since this one was loaded, so go by what's on disk
+        music = old_metadata.get("_music") if same_place else None
+        if self.has_audio() and (not same_place or "audio" in self._dirty_assets):
+            print("Exporting audio...")
+            music = self._save_audio(directory, music, progress)
+        progress(0.8)
+        if not same_place or "cover" in self._dirty_assets:
+            print("Exporting cover...")
+            self._save_cover(directory)
+        progress(0.9)
+        artist, _, title = self.name.partition(" - ")
+        metadata = old_metadata | {"_artist": artist, "_title": title, "_mappers": self.authors, "_version": 1, "_sspy": {
             "bpm": bpm,
-            "time_signature": time_signature,
+            "time_signature": list(time_signature),
             "offset": offset,
             "swing": swing
         }}
-        metadata |= metadata_temp
-        with open("meta.json", "w+") as m:
-            json.dump(metadata, m)
-        if self.cover is not None:
-            print("Exporting cover...")
-            for path in glob.glob("./cover*"):
-                os.remove(path)
-            self.cover.save("cover.png")
+        if music is not None:
+            metadata["_music"] = music
+        difficulties = metadata.get("_difficulties", [])
+        if Path(filename).name not in difficulties:
+            metadata["_difficulties"] = difficulties + [Path(filename).name]
+        if metadata != old_metadata:
+            print("Exporting metadata...")
+            with atomic_write(directory / "meta.json", "w") as m:
+                json.dump(metadata, m)
         print("Exporting notes...")
-        level = {"_notes": [], "_name": self.difficulty}
-        for time in self.notes:
-            for note in self.notes[time]:
-                level["_notes"].append({"_time": time / 1000, "_x": 1 - note[0], "_y": note[1] - 1})
-        with open(f"{filename}", "w+") as level_file:
-            json.dump(level, level_file)
+        times = (self.notes.times / 1000).tolist()
+        xs = (1 - self.notes.data["x"]).tolist()
+        ys = (self.notes.data["y"] - 1).tolist()
+        level = {"_notes": [{"_time": time, "_x": x, "_y": y} for time, x, y in zip(times, xs, ys)],
+                 "_name": self.difficulty}
+        with atomic_write(filename, "w") as level_file:
+            level_file.write(json.dumps(level))
+        self._record_saved(directory)
+
+    def _save_audio(self, directory, old_music, progress):
+        """Write the audio next to the map, copying the original file if it's unchanged. Returns its file name."""
+        data = self.audio_data
+        format = audio_format(data)
+        if format in ("ogg", "mp3", "wav"):
+            music = f"audio.{format}"
+            with atomic_write(directory / music) as f:
+                f.write(data)
+        else:
+            music = "audio.ogg"
+            with atomic_write(directory / music) as f:
+                encode_audio(self.audio, f, "ogg", lambda p: progress(p * 0.8))
+            # Now that it's been encoded, later saves can copy it as-is
+            self.set_audio_data((directory / music).read_bytes, self._audio)
+        if old_music is not None and old_music != music:
+            (directory / old_music).unlink(missing_ok=True)
+        return music
+
+    def _save_cover(self, directory):
+        """Write the cover next to the map, replacing any old one. Other covers are kept unless this one was removed."""
+        data = self.cover_data
+        cover = None
+        if self.has_cover():
+            cover = "cover.png"
+            with atomic_write(directory / cover) as f:
+                if is_png(data):
+                    f.write(data)
+                else:
+                    self.cover.save(f, "png")
+            if not is_png(data):
+                self.set_cover_data((directory / cover).read_bytes, self._cover)
+        if cover is None and (self._saved is None or "cover" not in self._dirty_assets):
+            return  # It wasn't removed since loading, so any cover there belongs to the other difficulties
+        for path in directory.glob("cover*"):
+            if path.name != cover:
+                path.unlink()
+
+
+class VulnusMapSet:
+    """
+    Every difficulty of a Vulnus map, as listed in its meta.json.
+    The difficulties share one audio and cover, so they're only decoded once.
+    """
+
+    def __init__(self, directory, levels: dict[str, VulnusLevel]):
+        self.directory = Path(directory)
+        self.levels = levels  # File name -> level
+
+    @classmethod
+    def load(cls, file):
+        """Load the map set that a difficulty file belongs to."""
+        directory = Path(file).parent
+        assert (directory / "meta.json").exists(), "Metadata file not found!"
+        with open(directory / "meta.json", "r") as meta:
+            names = list(dict.fromkeys(json.load(meta).get("_difficulties", [])))
+        if Path(file).name not in names:
+            names.append(Path(file).name)
+        levels = {}
+        metadata = None
+        for name in names:
+            if not (directory / name).exists():
+                print(f"/!\\ Difficulty {name} wasn't found, skipping it")
+                continue
+            level, level_metadata = VulnusLevel.load(directory / name)
+            if levels:
+                level.link_assets(next(iter(levels.values())))
+            levels[name] = level
+            if name == Path(file).name or metadata is None:
+                metadata = level_metadata
+        return cls(directory, levels), metadata
+
+    def name_of(self, level):
+        for name, other in self.levels.items():
+            if other is level:
+                return name
+        return None
+
+    def add(self, name, level):
+        """Add a new difficulty, using the same audio and cover as the others."""
+        if self.levels:
+            first = next(iter(self.levels.values()))
+            level.link_assets(first)
+            level._saved = first._saved  # They're already next to the map
+        self.levels[name] = level
+
+    def place(self, level, file) -> bool:
+        """
+        Keep track of a difficulty being saved as file, in case it was renamed.
+        Returns False if it's being saved outside of this map set's folder.
+        """
+        if os.path.realpath(Path(file).parent) != os.path.realpath(self.directory):
+            return False
+        name = self.name_of(level)
+        if name != Path(file).name:
+            self.levels.pop(name, None)
+            self.levels[Path(file).name] = level
+        return True
+
+
+FORMATS: tuple = (SSPMLevel, RawDataLevel, VulnusLevel)
+FORMAT_NAMES: tuple = ("SS+ Map", "Raw Data", "Vulnus Map")
+FORMAT_EXTS: tuple = ("*.sspm", "*.txt", "*.json")
+DIFFICULTIES: tuple = ("Unspecified", "Easy", "Medium", "Hard", "LOGIC?", "Tasukete")
+
+
+def format_of(filename):
+    """The level class for a file, going by its extension, or None if it isn't a level."""
+    suffix = Path(filename).suffix.lower()
+    for level_class, extension in zip(FORMATS, FORMAT_EXTS):
+        if extension == f"*{suffix}":
+            return level_class
+    return None
+
+
+def convert_difficulty(difficulty, level_class):
+    """Vulnus names its difficulties, while the other formats number them. Convert one to what level_class uses."""
+    if level_class is VulnusLevel:
+        return DIFFICULTIES[difficulty + 1] if isinstance(difficulty, int) else difficulty
+    if isinstance(difficulty, str):
+        return DIFFICULTIES.index(difficulty) - 1 if difficulty in DIFFICULTIES else -1
+    return difficulty
@@ -0,0 +1,163 @@
+"""
+An index of every map in a set of folders, kept in an SQLite database next to the editor.
+Only the headers of maps are read, so even large folders are quick to index, and rescans only read maps that changed.
+This doesn't import anything from the editor, so it can be used from scripts too.
+"""
+import contextlib
+import mmap
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.level import ByteCursor, SSPMv2Reader
+
+# Bump this when the maps table changes, so old databases get reindexed instead of misread
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS maps (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT,
+    song_name TEXT,
+    mappers TEXT,
+    difficulty INTEGER,
+    notes INTEGER,
+    length INTEGER,
+    bpm REAL,
+    error TEXT
+);
+"""
+COLUMNS = ("path", "name", "song_name", "mappers", "difficulty", "notes", "length", "bpm")
+
+
+def read_map_info(path) -> dict:
+    """Read what the library shows about a map from its header, without touching its audio or cover."""
+    with open(path, "rb") as f:
+        signature = f.read(4)
+        version = int.from_bytes(f.read(2), "little")
+    assert signature == b"SS+m", "Invalid file signature!"
+    if version == 2:
+        with SSPMv2Reader(path) as reader:
+            bpm = reader.custom_fields().get("bpm", (None,))[0]
+            return {
+                "name": reader.name, "song_name": reader.song_name, "mappers": reader.authors,
+                "difficulty": reader.difficulty, "notes": reader.note_count, "length": reader.end,
+                "bpm": bpm if isinstance(bpm, (int, float)) else None
+            }
+    elif version == 1:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, ByteCursor(m) as cursor:
+            cursor.pos = 8  # Skip the signature, version and reserved bits
+            cursor.line()
+            song_name = cursor.line()
+            song_author = cursor.line()
+            length = cursor.u32()
+            note_count = cursor.u32()
+            difficulty = cursor.u8() - 1
+        # SSPMv1 has no separate level name or BPM
+        return {
+            "name": song_name, "song_name": song_name, "mappers": [song_author],
+            "difficulty": difficulty, "notes": note_count, "length": length, "bpm": None
+        }
+    raise Exception(f"Unknown version: {version}")
+
+
+def _index_row(path):
+    """Read a map for the index. Runs in a worker process, so errors are sent back as text."""
+    try:
+        info = read_map_info(path)
+    except Exception as e:
+        return None, f"{e.__class__.__name__}: {e}"
+    return info, None
+
+
+class Library:
+    """
+    The maps in some folders, as stored in an SQLite database.
+    Each call opens its own connection, so a scan can run on another thread while the editor searches.
+    """
+
+    def __init__(self, database):
+        self.database = str(database)
+        with self._connection() as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                db.execute("DROP TABLE IF EXISTS maps")
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connection(self):
+        db = sqlite3.connect(self.database, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def folders(self) -> list:
+        with self._connection() as db:
+            return [path for path, in db.execute("SELECT path FROM folders ORDER BY path")]
+
+    def add_folder(self, folder):
+        with self._connection() as db:
+            db.execute("INSERT OR IGNORE INTO folders VALUES (?)", (os.path.realpath(folder),))
+
+    def remove_folder(self, folder):
+        """Stop indexing a folder. Its maps are dropped on the next scan."""
+        with self._connection() as db:
+            db.execute("DELETE FROM folders WHERE path = ?", (os.path.realpath(folder),))
+
+    def scan(self, progress=None, workers=None) -> tuple:
+        """
+        Bring the index up to date with the folders, reading only maps that are new or whose size or mtime changed.
+        Returns how many maps were read and how many were dropped.
+        """
+        with self._connection() as db:
+            known = {path: (mtime, size) for path, mtime, size in db.execute("SELECT path, mtime_ns, size FROM maps")}
+        found = {}
+        for folder in self.folders():
+            for path in Path(folder).rglob("*.sspm"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                found[os.path.realpath(path)] = (stat.st_mtime_ns, stat.st_size)
+        stale = [path for path, key in found.items() if known.get(path) != key]
+        removed = [(path,) for path in known if path not in found]
+        rows = []
+        if stale:
+            with ProcessPoolExecutor(workers) as pool:
+                results = pool.map(_index_row, stale, chunksize=max(1, min(64, len(stale) // 32)))
+                for i, (path, (info, error)) in enumerate(zip(stale, results)):
+                    mtime, size = found[path]
+                    if info is None:
+                        rows.append((path, mtime, size, None, None, None, None, None, None, None, error))
+                    else:
+                        rows.append((path, mtime, size, info["name"], info["song_name"], ", ".join(info["mappers"]),
+                                     info["difficulty"], info["notes"], info["length"], info["bpm"], None))
+                    if progress is not None:
+                        progress((i + 1) / len(stale))
+        with self._connection() as db:
+            db.executemany("DELETE FROM maps WHERE path = ?", removed)
+            db.executemany("INSERT OR REPLACE INTO maps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(stale), len(removed)
+
+    def search(self, text="", limit=500) -> list:
+        """Maps whose name, song, mappers or path contain every word of the text, as dicts."""
+        query = f"SELECT {', '.join(COLUMNS)} FROM maps WHERE error IS NULL"
+        args = []
+        for word in text.split():
+            pattern = "%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            query += " AND (" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in
+                                            ("name", "song_name", "mappers", "path")) + ")"
+            args += [pattern] * 4
+        query += " ORDER BY name COLLATE NOCASE, path LIMIT ?"
+        with self._connection() as db:
+            return [dict(zip(COLUMNS, row)) for row in db.execute(query, (*args, limit))]
+
+    def counts(self) -> tuple:
+        """How many maps are indexed, and how many of those couldn't be read."""
+        with self._connection() as db:
+            return db.execute("SELECT COUNT(*), COUNT(error) FROM maps").fetchone()
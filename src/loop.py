@@ -1,48 +1,53 @@
 import base64
 import binascii
 import colorsys
-import ctypes
+import glob
 import hashlib
 import http.client
+import json
 import math
+import os
 import sys
+import threading
 import time
 import traceback
 import webbrowser
+from functools import cache
 from more_itertools import locate
+from pathlib import Path
 from tkinter import filedialog
 from ctypes import POINTER, c_int
 
 import OpenGL.GL as GL
 import imgui
+import numpy as np
 import pydub.exceptions
 import sdl2
+from PIL import Image
+from pydub import AudioSegment
 from pydub.exceptions import TooManyMissingFrames
 from pydub.playback import _play_with_simpleaudio
 from pypresence import Presence
-from scipy.interpolate import \
-    CubicSpline  # NOTE:  god i wish scipy had partial downloads like "scipy[interpolate]" like i don't need all of math to make. a spline
 
+import src.beats as beats
 from src.level import *  # this is fine, i know what's there
+from src.library import Library
+from src.notefield import NoteFieldRenderer
+from src.notes import NoteWindow
+from src.profiling import FrameProfiler
+from src.replay import LiveInput, level_hash, replay_profile
+from src.view import LevelView
 from src.timings import import_timings
 
 # Initialize constants
 
 SCRIPT_DIR = str(Path(__file__).resolve().parent.parent)
 
-FORMATS: tuple = (SSPMLevel, RawDataLevel, VulnusLevel)
-FORMAT_NAMES: tuple = ("SS+ Map", "Raw Data", "Vulnus Map")
 TIMING_GAMES = (
     "*.adofai",
     "*.osu",
     "*.chart"
 )
-FORMAT_EXTS: tuple = ("*.sspm", "*.txt", "*.json")
-DIFFICULTIES: tuple = ("Unspecified", "Easy", "Medium", "Hard", "LOGIC?", "Tasukete")
-HITSOUND = AudioSegment.from_file(f"{SCRIPT_DIR + os.sep}assets{os.sep}hit.wav").set_sample_width(2)
-MISSSOUND = AudioSegment.from_file(f"{SCRIPT_DIR + os.sep}assets{os.sep}miss.wav").set_sample_width(2)
-METRONOME_M = AudioSegment.from_file(f"{SCRIPT_DIR + os.sep}assets{os.sep}metronome_measure.wav").set_sample_width(2)
-METRONOME_B = AudioSegment.from_file(f"{SCRIPT_DIR + os.sep}assets{os.sep}metronome_beat.wav").set_sample_width(2)
 VAR_TYPES = ["8-bit Unsigned Integer",
              "16-bit Unsigned Integer",
              "32-bit Unsigned Integer",
@@ -73,30 +78,69 @@ class DummyRPC:
         pass
 
 
-class DelayedRect:
-    def __init__(self, box: tuple[int, int, int, int], color: int, filled: bool = True, thickness: float = 1):
-        self.box = box
-        self.color = color
-        self.filled = filled
-        self.thickness = thickness
+class BackgroundSave:
+    """
+    Saves a snapshot of a level on a worker thread, so the editor doesn't freeze while it's written.
+    """
 
-    def draw(self, draw_list):
-        if self.filled:
-            draw_list.add_rect_filled(*self.box, self.color)
-        else:
-            draw_list.add_rect(*self.box, self.color, self.thickness)
+    def __init__(self, level, filename, *metadata):
+        self.level = level
+        self.snapshot = level.snapshot()
+        self.filename = filename
+        self.progress = 0
+        self.error = None
+        self.done = False
+        self.edited = False  # Whether the level was edited after the snapshot was taken
+        # Not a daemon, so quitting mid-save still lets it finish
+        self.thread = threading.Thread(target=self._run, args=metadata, name="SSPy save")
+        self.thread.start()
+
+    def _run(self, *metadata):
+        try:
+            self.snapshot.save(self.filename, *metadata, progress=self._set_progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+
+    def _set_progress(self, progress):
+        self.progress = progress
+
+    def finish(self):
+        """Call from the main thread once the save is done."""
+        self.thread.join()
+        if self.error is None:
+            self.level.adopt_save(self.snapshot)
+
+
+class LibraryScan:
+    """
+    Brings the map library up to date on a worker thread, so indexing a big folder doesn't freeze the editor.
+    """
+
+    def __init__(self, library):
+        self.progress = 0
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread(target=self._run, args=(library,), name="SSPy library scan", daemon=True)
+        self.thread.start()
+
+    def _run(self, library):
+        try:
+            library.scan(progress=self._set_progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+
+    def _set_progress(self, progress):
+        self.progress = progress
 
 
-def spline(nodes, count):
-    nodes = [(key, *value) for key, value in sorted(nodes.items())]
-    nodes = np.array(nodes, dtype=np.float64)
-    notes = {}
-    start = min(nodes[:, 0])
-    end = max(nodes[:, 0])
-    cs = CubicSpline(nodes[:, 0], nodes[:, 1:])
-    for time in np.linspace(start, end, count):
-        notes[time] = cs(time)
-    return notes
+@cache
+def sound(name) -> AudioSegment:
+    """One of the sounds in the assets folder, decoded the first time it's played."""
+    return AudioSegment.from_file(f"{SCRIPT_DIR + os.sep}assets{os.sep}{name}.wav").set_sample_width(2)
 
 
 def play_at_position(audio, position):
@@ -127,61 +171,62 @@ def get_time_color():
     return 0xFF000000 | (int(r * 255) << 16) | (int(g * 255) << 8) | int(b * 255)
 
 
-class Editor:
+def phase_color(index):
+    """A color for each phase in the frame time graph, spread around the hue wheel so neighbours stand apart."""
+    r, g, b = colorsys.hsv_to_rgb((index * 0.618034) % 1, .6, 1)
+    return 0xFF000000 | (int(b * 255) << 16) | (int(g * 255) << 8) | int(r * 255)
+
+
+class Editor(LevelView):
+    uses_textures = True
+
     def __init__(self):
-        self.displayed_markers = []
+        super().__init__()
         self.adding_marker_type = ""
         self.adding_field = ""
-        self.background_size = (0, 0)
-        self.times_to_display = None
-        self.notes_changed = False
+        self.adding_difficulty = ""
         self.starting_position = None
         self.starting_time = None
         self.GITHUB_ICON_ID = None
         self.COVER_ID = None
         self.NO_COVER = None
-        self.BACKGROUND = None
         self.menu_choice = None
         self.hitsounds = True
-        self.bpm_markers = True
         self.io = None
-        self.bpm = 120
-        self.offset = 0
-        self.approach_rate = 1100
-        self.approach_distance = 30
         self.snapping = None
         self.level_window_size = (200, 200)
         self.filename = None
         self.temp_filename = None
         self.files = None
-        self.preview_mode = False
         self.file_choice = -1
         self.current_folder = str(Path.home())
-        self.level = None
-        self.time = 0
+        self.map_set = None  # Every difficulty of the open Vulnus map
+        self.unsaved_difficulties = set()  # Other difficulties in the map set with unsaved changes
         self.playing = False
-        self.changed_since_save = False
+        self._changed_since_save = False
         self.playback = None
-        self.time_signature = (4, 4)
-        self.beat_divisor = 4
         self.note_snapping = 3, 3
-        self.draw_notes = True
-        self.draw_audio = False
         self.fps_cap = 100
         self.vsync = False
-        self.rects_drawn = 0
-        self.rounding = 0
         self.volume = 0
-        self.waveform_res = 4
-        self.timeline_height = 50
         self.hitsound_offset = 0
         self.metronome = False
-        self.cursor = True
         self.colors = []
-        self.camera_pos = [0, 0]
-        self.parallax = 0
-        self.timings = np.array((), dtype=np.int64)
         self.time_since_last_change = time.time()
+        self.save_job = None
+        self.library = None
+        self.library_folders = []
+        self.library_scan = None
+        self.library_query = ""
+        self.library_results = None
+        self.library_status = ""
+        self.input = LiveInput()  # Swapped out to record or replay a session
+        self.profiler = FrameProfiler()
+        self.profiler_frames = 120
+        self.textures = {}  # Texture ids given out by upload_image, by name
+        self.gpu_notes = True
+        self.note_renderer = None
+        self.startup_file = None
         # Read colors from file
         if os.path.exists(f"{SCRIPT_DIR + os.sep}colors.txt"):
             with open(f"{SCRIPT_DIR + os.sep}colors.txt", "r") as f:
@@ -197,12 +242,9 @@ class Editor:
             with open(f"{SCRIPT_DIR + os.sep}colors.txt", "w") as f:
                 f.write("#FFFFFFFF")
             self.colors = [0xFFFFFFFF]
-        self.swing = 0.5
         self.hitsound_panning = 1.0
-        self.vis_map_size = 3
         self.audio_speed = 1
         self.error = None
-        self.playtesting = False
         self.sensitivity = 2.0
         self.unique_label_counter = 0
         self.RPC = Presence(1032430090505703486)
@@ -223,14 +265,6 @@ class Editor:
         })
         return sound_with_altered_frame_rate.set_frame_rate(sound.frame_rate)
 
-    def adjust_swing(self, beat):
-        b = (beat % 2)
-        s = self.swing
-        if b < (2 * s):
-            return (beat - b) + (((2 - 2 * s) / (2 * s)) * b)
-        else:
-            return (beat - b) + (((2 * s) / (2 - 2 * s)) * (b - 2 * s) + 2 - 2 * s)
-
     def display_marker_type(self, index, name, types, readonly=False):
         any_changed = False
         if not isinstance(types, list):
@@ -374,9 +408,9 @@ class Editor:
             changed, value = self.open_file_dialog(
                 {"Image": "*.png *.jpg *.bmp *.gif *.webp"})
             if changed:
-                with Image.open(value) as im:
-                    self.level.cover = im.copy()
-                    self.create_image(self.level.cover, self.COVER_ID)
+                cover_data = Path(value).read_bytes()
+                self.level.set_cover_data(cover_data, decode_cover(cover_data))
+                self.create_image(self.level.cover, self.COVER_ID)
                 self.changed_since_save = True
                 self.time_since_last_change = time.time()
         if imgui.is_item_hovered():
@@ -445,6 +479,25 @@ class Editor:
         """Display the edit menu for Vulnus levels."""
         if isinstance(self.level.difficulty, int):
             self.level.difficulty = DIFFICULTIES[self.level.difficulty + 1]
+        if self.map_set is not None:
+            names = list(self.map_set.levels)
+            current = names.index(self.map_set.name_of(self.level))
+            labels = [f"*{name}" if name in self.unsaved_difficulties else name for name in names]
+            changed, value = imgui.combo("Difficulty File", current, labels)
+            if changed and value != current:
+                self.switch_difficulty(names[value])
+            changed, value = imgui.input_text("Add##add-difficulty", self.adding_difficulty, 128)
+            if changed:
+                self.adding_difficulty = value
+            imgui.same_line()
+            if imgui.button("+##add-difficulty", 26, 26) and self.adding_difficulty != "":
+                name = Path(self.adding_difficulty).stem + ".json"
+                if name not in self.map_set.levels:
+                    self.map_set.add(name, VulnusLevel(self.level.name, list(self.level.authors),
+                                                       difficulty=Path(name).stem))
+                    self.switch_difficulty(name)
+                    self.changed_since_save = True
+                self.adding_difficulty = ""
         changed, value = imgui.input_text("Difficulty", self.level.difficulty, 128)
         if changed:
             self.level.difficulty = value
@@ -475,9 +528,9 @@ class Editor:
             changed, value = self.open_file_dialog(
                 {"Image": "*.png *.jpg *.bmp *.gif *.webp"})
             if changed:
-                with Image.open(value) as im:
-                    self.level.cover = im.copy()
-                    self.create_image(self.level.cover, self.COVER_ID)
+                cover_data = Path(value).read_bytes()
+                self.level.set_cover_data(cover_data, decode_cover(cover_data))
+                self.create_image(self.level.cover, self.COVER_ID)
                 self.changed_since_save = True
                 self.time_since_last_change = time.time()
         if imgui.is_item_hovered():
@@ -489,15 +542,15 @@ class Editor:
             self.changed_since_save = True
 
     def open_file_dialog(self, extensions: dict[str, str]):
-        v = filedialog.askopenfilename(title="Open a file",
-                                       initialdir=self.current_folder,
-                                       filetypes=tuple(extensions.items()))
+        v = self.input.dialog(lambda: filedialog.askopenfilename(title="Open a file",
+                                                                 initialdir=self.current_folder,
+                                                                 filetypes=tuple(extensions.items())))
         return bool(len(v)), v
 
     def save_file_dialog(self, suffix):
-        v = filedialog.asksaveasfilename(title="Save a file",
-                                         initialdir=self.current_folder,
-                                         filetypes=tuple(suffix.items()))
+        v = self.input.dialog(lambda: filedialog.asksaveasfilename(title="Save a file",
+                                                                   initialdir=self.current_folder,
+                                                                   filetypes=tuple(suffix.items())))
         return bool(len(v)), v
 
     def keys(self):
@@ -540,23 +593,233 @@ class Editor:
         return tex_id  # NOTE: returning it makes things easier
 
     def snap_time(self):
-        ms_per_beat = (60000 / self.bpm) * (4 / self.time_signature[1])
-        step = (ms_per_beat) / self.beat_divisor
-        self.time = int((round(self.time / step) * (step)) - ((ms_per_beat - self.offset) % ms_per_beat))
+        self.time = beats.snap_time(self.time, self.bpm, self.offset, self.time_signature, self.beat_divisor)
 
-    def load_file(self, filename):
-        if Path(filename).suffix == ".sspm":
-            level_class = SSPMLevel
-        elif Path(filename).suffix == ".txt":
-            level_class = RawDataLevel
-        elif Path(filename).suffix == ".json":
-            level_class = VulnusLevel
+    def render_notes(self, instances, box, x, y, w, h) -> int:
+        if self.note_renderer is None:
+            self.note_renderer = NoteFieldRenderer()
+        return self.note_renderer.render(instances, box, x, y, w, h, self)
+
+    def upload_image(self, name, image) -> int:
+        texture = self.textures.get(name)
+        if texture is None:
+            texture = self.textures[name] = int(GL.glGenTextures(1))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        # Nearest, so the bars stay sharp
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, image.shape[1], image.shape[0], 0, GL.GL_RGBA,
+                        GL.GL_UNSIGNED_BYTE, image.tobytes())
+        return texture
+
+    def text_size(self, text) -> tuple:
+        size = imgui.calc_text_size(text)
+        return size.x, size.y
+
+    def font_size(self) -> float:
+        return imgui.get_font_size()
+
+    def set_font_scale(self, scale):
+        imgui.set_window_font_scale(scale)
+
+    def display_frame_times(self):
+        timer = self.frame_timer
+        phases, durations, frame_ms = timer.history()
+        if not len(frame_ms):
+            return
+        # Stack the phases on top of each other, one line per phase, newest frame on the right
+        width, height = imgui.get_content_region_available_width(), 120
+        x, y = imgui.get_cursor_screen_pos()
+        draw_list = imgui.get_window_draw_list()
+        frames = min(len(frame_ms), int(width))
+        stacked = np.cumsum(durations[-frames:], axis=1)
+        scale = height / max(np.percentile(frame_ms[-frames:], 99), 1000 / self.fps_cap, 1)
+        xs = x + width - frames + np.arange(frames)
+        draw_list.add_rect_filled(x, y, x + width, y + height, 0x40000000)
+        target = y + height - (1000 / self.fps_cap) * scale
+        draw_list.add_line(x, target, x + width, target, 0x80FFFFFF)
+        for i in range(len(phases) - 1, -1, -1):
+            ys = np.maximum(y + height - stacked[:, i] * scale, y)
+            draw_list.add_polyline(list(zip(xs.tolist(), ys.tolist())), phase_color(i), thickness=1)
+        imgui.dummy(width, height)
+        recent = durations[-60:].mean(axis=0)
+        imgui.text(f"{frame_ms[-60:].mean():.2f} ms per frame on average, {frame_ms[-frames:].max():.2f} ms at worst"
+                   f" (line is {1000 / self.fps_cap:.1f} ms)")
+        imgui.columns(3, "frame-phases", border=False)
+        for i, phase in enumerate(phases):
+            x, y = imgui.get_cursor_screen_pos()
+            size = imgui.get_text_line_height()
+            draw_list.add_rect_filled(x, y, x + size, y + size, phase_color(i))
+            imgui.dummy(size, size)
+            imgui.same_line()
+            imgui.text(f"{phase}: {recent[i]:.2f} ms")
+            imgui.next_column()
+        imgui.columns(1)
+        changed, timer.paused = imgui.checkbox("Pause", timer.paused)
+        imgui.same_line()
+        if imgui.button("Save Trace"):
+            self.save_frame_trace()
+
+    def save_frame_trace(self):
+        """Save the recorded frames next to the crash log, as a trace for Perfetto or chrome://tracing."""
+        filename = f"{SCRIPT_DIR + os.sep}trace-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        try:
+            self.frame_timer.save_trace(filename)
+        except OSError as e:
+            self.error = e
+            return
+        print(f"Saved a trace of the last {min(self.frame_timer.frames, self.frame_timer.capacity)} frames to {filename}")
+
+    def toggle_profiler(self):
+        """Start profiling the next few frames, or stop early if that's already happening."""
+        if self.profiler.running:
+            self.stop_profiler()
+            return
+        try:
+            self.profiler.start(self.profiler_frames)
+        except ValueError as e:  # Something else, like a debugger, is profiling already
+            self.error = e
+
+    def stop_profiler(self):
+        """Save what was profiled next to the crash log, where it can be opened with snakeviz or pstats."""
+        filename = f"{SCRIPT_DIR + os.sep}profile-{time.strftime('%Y%m%d-%H%M%S')}.pstats"
+        try:
+            self.profiler.stop(filename)
+        except OSError as e:
+            self.error = e
+            return
+        print(f"Saved a profile of {self.profiler.frames} frames to {filename}")
+
+    def display_profiler(self):
+        profiler = self.profiler
+        if profiler.running:
+            imgui.text(f"Profiling... {profiler.frames_left} frames left")
+            if imgui.button("Stop"):
+                self.stop_profiler()
         else:
+            imgui.push_item_width(120)
+            changed, value = imgui.input_int("Frames", self.profiler_frames)
+            imgui.pop_item_width()
+            if changed:
+                self.profiler_frames = min(max(value, 1), 10000)
+            imgui.same_line()
+            if imgui.button("Start"):
+                self.toggle_profiler()
+        if profiler.filename is None:
+            imgui.text_wrapped("F4 profiles the next few frames, and shows which functions took the longest here.")
+            return
+        imgui.text(f"{profiler.frames} frames, saved to {os.path.basename(profiler.filename)}")
+        imgui.columns(4, "profiler-functions")
+        for header in ("Function", "Calls", "Own ms", "Total ms"):
+            imgui.text(header)
+            imgui.next_column()
+        imgui.separator()
+        for name, calls, own, total in profiler.top:
+            imgui.text(name)
+            imgui.next_column()
+            imgui.text(str(calls))
+            imgui.next_column()
+            imgui.text(f"{own:.1f}")
+            imgui.next_column()
+            imgui.text(f"{total:.1f}")
+            imgui.next_column()
+        imgui.columns(1)
+
+    def open_library(self):
+        if self.library is None:
+            self.library = Library(f"{SCRIPT_DIR + os.sep}library.sqlite3")
+            self.library_folders = self.library.folders()
+            self.rescan_library()
+
+    def rescan_library(self):
+        if self.library_scan is None:
+            self.library_scan = LibraryScan(self.library)
+
+    def display_library(self):
+        """Draw the library browser. Returns False once a map's been opened from it."""
+        if self.library_scan is not None and self.library_scan.done:
+            if self.library_scan.error is not None:
+                self.error = self.library_scan.error
+            self.library_scan = None
+            self.library_results = None
+        imgui.text("Folders")
+        for folder in self.library_folders:
+            if imgui.button(f"-##{folder}"):
+                self.library.remove_folder(folder)
+                self.library_folders = self.library.folders()
+                self.rescan_library()
+            imgui.same_line()
+            imgui.text(folder)
+        if imgui.button("Add Folder..."):
+            folder = self.input.dialog(lambda: filedialog.askdirectory(title="Add a folder to the library",
+                                                                       initialdir=self.current_folder))
+            if folder:
+                self.library.add_folder(folder)
+                self.library_folders = self.library.folders()
+                self.rescan_library()
+        imgui.same_line()
+        if self.library_scan is not None:
+            imgui.progress_bar(self.library_scan.progress, (160, 0), "Scanning...")
+        elif imgui.button("Rescan"):
+            self.rescan_library()
+        imgui.separator()
+        changed, value = imgui.input_text("Search", self.library_query, 256)
+        if changed:
+            self.library_query = value
+            self.library_results = None
+        if self.library_results is None:
+            self.library_results = self.library.search(self.library_query)
+            count, failed = self.library.counts()
+            self.library_status = f"{len(self.library_results)} of {count} maps shown"
+            if failed:
+                self.library_status += f", {failed} couldn't be read"
+        imgui.text(self.library_status)
+        imgui.begin_child("library-results")
+        imgui.columns(6, "library-columns")
+        for heading in ("Name", "Song", "Mappers", "Difficulty", "Notes", "Length"):
+            imgui.text(heading)
+            imgui.next_column()
+        imgui.separator()
+        opened = None
+        for row in self.library_results:
+            if imgui.selectable(f"{row['name']}##{row['path']}", flags=imgui.SELECTABLE_SPAN_ALL_COLUMNS)[0]:
+                opened = row["path"]
+            if imgui.is_item_hovered():
+                imgui.set_tooltip(row["path"] if row["bpm"] is None else f"{row['path']}\n{row['bpm']:g} BPM")
+            imgui.next_column()
+            imgui.text(row["song_name"])
+            imgui.next_column()
+            imgui.text(row["mappers"])
+            imgui.next_column()
+            imgui.text(DIFFICULTIES[row["difficulty"] + 1] if -1 <= row["difficulty"] < len(DIFFICULTIES) - 1 else "???")
+            imgui.next_column()
+            imgui.text(str(row["notes"]))
+            imgui.next_column()
+            imgui.text(f"{row['length'] // 60000}:{row['length'] // 1000 % 60:02}")
+            imgui.next_column()
+        imgui.columns(1)
+        imgui.end_child()
+        if opened is not None:
+            self.load_file(opened)
+            return False
+        return True
+
+    def load_file(self, filename):
+        level_class = format_of(filename)
+        if level_class is None:
             self.error = AssertionError("Invalid level type!")
             return False
         # Read the level from the file and load it
         try:
-            self.level, metadata = level_class.load(filename)
+            if level_class is VulnusLevel:
+                map_set, metadata = VulnusMapSet.load(filename)
+                level = map_set.levels[Path(filename).name]
+            else:
+                map_set = None
+                level, metadata = level_class.load(filename)
+            self.level, self.map_set = level, map_set
+            self.unsaved_difficulties = set()
             if metadata is not None:
                 # Load metadata
                 self.bpm = metadata[0]
@@ -588,20 +851,21 @@ class Editor:
         # Only connect if connected to the internet
         conn = http.client.HTTPSConnection("1.1.1.1", timeout=5)
         try:
+            if self.input.replaying:
+                raise ConnectionError  # Replays shouldn't depend on Discord
             conn.request("HEAD", "/")
             self.RPC.connect()
         except:
             self.RPC = DummyRPC()
         start_time = time.time()
         running = True
-        old_audio = None
         cursor = "arrow"
         sdl2_cursor = None
-        audio_data = None
         space_last = False
         was_playing = False
         was_resizing_timeline = False
         last_hitsound_times = np.zeros((0), dtype=np.int64)
+        hitsound_window = NoteWindow()
         old_mouse = (0, 0, 0, 0, 0)
         old_beat = 0
         tex_ids = GL.glGenTextures(3)  # NOTE: Update this when you add more images
@@ -609,20 +873,22 @@ class Editor:
         old_keys = self.keys()
         easter_egg_active = False  # feel free to enable this from here, but it's more fun if you find what makes it true w/o mofifying the code
         keys_pressed = []
-        cursor_positions = [[0, 0]]
         level_was_active = False
-        extent = 0
         spline_nodes = {}
         spline_display_notes = {}
         spline_amount = 5
         spline_window_open = False
         bulk_delete_window_open = False
         tap_timings_window_open = False
+        library_window_open = False
+        frame_times_window_open = False
+        profiler_window_open = False
         bulk_delete_start_time = 0
         bulk_delete_end_time = 0
-        cursor_spline = None
         name_id = -1
         timeline_width = 0
+        timeline_start = 0
+        timeline_hovered = False
         dragging_timeline = False
         ms_per_beat = 0
         edit_markers_window_open = False
@@ -643,19 +909,21 @@ class Editor:
                 self.BACKGROUND = self.create_image(im, int(tex_ids[2]))
                 self.background_size = im.size
         # Handle opening a file with the program
-        if len(sys.argv) > 1:
-            self.load_file(sys.argv[1])
+        if self.startup_file is not None:
+            self.load_file(self.startup_file)
         while running:
+            self.frame_timer.begin_frame()
+            self.frame_timer.phase("setup")
             self.rects_drawn = 0
             dt = time.perf_counter_ns()
-            # Check if the audio data needs to be updated
-            if self.level is not None:
-                if self.level.audio is not None:
-                    if self.level.audio != old_audio:
-                        audio_data = np.array(self.level.audio.get_array_of_samples())
-                        extent = np.max(np.abs(audio_data))
-                        old_audio = self.level.audio
+            self.check_save()
+            # Check if the waveform needs to be updated
+            self.update_waveform()
             impl.process_inputs()
+            if not self.input.begin_frame(self.io):
+                self.frame_timer.end_frame()
+                self.finish_replay()
+                break
             imgui.new_frame()
             keys = self.keys()
             keys_changed = []
@@ -672,6 +940,7 @@ class Editor:
             mouse = tuple(self.io.mouse_down)
             if self.bpm:
                 ms_per_beat = (60000 / self.bpm) * (4 / self.time_signature[1])
+            self.frame_timer.phase("playback")
             # Check if the song needs to be paused/played
             if keys[sdl2.SDLK_SPACE] and self.level is not None and level_was_active:
                 if not old_keys[sdl2.SDLK_SPACE]:
@@ -684,7 +953,7 @@ class Editor:
                     self.playback = play_at_position(
                         self.speed_change(self.level.audio + self.volume, self.audio_speed),
                         ((self.time) / 1000) / self.audio_speed)
-                self.starting_time = time.perf_counter_ns()
+                self.starting_time = self.input.clock()
                 self.starting_position = self.time
             elif not self.playing and was_playing:
                 if self.playback is not None:
@@ -704,6 +973,7 @@ class Editor:
                     and self.time / 1000 <= self.level.audio.duration_seconds):
                 self.playback = play_at_position(self.speed_change(self.level.audio + self.volume, self.audio_speed),
                                                  ((self.time) / 1000) / self.audio_speed)
+            self.frame_timer.phase("rpc")
             # Set the window name
             # FIXME: The self.RPC code is kind of spaghetti.
             if sys.gettrace() is not None:
@@ -743,19 +1013,34 @@ class Editor:
                                     state=f"{self.level.get_end() / 1000:.1f} seconds long, {len(self.level.get_notes())} notes",
                                     start=start_time,
                                     buttons=[{"label": "GitHub", "url": "https://github.com/balt-dev/SSpy/"}])
+            self.frame_timer.phase("ui")
             with imgui.font(font):
-                while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
+                while self.input.poll(event):
                     # Handle quitting the app
                     if event.type == sdl2.SDL_QUIT:
                         self.playing = False
-                        if not self.changed_since_save:
+                        if not self.has_unsaved_changes():
                             running = False
                         else:
                             imgui.open_popup("quit.ensure")
-                    if event.type == sdl2.SDL_MOUSEWHEEL and level_was_active and not self.playing:
+                    if event.type == sdl2.SDL_MOUSEWHEEL and level_was_active and timeline_hovered and not self.preview_mode:
+                        self.zoom_timeline(event.wheel.y)
+                    elif event.type == sdl2.SDL_MOUSEWHEEL and level_was_active and not self.playing:
                         self.time_scroll(event.wheel.y, keys)
                     impl.process_event(event)
+                self.input.end_events(self.io)
                 self.menu_choice = None
+                if keys[sdl2.SDL_SCANCODE_F3] and not old_keys[sdl2.SDL_SCANCODE_F3]:
+                    if keys[sdl2.SDL_SCANCODE_LCTRL] or keys[sdl2.SDL_SCANCODE_RCTRL]:
+                        # CTRL + F3 : Save a trace of the last few seconds
+                        self.save_frame_trace()
+                    else:
+                        # F3 : Frame times
+                        frame_times_window_open = not frame_times_window_open
+                if keys[sdl2.SDL_SCANCODE_F4] and not old_keys[sdl2.SDL_SCANCODE_F4]:
+                    # F4 : Profile the next few frames
+                    profiler_window_open = True
+                    self.toggle_profiler()
                 # Handle file keybinds
                 if keys[sdl2.SDL_SCANCODE_LCTRL] or keys[sdl2.SDL_SCANCODE_RCTRL]:
                     if keys[sdl2.SDLK_n] and not old_keys[sdl2.SDLK_n]:
@@ -763,6 +1048,8 @@ class Editor:
                         self.notes_changed = True
                         self.times_to_display = None
                         self.level = SSPMLevel()
+                        self.map_set = None
+                        self.unsaved_difficulties = set()
                         if self.playback is not None:
                             self.playback.stop()
                         self.playback = None
@@ -784,11 +1071,7 @@ class Editor:
                     if keys[sdl2.SDLK_s] and not old_keys[sdl2.SDLK_s]:
                         # CTRL + S : Save / CTRL + SHIFT + S : Save As...
                         if self.filename is not None and not keys[sdl2.SDL_SCANCODE_LSHIFT]:
-                            try:
-                                self.level.save(self.filename, self.bpm, self.offset, self.time_signature, self.swing)
-                                self.changed_since_save = False
-                            except Exception as e:
-                                self.error = e
+                            self.start_save(self.filename)
                         else:
                             self.saveas()
                     if keys[sdl2.SDLK_p] and not old_keys[sdl2.SDLK_p]:
@@ -807,6 +1090,8 @@ class Editor:
                             self.notes_changed = True
                             self.times_to_display = None
                             self.level = SSPMLevel()
+                            self.map_set = None
+                            self.unsaved_difficulties = set()
                             if self.playback is not None:
                                 self.playback.stop()
                             self.filename = None
@@ -822,15 +1107,13 @@ class Editor:
                             changed, value = self.open_file_dialog({k: v for k, v in zip(FORMAT_NAMES, FORMAT_EXTS)})
                             if changed:
                                 self.load_file(value)
+                        if imgui.menu_item("Library...")[0]:
+                            self.open_library()
+                            library_window_open = True
                         if imgui.menu_item("Save", "ctrl + s",
                                            enabled=(self.level is not None and self.filename is not None))[0]:
                             if self.filename is not None:
-                                try:
-                                    self.level.save(self.filename, self.bpm, self.offset, self.time_signature,
-                                                    self.swing)
-                                    self.changed_since_save = False
-                                except Exception as e:
-                                    self.error = e
+                                self.start_save(self.filename)
                             else:
                                 self.saveas()
                         if imgui.menu_item("Save As...", "ctrl + shift + s", enabled=self.level is not None)[0]:
@@ -840,7 +1123,7 @@ class Editor:
                         imgui.separator()
                         if imgui.menu_item("Quit", "alt + f4")[0]:
                             self.playing = False
-                            if not self.changed_since_save:
+                            if not self.has_unsaved_changes():
                                 running = False
                             else:
                                 self.menu_choice = "quit.ensure"  # NOTE: The quit menu won't open if I don't do this from here
@@ -849,12 +1132,16 @@ class Editor:
                         changed, value = imgui.combo("Format", FORMATS.index(self.level.__class__),
                                                      list(FORMAT_NAMES))
                         if changed:
-                            self.level = FORMATS[value](self.level.name,
-                                                        self.level.authors,
-                                                        self.level.notes,
-                                                        self.level.cover,
-                                                        self.level.audio,
-                                                        self.level.difficulty)
+                            new_level = FORMATS[value](self.level.name,
+                                                       self.level.authors,
+                                                       self.level.notes,
+                                                       None,
+                                                       None,
+                                                       convert_difficulty(self.level.difficulty, FORMATS[value]))
+                            new_level.share_assets(self.level)
+                            self.level = new_level
+                            self.map_set = None
+                            self.unsaved_difficulties = set()
                             self.changed_since_save = True
                             self.time_since_last_change = time.time()
                         imgui.push_item_width(240)
@@ -879,7 +1166,8 @@ class Editor:
                                 {"Audio": "*.mp3 *.ogg *.wav *.flac *.opus"})
                             if changed:
                                 try:
-                                    self.level.audio = AudioSegment.from_file(value).set_sample_width(2)
+                                    song_data = Path(value).read_bytes()
+                                    self.level.set_audio_data(song_data, decode_audio(song_data))
                                     self.changed_since_save = True
                                     self.time_since_last_change = time.time()
                                 except pydub.exceptions.CouldntDecodeError:
@@ -1014,6 +1302,9 @@ class Editor:
                         changed, value = imgui.slider_int("Note Rounding", int(self.rounding * 100), 0, 100)
                         if changed:
                             self.rounding = value / 100
+                        changed, value = imgui.checkbox("Draw Notes With GPU", self.gpu_notes)
+                        if changed:
+                            self.gpu_notes = value
                         imgui.pop_item_width()
                         imgui.end_menu()
                     if imgui.begin_menu("Tools", self.level is not None):
@@ -1062,12 +1353,18 @@ class Editor:
                         imgui.text("Mouse wheel or left/right arrows to move your place on the timeline")
                         imgui.text("Space to play/pause the level")
                         imgui.text("Left click to place a note, right click to delete")
+                        imgui.text("Mouse wheel over the timeline to zoom it")
                         imgui.separator()
                         imgui.text(
                             "Place colors.txt in the script directory with a list of colors to customize note colors")
                         imgui.text(
                             "Place background.png (or .jpg, .webp, whatever) in the script directory to add a background")
+                        imgui.separator()
+                        imgui.text("F3 to show how long each part of a frame takes, ctrl + F3 to save them as a trace")
+                        imgui.text("F4 to profile the next few frames, and see which functions are slowest")
                         imgui.end_menu()
+                    if self.save_job is not None:
+                        imgui.progress_bar(self.save_job.progress, (160, 0), "Saving...")
                     source_code_was_open = imgui.core.image_button(self.GITHUB_ICON_ID, 26, 26, frame_padding=0)
                     if source_code_was_open:
                         webbrowser.open("https://github.com/balt-is-you-and-shift/SSpy", 2, autoraise=True)
@@ -1098,11 +1395,7 @@ class Editor:
                     if imgui.button("Confirm"):
                         self.notes_changed = True
                         self.times_to_display = None
-                        # FIXME: this code kinda sucks
-                        new_notes = {}
-                        for timing, pos in self.level.notes.items():
-                            new_notes[timing - note_offset] = pos
-                        self.level.notes = new_notes
+                        self.level.notes.shift(-note_offset)
                         note_offset = None
                         self.changed_since_save = True
                         self.time_since_last_change = time.time()
@@ -1137,10 +1430,7 @@ class Editor:
                     if imgui.button("Confirm"):
                         self.notes_changed = True
                         self.times_to_display = None
-                        times = np.array(tuple(self.level.notes.keys()))
-                        times = times[np.logical_and(bulk_delete_start_time <= times, times <= bulk_delete_end_time)]
-                        for note_time in times:
-                            del self.level.notes[note_time]
+                        self.level.notes.delete_range(bulk_delete_start_time, bulk_delete_end_time + 1)
                         self.changed_since_save = True
                         self.time_since_last_change = time.time()
                     imgui.end()
@@ -1253,15 +1543,13 @@ class Editor:
                             spline_window_open = False
                         imgui.same_line(spacing=10)
                         if len(spline_nodes) > 1:
-                            spline_display_notes = spline(spline_nodes, spline_amount)
+                            spline_display_notes = beats.spline(spline_nodes, spline_amount)
                             if imgui.button("Place"):
                                 self.notes_changed = True
                                 self.times_to_display = None
-                                for timing, position in spline_display_notes.items():
-                                    if timing in self.level.notes:
-                                        self.level.notes[int(timing)].append(position)
-                                    else:
-                                        self.level.notes[int(timing)] = [position]
+                                spline_times = np.array(tuple(spline_display_notes.keys()), dtype=np.int32)
+                                spline_positions = np.array(tuple(spline_display_notes.values()), dtype=np.float64)
+                                self.level.notes.extend(spline_times, spline_positions[:, 0], spline_positions[:, 1])
                                 self.changed_since_save = True
                                 self.time_since_last_change = time.time()
                         imgui.pop_item_width()
@@ -1285,7 +1573,7 @@ class Editor:
                                     self.playback = play_at_position(
                                         self.speed_change(self.level.audio + self.volume, self.audio_speed),
                                         ((self.time) / 1000) / self.audio_speed)
-                                self.starting_time = time.perf_counter_ns()
+                                self.starting_time = self.input.clock()
                                 self.starting_position = self.time
                             set_timing = self.time
                             if timings_quantize:
@@ -1294,6 +1582,24 @@ class Editor:
                         if imgui.button("Done"):
                             tap_timings_window_open = False
                         imgui.end()
+                if frame_times_window_open:
+                    imgui.set_next_window_size(480, 0, imgui.FIRST_USE_EVER)
+                    expanded, frame_times_window_open = imgui.begin("Frame Times", True)
+                    if expanded:
+                        self.display_frame_times()
+                    imgui.end()
+                if profiler_window_open:
+                    imgui.set_next_window_size(640, 360, imgui.FIRST_USE_EVER)
+                    expanded, profiler_window_open = imgui.begin("Profiler", True)
+                    if expanded:
+                        self.display_profiler()
+                    imgui.end()
+                if library_window_open:
+                    imgui.set_next_window_size(720, 400, imgui.FIRST_USE_EVER)
+                    expanded, library_window_open = imgui.begin("Library", True)
+                    if expanded:
+                        library_window_open = self.display_library()
+                    imgui.end()
                 if self.level is not None:
                     size = self.io.display_size
                     imgui.set_next_window_size(size[0], size[1] - (0 if self.preview_mode else 26))
@@ -1304,34 +1610,18 @@ class Editor:
                                         flags=imgui.WINDOW_NO_MOVE | imgui.WINDOW_NO_COLLAPSE | imgui.WINDOW_NO_TITLE_BAR | imgui.WINDOW_NO_RESIZE | imgui.WINDOW_NO_BRING_TO_FRONT_ON_FOCUS):
                         x, y = imgui.get_window_position()
                         w, h = imgui.get_content_region_available()
-                        timeline_rects = []
                         if imgui.begin_child("nodrag", 0, 0, False, ):
                             level_was_active = imgui.is_window_focused()
                             if level_was_active and (keys[sdl2.SDL_SCANCODE_LEFT] or keys[sdl2.SDL_SCANCODE_RIGHT]) and not \
                                     (old_keys[sdl2.SDL_SCANCODE_LEFT] or old_keys[sdl2.SDL_SCANCODE_RIGHT]):
                                 self.time_scroll((2 * keys[sdl2.SDL_SCANCODE_RIGHT]) - 1, keys)
+                            self.frame_timer.phase("level view")
                             draw_list = imgui.get_window_draw_list()
                             if not dragging_timeline:
-                                timeline_width = max(self.level.get_end() + 1000, self.time + self.approach_rate, 1)
-                            # Draw the main UI background
-                            square_side = min(w, h)
-                            if self.BACKGROUND is None:
-                                draw_list.add_rect_filled(x, y, x + w, y + h, 0xff000000)
-                            else:
-                                # Adjust width and height for UVs
-                                adjusted_w = w / self.background_size[0]
-                                adjusted_h = h / self.background_size[1]
-                                normalized_w = adjusted_w / max(adjusted_w, adjusted_h)
-                                normalized_h = adjusted_h / max(adjusted_w, adjusted_h)
-                                draw_list.add_image(self.BACKGROUND, (x, y), (x + w, y + h),
-                                                    (0.5 - (normalized_w / 2), 0.5 - (normalized_h / 2)),
-                                                    (0.5 + (normalized_w / 2), 0.5 + (normalized_h / 2)))
-                            adjusted_x = (((x + w) / 2) - (square_side / 2))
-                            adjusted_y = (((y + h) / 2) - (square_side / 2))
-                            box = (adjusted_x, adjusted_y, adjusted_x + square_side, adjusted_y + square_side)
-                            timeline_rects.append(
-                                DelayedRect((x, (y + h) - (0 if self.preview_mode else self.timeline_height), x + w, (y + h)), 0x80404040))
-                            self.rects_drawn += 3
+                                timeline_start, timeline_width = self.timeline_view(
+                                    max(self.level.get_end() + 1000, self.time + self.approach_rate, 1))
+                            box, square_side = self.level_box(x, y, w, h)
+                            adjusted_x, adjusted_y = box[:2]
                             note_pos = [(((mouse_pos[0] - (adjusted_x)) / (square_side)) * self.vis_map_size) - (
                                 self.vis_map_size / 2) + 1,
                                 (((mouse_pos[1] - (adjusted_y)) / (square_side)) * self.vis_map_size) - (
@@ -1340,249 +1630,59 @@ class Editor:
                                 ((note_pos[0] - 1) * self.sensitivity) + 1, ((note_pos[1] - 1) * self.sensitivity) + 1)
                             note_pos[0] -= self.camera_pos[0]
                             note_pos[1] -= self.camera_pos[1]
-                            if ((not self.preview_mode) and self.level.audio is not None and audio_data is not None
-                                    and self.draw_audio and self.timeline_height > 20):
-                                center = (y + h) - (self.timeline_height / 2)
-                                length = int(self.level.audio.frame_rate * timeline_width / 1000)
-                                waveform_width = int(
-                                    size[0])
-                                # Draw waveform
-                                # FIXME: it'd be nice if this wasn't a python loop
-                                for n in range(0, waveform_width, self.waveform_res):
-                                    try:
-                                        # Slice a segment of audio
-                                        sample = audio_data[math.floor((n / waveform_width) * length * 2): math.floor(
-                                            ((n + self.waveform_res) / waveform_width) * length * 2)]
-                                        timeline_rects.append(DelayedRect(
-                                            (x + int((w / waveform_width) * n),
-                                             center + int(
-                                                 (np.max(sample) / (extent / 0.8)) * (
-                                                     self.timeline_height // 2)),
-                                             x + int((w / waveform_width) * n) + self.waveform_res,
-                                             center + int(
-                                                 (np.min(sample) / (extent / 0.8)) * (
-                                                     self.timeline_height // 2))),
-                                            0x20ffffff))
-                                        self.rects_drawn += 1
-                                    except (IndexError, ValueError):
-                                        break
-                            if not self.preview_mode and self.draw_notes and self.times_to_display is not None:
-                                # Draw notes
-                                for i, note in enumerate(self.times_to_display):
-                                    color = (self.colors[i % len(self.colors)] & 0xFFFFFF) | 0x40000000
-                                    progress = note / timeline_width
-                                    progress = progress if not math.isnan(progress) else 1
-                                    timeline_rects.append(
-                                        DelayedRect((x + int(w * progress), (y + h) - self.timeline_height,
-                                                     x + int(w * progress) + 1,
-                                                     (y + h) - (self.timeline_height * 0.8)),
-                                                    color))
-                                    self.rects_drawn += 1
-                            # Draw currently visible area on timeline
-                            start = (self.time) / timeline_width
-                            end = (self.time + self.approach_rate) / timeline_width
-                            timeline_rects.append(
-                                DelayedRect((x + int(w * start), (y + h) - self.timeline_height, x + int(w * end) + 1,
-                                             (y + h)), 0x80ffffff, thickness=3, filled=False))
-                            self.rects_drawn += 1
-
-                            def center_of_view(text):
-                                text_width = imgui.calc_text_size(text).x
-                                return max(
-                                    min((((x + int(w * start)) + (x + int(w * end) + 1)) / 2) - (text_width / 2),
-                                        w - text_width), text_width / 2)
-
-                            # Draw the current time above the visible area
-                            if not self.preview_mode:
-                                draw_list.add_text(
-                                    center_of_view(f"{self.time / 1000:.3f}"),
-                                    y + h - (self.timeline_height + 20), 0x80FFFFFF, f"{self.time / 1000:.3f}")
-                                if self.bpm:
-                                    # Draw the current measure and beat
-                                    raw_current_beat = (self.time - self.offset) / (ms_per_beat)
-                                    current_beat = self.adjust_swing(raw_current_beat)
-                                    m_text = f"Measure {current_beat // self.time_signature[0]:.0f}"
-                                    draw_list.add_text(
-                                        center_of_view(m_text),
-                                        y + h - (self.timeline_height + 60), 0x80FFFFFF, m_text)
-                                    b_text = f"Beat {f'{current_beat % (self.time_signature[0] / (self.time_signature[1] / 4)):.2f}'.rstrip('0').rstrip('.')}"
-                                    draw_list.add_text(
-                                        center_of_view(b_text),
-                                        y + h - (self.timeline_height + 40), 0x80FFFFFF, b_text)
-
-                                    floor_beat = math.floor(raw_current_beat)
-                                    # Play the metronome
-                                    if self.metronome and self.playing:
-                                        beat_skipped = floor_beat - math.floor(old_beat)
-                                        if beat_skipped:
-                                            if old_beat // self.time_signature[0] != current_beat // self.time_signature[
-                                                    0]:  # If a measure has passed
-                                                _play_with_simpleaudio(METRONOME_M)
-                                            else:
-                                                _play_with_simpleaudio(METRONOME_B)
-                                    old_beat = current_beat
-                                    # Draw markers
-                                    if isinstance(self.level, SSPMLevel):
-                                        old_time = -1
-                                        offset = 0
-                                        self.displayed_markers = []
-                                        for marker_type in self.level.markers:
-                                            for i, marker in enumerate(self.level.markers[marker_type]):
-                                                line_prog = 1 - ((marker["time"] - self.time) / self.approach_rate)
-                                                if marker["time"] == old_time:
-                                                    offset += imgui.get_font_size() / 4
-                                                else:
-                                                    offset = 0
-                                                    old_time = marker["time"]
-                                                if self.time <= marker["time"] < (self.time + self.approach_rate):
-                                                    imgui.set_window_font_scale(self.perspective_scale(line_prog) * 4)
-                                                    draw_list.add_text(
-                                                        *self.note_pos_to_abs_pos(
-                                                            (self.vis_map_size / -2 + 1,
-                                                             (self.vis_map_size / 2 + 1) + (0.05 * offset)),
-                                                            box, line_prog),
-                                                        0xFFFFFF | (int(0xFF * max(0, line_prog)) << 24),
-                                                        f"{marker_type}"
-                                                    )
-                                                    imgui.set_window_font_scale(1)
-                                                progress = marker["time"] / timeline_width
-                                                timeline_rects.append(
-                                                    DelayedRect((x + int(w * progress), (y + h) - self.timeline_height * 0.2,
-                                                                 x + int(w * progress) + 1,
-                                                                 (y + h) - self.timeline_height * 0.4),
-                                                                0x00ff00ff))
-                                                if self.time == marker["time"]:
-                                                    self.displayed_markers.append((marker_type, i, marker))
-                                                self.rects_drawn += 1
-
-                                    if self.bpm_markers:
-                                        # Draw beat markers on timeline
-                                        end_beat = (timeline_width / ms_per_beat)
-                                        for beat in range(int(end_beat * self.beat_divisor + 1), 0, -1):
-                                            beat /= self.beat_divisor
-                                            on_measure = not (beat % self.time_signature[0])
-                                            on_beat = not (beat % 1)
-                                            self.swing = 1 - self.swing  # Invert this because it draws in the wrong place otherwise
-                                            swung_beat = self.adjust_swing(beat)
-                                            self.swing = 1 - self.swing
-                                            beat_time = (swung_beat * ms_per_beat) + self.offset
-                                            if (end_beat < 250 or on_beat) and (
-                                                    end_beat < 500 or on_measure) and end_beat < 2000:
-                                                progress = beat_time / timeline_width
-                                                progress = progress if not math.isnan(progress) else 1
-                                                timeline_rects.append(DelayedRect((x + int(w * progress), (y + h) - (
-                                                    self.timeline_height * (
-                                                        0.3 if on_measure else 0.2 if on_beat else 0.1)),
-                                                    x + int(w * progress) + 1, (y + h)),
-                                                    0xff0000ff if on_measure else 0x800000ff))
-                                                self.rects_drawn += 1
-                                            if (self.time <= beat_time < self.time + self.approach_rate):
-                                                line_prog = 1 - ((beat_time - self.time) / self.approach_rate)
-                                                # Draw beat marker in note space
-                                                draw_list.add_rect(
-                                                    *self.note_pos_to_abs_pos(
-                                                        (self.vis_map_size / 2 + 1, self.vis_map_size / 2 + 1),
-                                                        box, line_prog),
-                                                    *self.note_pos_to_abs_pos(
-                                                        (self.vis_map_size / -2 + 1, self.vis_map_size / -2 + 1),
-                                                        box, line_prog),
-                                                    0xFF | (int(0xFF * max(0, line_prog) / (
-                                                        1 if on_measure else 2 if on_beat else 6))) << 24,
-                                                    thickness=2 * max(0, line_prog) * (2 if on_measure else 1)
-                                                )
-                                                self.rects_drawn += 1
-                                for i, timing in enumerate(self.timings[np.logical_and(self.time <= self.timings, self.timings < (self.time + self.approach_rate))]):
-                                    progress = timing / timeline_width
-                                    if progress < 1:
-                                        progress = progress if not math.isnan(progress) else 1
-                                        line_prog = 1 - ((timing - self.time) / self.approach_rate)
-                                        # Draw beat marker in note space
-                                        draw_list.add_line(
-                                            *self.note_pos_to_abs_pos(
-                                                (self.vis_map_size / 2 + 1, self.vis_map_size / -2 + 1),
-                                                box, line_prog),
-                                            *self.note_pos_to_abs_pos(
-                                                (self.vis_map_size / -2 + 1, self.vis_map_size / -2 + 1),
-                                                box, line_prog),
-                                            0xFF00 | int(0xFF * max(0, line_prog)) << 24,
-                                            thickness=2 * max(0, line_prog)
-                                        )
-                                        self.rects_drawn += 1
+                            self.draw_level(draw_list, x, y, w, h, timeline_width,
+                                            spline_nodes if spline_window_open else None, spline_display_notes,
+                                            timeline_start)
+                            if not self.preview_mode and self.bpm:
+                                raw_current_beat = (self.time - self.offset) / (ms_per_beat)
+                                current_beat = self.adjust_swing(raw_current_beat)
+                                floor_beat = math.floor(raw_current_beat)
+                                # Play the metronome
+                                if self.metronome and self.playing:
+                                    beat_skipped = floor_beat - math.floor(old_beat)
+                                    if beat_skipped:
+                                        if old_beat // self.time_signature[0] != current_beat // self.time_signature[
+                                                0]:  # If a measure has passed
+                                            _play_with_simpleaudio(sound("metronome_measure"))
+                                        else:
+                                            _play_with_simpleaudio(sound("metronome_beat"))
+                                old_beat = current_beat
                             if self.times_to_display is not None:
-                                # FIXME: Copy the times display for hitsound offsets :(
-                                hitsound_times = self.times_to_display[np.logical_and(
-                                    self.times_to_display >= int(self.time) + (
-                                        self.hitsound_offset / self.audio_speed) - 1,
-                                    (self.times_to_display) < (
-                                        int(self.time) + self.approach_rate + (
-                                            self.hitsound_offset * self.audio_speed)))].flatten()
-                                note_times = self.times_to_display[
-                                    np.logical_and(self.times_to_display - self.time >= 0,
-                                                   (self.times_to_display) < (
-                                                       self.time + self.approach_rate))].flatten()
-                                for note_time in note_times[::-1]:
-                                    i = np.where(self.times_to_display == note_time)[0][0]
-                                    for note in self.level.notes[note_time]:
-                                        rgba = self.colors[i % len(self.colors)]
-                                        rgb, a = rgba & 0xFFFFFF, (rgba & 0xFF000000) >> 24
-                                        progress = 1 - ((note_time - self.time) / self.approach_rate)
-                                        self.draw_note(draw_list, note,
-                                                       box, progress,
-                                                       color=rgb, alpha=a)
-
+                                self.frame_timer.phase("hitsounds")
+                                first, last = hitsound_window.find(
+                                    self.times_to_display,
+                                    int(self.time) + (self.hitsound_offset / self.audio_speed) - 1,
+                                    int(self.time) + self.approach_rate + (self.hitsound_offset * self.audio_speed))
+                                hitsound_times = self.times_to_display[first:last]
                                 # Play note hit sound
                                 if self.playing and self.hitsounds:
                                     if ((last_hitsound_times.size and
-                                         np.min(last_hitsound_times) < self.time + (
+                                         last_hitsound_times[0] < self.time + (
                                              self.hitsound_offset / self.audio_speed) - 1)):
-                                        notes = self.level.notes[np.min(last_hitsound_times)]
+                                        notes = self.level.notes.positions_at(last_hitsound_times[0])
                                         for note in notes[:8]:
                                             pos = note[0] - 1
                                             panning = (pos / (self.vis_map_size / 2)) * self.hitsound_panning
                                             if not self.playtesting or (abs(note[0] - cursor_pos[0]) < (0.57) and abs(
                                                     note[1] - cursor_pos[1]) < (0.57)):
-                                                _play_with_simpleaudio(HITSOUND.pan(min(max(panning, -1), 1)))
+                                                _play_with_simpleaudio(sound("hit").pan(min(max(panning, -1), 1)))
                                             else:
-                                                _play_with_simpleaudio(MISSSOUND.pan(min(max(panning, -1), 1)))
+                                                _play_with_simpleaudio(sound("miss").pan(min(max(panning, -1), 1)))
                                 last_hitsound_times = hitsound_times
-                            # XXX: copy/pasted code :/
-                            if len(spline_display_notes) and spline_window_open:
-                                if len(spline_nodes) > 1:
-                                    for note_time, note in tuple(spline_nodes.items())[
-                                            ::-1]:  # Invert to draw from back to front
-                                        progress = 1 - ((note_time - self.time) / self.approach_rate)
-                                        if 0 < progress < 1.01:
-                                            handle_size = ((square_side / self.vis_map_size) / 1.25) * (
-                                                1 / (1 + ((1 - progress) * self.approach_distance)))
-                                            abs_position = self.note_pos_to_abs_pos(note,
-                                                                                    box,
-                                                                                    progress)
-                                            draw_list.add_circle_filled(*abs_position, handle_size / 8,
-                                                                        (int(0x80 * progress) << 24) | 0x00FFFF)
-
-                                    for note_time in tuple(spline_display_notes.keys())[
-                                            ::-1]:  # Invert to draw from back to front
-                                        note = spline_display_notes[note_time]
-                                        progress = 1 - ((note_time - self.time) / self.approach_rate)
-                                        self.draw_note(draw_list, note,
-                                                       box, progress,
-                                                       color=0xFFFF00, alpha=int(0x80 * progress), size=0.5)
-
+                            self.frame_timer.phase("level view")
                             if level_was_active and mouse_pos[
                                     1] < y + h - 5 - (0 if self.preview_mode else self.timeline_height):
                                 sdl2.SDL_ShowCursor(
                                     not (self.playtesting and imgui.is_window_focused() and imgui.is_window_hovered()))
                                 # Note placing and deleting
-                                time_arr = np.array(tuple(self.level.notes.keys()))
-                                time_arr = time_arr[
-                                    np.logical_and(time_arr - self.time >= -1,
-                                                   time_arr - self.time < self.approach_rate)]
-                                closest_time = np.min(time_arr) if time_arr.size > 0 else self.time
+                                first, last = self.level.notes.range(self.time - 1, self.time + self.approach_rate)
+                                closest_time = self.level.notes.times[first] if last > first else self.time
                                 closest_index = None
                                 closest_dist = None
                                 # Note deletion
                                 if mouse[1] and not old_mouse[1]:
-                                    for i, note in enumerate(self.level.notes.get(closest_time, ())):
+                                    progress = 1 - ((closest_time - self.time) / self.approach_rate)
+                                    for i, note in enumerate(self.level.notes.positions_at(closest_time)):
                                         p_scale = 1 / self.perspective_scale(progress)
                                         note = (((note[0] - 1) * p_scale) + 1, ((note[1] - 1) * p_scale) + 1)
                                         if abs(note[0] - note_pos[0]) < (0.5 / p_scale) and abs(
@@ -1595,9 +1695,7 @@ class Editor:
                                     if closest_index is not None:
                                         self.notes_changed = True
                                         self.times_to_display = None
-                                        del self.level.notes[int(closest_time)][closest_index]
-                                        if len(self.level.notes[int(closest_time)]) == 0:
-                                            del self.level.notes[int(closest_time)]
+                                        self.level.notes.delete(self.level.notes.range(closest_time, closest_time + 1)[0] + closest_index)
                                         self.changed_since_save = True
                                         self.time_since_last_change = time.time()
                                 # Draw the note under the cursor
@@ -1611,18 +1709,15 @@ class Editor:
                                     if mouse[0] and not old_mouse[0]:
                                         self.notes_changed = True
                                         self.times_to_display = None
-                                        if int(math.ceil(self.time)) in self.level.notes:
-                                            self.level.notes[int(math.ceil(self.time))].append(draw_note_pos)
-                                        else:
-                                            self.level.notes[int(math.ceil(self.time))] = [draw_note_pos]
+                                        self.level.notes.insert(int(math.ceil(self.time)), *draw_note_pos)
                                         self.changed_since_save = True
                                         self.time_since_last_change = time.time()
                                     if keys[sdl2.SDLK_s] and spline_window_open:
                                         spline_nodes[int(self.time)] = draw_note_pos
                             else:
                                 sdl2.SDL_ShowCursor(True)
-                            if (mouse_pos[
-                                    1] > y + h + 5 - self.timeline_height or dragging_timeline) and level_was_active and not was_resizing_timeline:
+                            timeline_hovered = mouse_pos[1] > y + h + 5 - self.timeline_height
+                            if (timeline_hovered or dragging_timeline) and level_was_active and not was_resizing_timeline:
                                 if cursor != "resize_ew":
                                     if sdl2_cursor is not None:
                                         sdl2.SDL_FreeCursor(sdl2_cursor)
@@ -1631,7 +1726,7 @@ class Editor:
                                 cursor = "resize_ew"
                                 dragging_timeline = mouse[0] and not self.playing
                                 if dragging_timeline:
-                                    self.time = (mouse_pos[0] / w * timeline_width) - (self.approach_rate / 2)
+                                    self.time = timeline_start + (mouse_pos[0] / w * timeline_width) - (self.approach_rate / 2)
                                     if not (keys[sdl2.SDL_SCANCODE_LALT] or keys[
                                             sdl2.SDL_SCANCODE_RALT]) and self.bpm != 0:
                                         self.snap_time()
@@ -1640,56 +1735,13 @@ class Editor:
                                 sdl2.SDL_FreeCursor(sdl2_cursor)
                                 sdl2_cursor = None
                                 cursor = "arrow"
-                            # Draw cursor
-                            if self.cursor and (len(self.level.notes) or self.playtesting):
-                                notes = self.level.get_notes()
-                                if len(notes):
-                                    start = np.min(notes)
-                                    end = np.max(notes)
-                                if self.playtesting or (end - start):
-                                    progress = (self.time - start) / (end - start)
-                                    if (cursor_spline is None or self.notes_changed) and not self.playtesting:
-                                        nodes = []
-                                        for timing, notes in dict(sorted(self.level.notes.items())).items():
-                                            node_x, node_y = 0, 0
-                                            for x, y in notes:
-                                                node_x += x / len(notes)
-                                                node_y += y / len(notes)
-                                            nodes.append((timing, node_x, node_y))
-                                        nodes = np.array(nodes, dtype=np.float64)
-                                        cursor_spline = CubicSpline(nodes[:, 0], nodes[:, 1:])
-
-                                    if self.playtesting:
-                                        cursor_positions = [cursor_pos] + cursor_positions[
-                                            :6]  # NOTE: using a .insert breaks because of None
-                                    else:
-                                        cursor_positions = [cursor_spline(self.time - t) for t in
-                                                            range(0, 75, 1)]
-                                    self.camera_pos = ((cursor_positions[0][0] - 1) * self.parallax,
-                                                       (cursor_positions[0][1] - 1) * self.parallax)
-
-                                    def position(pos):
-                                        return self.note_pos_to_abs_pos(pos, box, 1)
-
-                                    draw_list.add_circle_filled(*position(cursor_positions[0]),
-                                                                (square_side / self.vis_map_size) / 20,
-                                                                get_time_color() if easter_egg_active else 0xFFFFFFFF,
-                                                                num_segments=32)
-                                else:
-                                    self.camera_pos = (0, 0)
-                                    cursor_positions = []
-                                draw_list.add_polyline([position(p) for p in cursor_positions],
-                                                       get_time_color() & 0x40FFFFFF if easter_egg_active else 0x40FFFFFF,
-                                                       thickness=(square_side / self.vis_map_size) / 20)
+                            self.draw_overlay(draw_list, x, y, w, h, cursor_pos,
+                                              get_time_color() if easter_egg_active else 0xFFFFFFFF)
                             # Draw current statistics
                             if not self.preview_mode:
                                 fps_text = f"{int(self.io.framerate)}{f'/{self.fps_cap}' if not self.vsync else ''} FPS"
                                 fps_size = imgui.calc_text_size(fps_text)
                                 draw_list.add_text(w - fps_size.x - 4, y + 2, 0x80FFFFFF, fps_text)
-                                if not self.preview_mode:
-                                    for rect in timeline_rects:
-                                        rect.draw(draw_list)
-                                        self.rects_drawn += 1
                                 rdtf_size = imgui.calc_text_size(f"{self.rects_drawn} rects drawn")
                                 draw_list.add_text(w - rdtf_size.x - 4, y + fps_size.y + 2, 0x80FFFFFF,
                                                    f"{self.rects_drawn} rects drawn")
@@ -1697,6 +1749,7 @@ class Editor:
                             imgui.end_child()
                         imgui.end()
                     imgui.pop_style_var(imgui.STYLE_WINDOW_PADDING)
+                    self.frame_timer.phase("ui")
                     if self.notes_changed and self.level is not None:
                         self.times_to_display = self.level.get_notes()
                         self.notes_changed = False
@@ -1749,58 +1802,98 @@ class Editor:
                 imgui.pop_style_var(1)
             old_mouse = mouse
             old_keys = keys
+            self.frame_timer.phase("render")
             GL.glClearColor(0., 0., 0., 1)
             GL.glClear(GL.GL_COLOR_BUFFER_BIT)
             imgui.render()
             impl.render(imgui.get_draw_data())
             sdl2.SDL_GL_SwapWindow(window)
             if self.playing:
-                self.time = ((time.perf_counter_ns() - self.starting_time) / (
+                self.time = ((self.input.clock() - self.starting_time) / (
                     1000000 / self.audio_speed)) + self.starting_position
             self.time = min(max(int(self.time), 0),
                             2 ** 31 - 1)  # NOTE: This needs to be 2**31-1 no matter if it's on a 32-bit or 64-bit computer, so no sys.maxsize here
             was_playing = self.playing
             self.unique_label_counter = 0
-            if not self.vsync:
+            if not self.vsync and not self.input.replaying:
+                self.frame_timer.phase("idle")
                 dt = (time.perf_counter_ns() - dt) / 1000000000
                 time.sleep(max((1 / self.fps_cap) - dt, 0))
+            self.frame_timer.end_frame()
+            if self.profiler.end_frame():
+                self.stop_profiler()
 
-    def adjust_pos(self, cen, pos, progress):
-        visual_size = 1 / (1 + ((1 - progress) * self.approach_distance))
-        return (cen * visual_size) + (pos * (1 - visual_size))
-
-    def perspective_scale(self, progress):
-        return 1 / (1 + ((1 - progress) * self.approach_distance))
-
-    def note_pos_to_abs_pos(self, note_pos, box, progress):
-        note_pos = [note_pos[0] + self.camera_pos[0], note_pos[1] + self.camera_pos[1]]
-        center = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
-        spacing = ((box[2] - box[0]) / self.vis_map_size)
-        position = (center[0] + ((note_pos[0] - 1) * spacing),
-                    center[1] + ((note_pos[1] - 1) * spacing))
-        position = (self.adjust_pos(position[0], center[0], progress),
-                    self.adjust_pos(position[1], center[1], progress))
-        return position
-
-    def draw_note(self, draw_list, note_pos, box, progress, color=0xFFFFFF, alpha=0xff, size=1.0):
-        if progress <= 1:
-            spacing = ((box[2] - box[0]) / self.vis_map_size)
-            visual_scale = (spacing / 1.25) * self.perspective_scale(progress)
-            note_size = visual_scale * size
-            position = self.note_pos_to_abs_pos(note_pos, box, progress)
-            draw_list.add_rect(position[0] - note_size // 2, position[1] - note_size // 2,
-                               position[0] + note_size // 2, position[1] + note_size // 2,
-                               (int(alpha * max(progress, 0)) << 24) | color, thickness=max((note_size // 8), 0),
-                               rounding=self.rounding * note_size / 2)
-
-            self.rects_drawn += 1
+    def finish_replay(self):
+        """Write out how the replay performed, and what the level ended up as, next to the recording."""
+        filename = self.input.filename
+        metadata = (self.bpm, self.offset, self.time_signature, self.swing)
+        profile = replay_profile(self.frame_timer, level_hash(self.level, *metadata), filename)
+        with open(f"{filename}.profile.json", "w") as f:
+            json.dump(profile, f, indent=2)
+        self.frame_timer.save_trace(f"{filename}.trace.json")
+        frame_ms = profile["frame_ms"] or {"mean": 0, "p99": 0}
+        print(f"Replayed {profile['frames']} frames in {profile['seconds']:.2f}s "
+              f"({frame_ms['mean']:.2f} ms per frame, {frame_ms['p99']:.2f} ms p99)")
+        print(f"Level hash: {profile['level_hash']}")
+        print(f"Saved the profile to {filename}.profile.json")
 
     def saveas(self):
         i = FORMATS.index(self.level.__class__)
         changed, value = self.save_file_dialog({FORMAT_NAMES[i]: FORMAT_EXTS[i]})
         if changed:
-            try:
-                self.level.save(value, self.bpm, self.offset, self.time_signature, self.swing)
+            self.start_save(value)
+
+    @property
+    def changed_since_save(self):
+        return self._changed_since_save
+
+    @changed_since_save.setter
+    def changed_since_save(self, value):
+        self._changed_since_save = value
+        if value and self.save_job is not None and self.save_job.level is self.level:
+            self.save_job.edited = True  # Not in the snapshot, so it stays unsaved once the save is done
+
+    def has_unsaved_changes(self):
+        # Nothing is saved until the save in progress is done
+        return self.changed_since_save or bool(self.unsaved_difficulties) or self.save_job is not None
+
+    def switch_difficulty(self, name):
+        """Switch to another difficulty of the open Vulnus map, keeping the audio and cover that are already loaded."""
+        if self.changed_since_save:
+            self.unsaved_difficulties.add(self.map_set.name_of(self.level))
+        level = self.map_set.levels[name]
+        level.link_assets(self.level)
+        self.level = level
+        self.filename = str(self.map_set.directory / name)
+        self.changed_since_save = name in self.unsaved_difficulties
+        self.unsaved_difficulties.discard(name)
+        self.notes_changed = True
+        self.times_to_display = None
+        self.timings = np.array((), dtype=np.int64)
+
+    def start_save(self, filename):
+        if self.input.replaying:
+            print(f"/!\\ Not saving to {filename}, since this is a replay.")
+            self.changed_since_save = False
+            return
+        if self.save_job is not None:
+            return  # Still saving, changed_since_save stays set so it's clear this didn't go through
+        if self.map_set is not None and not self.map_set.place(self.level, filename):
+            self.map_set = None  # Saved somewhere else, so it's on its own now
+            self.unsaved_difficulties = set()
+        self.save_job = BackgroundSave(self.level, filename, self.bpm, self.offset, self.time_signature, self.swing)
+        self.filename = filename
+
+    def check_save(self):
+        if self.save_job is None or not self.save_job.done:
+            return
+        job, self.save_job = self.save_job, None
+        job.finish()
+        if job.error is not None:
+            self.error = job.error
+        elif not job.edited:
+            if job.level is self.level:
                 self.changed_since_save = False
-            except Exception as e:
-                self.error = e
+            elif self.map_set is not None and self.map_set.name_of(job.level) is not None:
+                # Switched to another difficulty while it was saving
+                self.unsaved_difficulties.discard(self.map_set.name_of(job.level))
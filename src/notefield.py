@@ -0,0 +1,256 @@
+"""
+Draws the notes in the level view with OpenGL, as one instanced draw call into a texture that imgui then shows.
+The perspective, the fade in and the rounded outlines are all worked out in the shaders, so the CPU only has to
+hand over where each visible note is, when, and in what color.
+"""
+import ctypes
+
+import numpy as np
+import OpenGL.GL as GL
+from OpenGL.GL import shaders
+
+from src.view import NOTE_INSTANCE_DTYPE
+
+NOTE_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 corner;
+layout(location = 1) in float note_time;
+layout(location = 2) in vec2 note_position;
+layout(location = 3) in vec4 note_color;
+
+uniform vec2 viewport;
+uniform vec4 box;
+uniform vec2 camera;
+uniform float map_size;
+uniform float approach_rate;
+uniform float approach_distance;
+uniform float rounding;
+
+out vec2 local;
+out vec4 color;
+flat out float half_size;
+flat out float thickness;
+flat out float radius;
+
+void main() {
+    float progress = 1.0 - note_time / approach_rate;
+    if (progress > 1.0) {
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);  // Past the camera, so it's clipped
+        return;
+    }
+    float scale = 1.0 / (1.0 + (1.0 - progress) * approach_distance);
+    vec2 center = (box.xy + box.zw) / 2.0;
+    float spacing = (box.z - box.x) / map_size;
+    vec2 position = center + (note_position + camera - 1.0) * spacing;
+    position = position * scale + center * (1.0 - scale);
+    float note_size = spacing / 1.25 * scale;
+    half_size = floor(note_size / 2.0);
+    thickness = max(floor(note_size / 8.0), 0.0);
+    radius = rounding * note_size / 2.0;
+    // Room for the outline, and a pixel to smooth its edge
+    local = corner * (half_size + thickness + 1.0);
+    vec2 pixel = position + local;
+    gl_Position = vec4(pixel / viewport * 2.0 - 1.0, 0.0, 1.0);
+    color = vec4(note_color.rgb, floor(note_color.a * 255.0 * max(progress, 0.0)) / 255.0);
+}
+"""
+
+NOTE_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 local;
+in vec4 color;
+flat in float half_size;
+flat in float thickness;
+flat in float radius;
+
+out vec4 fragment;
+
+void main() {
+    // Like imgui's outlines, centered half a pixel inside the note's edge
+    vec2 extent = vec2(max(half_size - 0.5, 0.0));
+    float corner = clamp(radius, 0.0, extent.x);
+    vec2 q = abs(local) - extent + corner;
+    float edge = length(max(q, 0.0)) + min(max(q.x, q.y), 0.0) - corner;
+    float coverage = clamp(thickness / 2.0 - abs(edge) + 0.5, 0.0, 1.0) * color.a;
+    if (coverage <= 0.0) {
+        discard;
+    }
+    fragment = vec4(color.rgb * coverage, coverage);  // Premultiplied, so overlapping notes blend right
+}
+"""
+
+# imgui blends textures as if they weren't premultiplied, so this undoes it
+RESOLVE_VERTEX_SHADER = """
+#version 330 core
+out vec2 uv;
+
+void main() {
+    uv = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+    gl_Position = vec4(uv * 2.0 - 1.0, 0.0, 1.0);
+}
+"""
+
+RESOLVE_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 uv;
+uniform sampler2D notes;
+out vec4 fragment;
+
+void main() {
+    vec4 premultiplied = texture(notes, uv);
+    fragment = premultiplied.a > 0.0 ? vec4(premultiplied.rgb / premultiplied.a, premultiplied.a) : vec4(0.0);
+}
+"""
+
+
+class _Target:
+    """A texture to draw into."""
+
+    def __init__(self, width, height):
+        self.texture = int(GL.glGenTextures(1))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        self.framebuffer = int(GL.glGenFramebuffers(1))
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, self.texture, 0)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            raise Exception(f"Couldn't make a framebuffer for the notes (status {status:#x}).")
+
+    def delete(self):
+        GL.glDeleteFramebuffers(1, [self.framebuffer])
+        GL.glDeleteTextures([self.texture])
+
+
+class NoteFieldRenderer:
+    """
+    Draws note_instances() from the level view with the GPU. Needs the editor's GL context to be current,
+    and leaves the GL state the way it found it, since it draws in the middle of building imgui's frame.
+    """
+
+    def __init__(self):
+        # Not validated, since that checks them against the current GL state, and fails with no vertex array bound
+        self.program = shaders.compileProgram(shaders.compileShader(NOTE_VERTEX_SHADER, GL.GL_VERTEX_SHADER),
+                                              shaders.compileShader(NOTE_FRAGMENT_SHADER, GL.GL_FRAGMENT_SHADER),
+                                              validate=False)
+        self.resolve_program = shaders.compileProgram(
+            shaders.compileShader(RESOLVE_VERTEX_SHADER, GL.GL_VERTEX_SHADER),
+            shaders.compileShader(RESOLVE_FRAGMENT_SHADER, GL.GL_FRAGMENT_SHADER), validate=False)
+        self.uniforms = {name: GL.glGetUniformLocation(self.program, name) for name in (
+            "viewport", "box", "camera", "map_size", "approach_rate", "approach_distance", "rounding")}
+        self.notes_uniform = GL.glGetUniformLocation(self.resolve_program, "notes")
+        self.vertex_array = int(GL.glGenVertexArrays(1))
+        self.empty_vertex_array = int(GL.glGenVertexArrays(1))  # The resolve pass makes its own vertices
+        self.corners = int(GL.glGenBuffers(1))
+        self.instances = int(GL.glGenBuffers(1))
+        self.instance_capacity = 0
+        self.size = None
+        self.drawn = None  # Premultiplied notes
+        self.resolved = None  # What imgui gets
+
+        previous = self._save_state()
+        try:
+            GL.glBindVertexArray(self.vertex_array)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.corners)
+            corners = np.array(((-1, -1), (1, -1), (-1, 1), (1, 1)), dtype=np.float32)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, corners.nbytes, corners, GL.GL_STATIC_DRAW)
+            GL.glEnableVertexAttribArray(0)
+            GL.glVertexAttribPointer(0, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, None)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instances)
+            stride = NOTE_INSTANCE_DTYPE.itemsize
+            for location, field, size, kind, normalized in (
+                    (1, "time", 1, GL.GL_FLOAT, GL.GL_FALSE),
+                    (2, "position", 2, GL.GL_FLOAT, GL.GL_FALSE),
+                    (3, "color", 4, GL.GL_UNSIGNED_BYTE, GL.GL_TRUE)):
+                GL.glEnableVertexAttribArray(location)
+                GL.glVertexAttribPointer(location, size, kind, normalized, stride,
+                                         ctypes.c_void_p(NOTE_INSTANCE_DTYPE.fields[field][1]))
+                GL.glVertexAttribDivisor(location, 1)
+        finally:
+            self._restore_state(previous)
+
+    @staticmethod
+    def _save_state() -> tuple:
+        return (GL.glGetIntegerv(GL.GL_FRAMEBUFFER_BINDING), GL.glGetIntegerv(GL.GL_VIEWPORT),
+                GL.glGetIntegerv(GL.GL_CURRENT_PROGRAM), GL.glGetIntegerv(GL.GL_VERTEX_ARRAY_BINDING),
+                GL.glGetIntegerv(GL.GL_ARRAY_BUFFER_BINDING), GL.glGetIntegerv(GL.GL_ACTIVE_TEXTURE),
+                GL.glGetIntegerv(GL.GL_TEXTURE_BINDING_2D), GL.glIsEnabled(GL.GL_BLEND),
+                GL.glIsEnabled(GL.GL_SCISSOR_TEST), GL.glGetIntegerv(GL.GL_BLEND_SRC_RGB),
+                GL.glGetIntegerv(GL.GL_BLEND_DST_RGB), GL.glGetIntegerv(GL.GL_BLEND_SRC_ALPHA),
+                GL.glGetIntegerv(GL.GL_BLEND_DST_ALPHA), GL.glGetFloatv(GL.GL_COLOR_CLEAR_VALUE))
+
+    @staticmethod
+    def _restore_state(state):
+        (framebuffer, viewport, program, vertex_array, array_buffer, active_texture, texture, blend, scissor,
+         src_rgb, dst_rgb, src_alpha, dst_alpha, clear_color) = state
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, int(framebuffer))
+        GL.glViewport(*(int(value) for value in viewport))
+        GL.glUseProgram(int(program))
+        GL.glBindVertexArray(int(vertex_array))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, int(array_buffer))
+        GL.glActiveTexture(int(active_texture))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, int(texture))
+        (GL.glEnable if blend else GL.glDisable)(GL.GL_BLEND)
+        (GL.glEnable if scissor else GL.glDisable)(GL.GL_SCISSOR_TEST)
+        GL.glBlendFuncSeparate(int(src_rgb), int(dst_rgb), int(src_alpha), int(dst_alpha))
+        GL.glClearColor(*clear_color)
+
+    def _resize(self, width, height):
+        if self.size == (width, height):
+            return
+        for target in (self.drawn, self.resolved):
+            if target is not None:
+                target.delete()
+        self.drawn = _Target(width, height)
+        self.resolved = _Target(width, height)
+        self.size = width, height
+
+    def render(self, instances, box, x, y, w, h, view) -> int:
+        """
+        Draw instances into a w by h texture, for a level view at (x, y) drawn with view's settings,
+        and return the texture's id.
+        """
+        width, height = max(int(w), 1), max(int(h), 1)
+        previous = self._save_state()
+        try:
+            self._resize(width, height)
+            GL.glBindVertexArray(self.vertex_array)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instances)
+            if len(instances) > self.instance_capacity:
+                # Grown in steps, so a few more notes coming in doesn't mean reallocating every frame
+                self.instance_capacity = max(len(instances), self.instance_capacity * 2, 256)
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, self.instance_capacity * NOTE_INSTANCE_DTYPE.itemsize, None,
+                                GL.GL_STREAM_DRAW)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, instances.nbytes, instances.view(np.uint8))
+
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.drawn.framebuffer)
+            GL.glViewport(0, 0, width, height)
+            GL.glDisable(GL.GL_SCISSOR_TEST)
+            GL.glClearColor(0, 0, 0, 0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            GL.glEnable(GL.GL_BLEND)
+            GL.glBlendFuncSeparate(GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA, GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+            GL.glUseProgram(self.program)
+            GL.glUniform2f(self.uniforms["viewport"], width, height)
+            # The box is relative to the texture, which starts at the view's corner
+            GL.glUniform4f(self.uniforms["box"], box[0] - x, box[1] - y, box[2] - x, box[3] - y)
+            GL.glUniform2f(self.uniforms["camera"], *view.camera_pos)
+            GL.glUniform1f(self.uniforms["map_size"], view.vis_map_size)
+            GL.glUniform1f(self.uniforms["approach_rate"], view.approach_rate)
+            GL.glUniform1f(self.uniforms["approach_distance"], view.approach_distance)
+            GL.glUniform1f(self.uniforms["rounding"], view.rounding)
+            GL.glDrawArraysInstanced(GL.GL_TRIANGLE_STRIP, 0, 4, len(instances))
+
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.resolved.framebuffer)
+            GL.glDisable(GL.GL_BLEND)
+            GL.glUseProgram(self.resolve_program)
+            GL.glActiveTexture(GL.GL_TEXTURE0)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self.drawn.texture)
+            GL.glUniform1i(self.notes_uniform, 0)
+            GL.glBindVertexArray(self.empty_vertex_array)
+            GL.glDrawArrays(GL.GL_TRIANGLES, 0, 3)
+        finally:
+            self._restore_state(previous)
+        return self.resolved.texture
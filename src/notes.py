@@ -0,0 +1,160 @@
+import numpy as np
+
+NOTE_DTYPE = np.dtype([
+    ("time", np.int32),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("quantum", np.bool_)  # Stored as floats instead of on the byte grid
+])
+
+
+class NoteStore:
+    """
+    Notes, kept as a structured array sorted by time.
+    Notes that share a time stay in the order they were added.
+    """
+
+    def __init__(self, data: np.ndarray = None):
+        self._data = np.zeros(0, dtype=NOTE_DTYPE) if data is None else data
+        self.version = 0  # Bumped on every change, so callers can cache things derived from the notes
+        self._unique_times = None
+
+    @classmethod
+    def from_arrays(cls, times, xs, ys, quantum=True):
+        data = np.zeros(len(times), dtype=NOTE_DTYPE)
+        data["time"] = times
+        data["x"] = xs
+        data["y"] = ys
+        data["quantum"] = quantum
+        if data.size > 1 and np.any(np.diff(data["time"]) < 0):
+            data = data[np.argsort(data["time"], kind="stable")]
+        return cls(data)
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} notes)"
+
+    @property
+    def data(self) -> np.ndarray:
+        """The underlying array. Don't modify it directly, or cached values will go stale."""
+        return self._data
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._data["time"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        return np.column_stack((self._data["x"], self._data["y"]))
+
+    def copy(self):
+        store = self.__class__(self._data.copy())
+        store.version = self.version
+        return store
+
+    def _changed(self):
+        self.version += 1
+        self._unique_times = None
+
+    def unique_times(self) -> np.ndarray:
+        """Sorted times that have at least one note on them."""
+        if self._unique_times is None:
+            times = self.times
+            if times.size:
+                self._unique_times = times[np.concatenate(((True,), times[1:] != times[:-1]))]
+            else:
+                self._unique_times = times.copy()
+        return self._unique_times
+
+    def end(self):
+        return int(self._data["time"][-1]) if len(self) else None
+
+    def range(self, start, stop) -> tuple[int, int]:
+        """Indices of the notes with start <= time < stop."""
+        times = self.times
+        return int(np.searchsorted(times, start, "left")), int(np.searchsorted(times, stop, "left"))
+
+    def at(self, time) -> np.ndarray:
+        lo, hi = self.range(time, time + 1)
+        return self._data[lo:hi]
+
+    def positions_at(self, time) -> np.ndarray:
+        notes = self.at(time)
+        return np.column_stack((notes["x"], notes["y"]))
+
+    def __contains__(self, time):
+        lo, hi = self.range(time, time + 1)
+        return hi > lo
+
+    def insert(self, time, x, y, quantum=True) -> int:
+        index = int(np.searchsorted(self.times, time, "right"))
+        note = np.zeros(1, dtype=NOTE_DTYPE)
+        note[0] = (time, x, y, quantum)
+        self._data = np.insert(self._data, index, note)
+        self._changed()
+        return index
+
+    def extend(self, times, xs, ys, quantum=True):
+        added = self.from_arrays(times, xs, ys, quantum)._data
+        if not added.size:
+            return
+        data = np.concatenate((self._data, added))
+        self._data = data[np.argsort(data["time"], kind="stable")]
+        self._changed()
+
+    def delete(self, indices):
+        self._data = np.delete(self._data, indices)
+        self._changed()
+
+    def delete_range(self, start, stop):
+        lo, hi = self.range(start, stop)
+        if hi > lo:
+            self.delete(np.s_[lo:hi])
+
+    def shift(self, offset):
+        self._data["time"] += offset
+        self._changed()
+
+    def centroids(self) -> tuple[np.ndarray, np.ndarray]:
+        """The average position of the notes at each unique time."""
+        times = self.times
+        if not times.size:
+            return times.copy(), np.zeros((0, 2))
+        starts = np.flatnonzero(np.concatenate(((True,), times[1:] != times[:-1])))
+        counts = np.diff(np.append(starts, times.size))
+        sums = np.add.reduceat(self.positions, starts, axis=0)
+        return times[starts], sums / counts[:, None]
+
+
+class NoteWindow:
+    """
+    The indices of the sorted times from start up to stop, for notes that are on screen.
+    When the window only moves forward a little, like during playback, it steps from where it was last time
+    instead of searching again, so it costs about as much as the notes that came in or went out.
+    """
+    MAX_STEPS = 16  # Past this many notes, searching is faster
+
+    def __init__(self):
+        self._times = None
+        self._start = self._stop = None
+        self.lo = self.hi = 0
+
+    def find(self, times, start, stop) -> tuple[int, int]:
+        """times[lo:hi] are the times with start <= time < stop."""
+        if times is not self._times or self._start is None or start < self._start or stop < self._stop:
+            self.lo, self.hi = (int(i) for i in np.searchsorted(times, (start, stop), "left"))
+        else:
+            self.lo = self._step(times, self.lo, start)
+            self.hi = self._step(times, self.hi, stop)
+        self._times, self._start, self._stop = times, start, stop
+        return self.lo, self.hi
+
+    def _step(self, times, index, bound) -> int:
+        end = len(times)
+        for _ in range(self.MAX_STEPS):
+            if index >= end or times[index] >= bound:
+                return index
+            index += 1
+        return index + int(np.searchsorted(times[index:], bound, "left"))
@@ -0,0 +1,163 @@
+"""
+Timing for the editor's frame loop. This doesn't import anything from the editor, so it can time scripts too.
+"""
+import cProfile
+import json
+import os
+import pstats
+import time
+
+import numpy as np
+
+MAX_PHASES = 32
+
+
+class FrameTimer:
+    """
+    Times the phases of each frame, keeping the last few hundred frames in a ring buffer.
+
+    A frame is split into phases with phase(name): each one lasts until the next one starts, or the frame ends,
+    so they add up to the whole frame and can be shown stacked. A phase can come up more than once in a frame,
+    its times are added together.
+    """
+
+    def __init__(self, capacity=600):
+        self.capacity = capacity
+        self.phases = []  # Phase names, in the order they were first seen
+        self._phase_index = {}
+        self._durations = np.zeros((capacity, MAX_PHASES), dtype=np.float64)  # Milliseconds spent in each phase
+        self._frame_ms = np.zeros(capacity, dtype=np.float64)
+        self._frame_events = [[] for _ in range(capacity)]  # (name, start, end, depth) in nanoseconds, for traces
+        self._events = None  # The current frame's events, or None between frames
+        self._frame_start = 0
+        self._phase = None
+        self._phase_start = 0
+        self.frames = 0  # Frames recorded in total, including ones that were overwritten since
+        self.paused = False
+        self.epoch = time.perf_counter_ns()
+
+    def begin_frame(self):
+        if self.paused:
+            return
+        row = self.frames % self.capacity
+        self._durations[row] = 0
+        self._events = self._frame_events[row]
+        self._events.clear()
+        self._frame_start = self._phase_start = time.perf_counter_ns()
+        self._phase = None
+
+    def _end_phase(self, now):
+        if self._phase is not None:
+            self._events.append((self._phase, self._phase_start, now, 1))
+            index = self._phase_index.get(self._phase)
+            if index is None:
+                if len(self.phases) >= MAX_PHASES:
+                    raise Exception(f"Too many frame phases! Only {MAX_PHASES} can be timed.")
+                index = self._phase_index[self._phase] = len(self.phases)
+                self.phases.append(self._phase)
+            self._durations[self.frames % self.capacity, index] += (now - self._phase_start) / 1_000_000
+
+    def phase(self, name):
+        """End the current phase and start another one."""
+        if self._events is None:
+            return
+        now = time.perf_counter_ns()
+        self._end_phase(now)
+        self._phase, self._phase_start = name, now
+
+    def end_frame(self):
+        if self._events is None:
+            return
+        now = time.perf_counter_ns()
+        self._end_phase(now)
+        self._events.append(("frame", self._frame_start, now, 0))
+        self._frame_ms[self.frames % self.capacity] = (now - self._frame_start) / 1_000_000
+        self._events = None
+        self.frames += 1
+
+    def _rows(self) -> np.ndarray:
+        """Indices of the recorded frames in the ring buffer, oldest first."""
+        count = min(self.frames, self.capacity)
+        return (np.arange(self.frames - count, self.frames)) % self.capacity
+
+    def history(self, frames=None) -> tuple:
+        """
+        The phase names, how long each phase took in the last frames as an array of (frame, phase) in milliseconds,
+        and how long those frames took, oldest first.
+        """
+        rows = self._rows()
+        if frames is not None:
+            rows = rows[-frames:]
+        return list(self.phases), self._durations[rows, :len(self.phases)], self._frame_ms[rows]
+
+    def trace(self) -> dict:
+        """The recorded frames in Chrome's trace event format, which Perfetto and chrome://tracing can open."""
+        events = []
+        for row in self._rows().tolist():
+            for name, start, end, depth in self._frame_events[row]:
+                events.append({
+                    "name": name, "cat": "frame" if depth == 0 else "phase", "ph": "X",
+                    "ts": (start - self.epoch) / 1000, "dur": (end - start) / 1000, "pid": os.getpid(), "tid": 1
+                })
+        # Viewers nest events by time, so outer ones have to come first when they start together
+        events.sort(key=lambda event: (event["ts"], -event["dur"]))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.trace(), f)
+
+
+def hot_functions(stats, count=20) -> list:
+    """The functions that took the most time by themselves, as (name, calls, own ms, total ms)."""
+    rows = []
+    for (filename, line, function), (_, calls, own, total, _) in stats.stats.items():
+        if filename == "~":  # Built in, so there's no file to point at
+            name = function
+        else:
+            name = f"{function} ({os.path.basename(filename)}:{line})"
+        rows.append((name, calls, own * 1000, total * 1000))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:count]
+
+
+class FrameProfiler:
+    """
+    Profiles every function call made over some number of frames with cProfile, for when phase times aren't enough.
+    This slows frames down a lot while it's running, so it's only meant to be turned on for a moment.
+    """
+
+    def __init__(self):
+        self._profile = None
+        self.frames_left = 0
+        self.frames = 0  # Frames profiled by the current or last run
+        self.filename = None  # Where the last run was saved
+        self.top = []  # The last run's hot_functions
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self, frames):
+        profile = cProfile.Profile()
+        profile.enable()  # Raises ValueError if another profiler is already running
+        self._profile = profile
+        self.frames_left = frames
+        self.frames = 0
+
+    def end_frame(self) -> bool:
+        """Count a frame, returning True once enough frames have been profiled."""
+        if self._profile is None:
+            return False
+        self.frames += 1
+        self.frames_left -= 1
+        return self.frames_left <= 0
+
+    def stop(self, filename, count=20):
+        """Stop profiling, and save the stats to filename, which snakeviz and pstats can open."""
+        profile, self._profile = self._profile, None
+        profile.disable()
+        stats = pstats.Stats(profile)
+        self.top = hot_functions(stats, count)
+        stats.dump_stats(filename)
+        self.filename = filename
@@ -0,0 +1,212 @@
+"""
+Records everything an editor session takes in from outside, so it can be played back exactly.
+
+That's the SDL events, the mouse and window state imgui reads every frame, every read of the clock,
+and whatever the file dialogs returned. A replay feeds those back in the same order, so the editor
+goes through the same frames and ends up with the same level, however fast the replay runs.
+"""
+import ctypes
+import gzip
+import hashlib
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import sdl2
+
+MAGIC = b"SSPyRec"
+VERSION = 1
+EVENT_SIZE = ctypes.sizeof(sdl2.SDL_Event)
+# Frame start: delta time, mouse position, mouse buttons, display size
+FRAME = struct.Struct("<fffBff")
+MODS = struct.Struct("<B")  # Ctrl, shift, alt and super, after the frame's events
+CLOCK = struct.Struct("<q")
+LENGTH = struct.Struct("<I")
+# Dropped files point at memory SDL frees right after, so they can't be recorded
+UNRECORDED_EVENTS = (sdl2.SDL_DROPFILE, sdl2.SDL_DROPTEXT, sdl2.SDL_DROPBEGIN, sdl2.SDL_DROPCOMPLETE)
+
+
+def level_hash(level, *metadata):
+    """A hash of everything that's saved about a level besides its audio and cover."""
+    if level is None:
+        return None
+    digest = hashlib.sha256(level.notes.data.tobytes())
+    digest.update(json.dumps({
+        "name": level.name, "authors": level.authors, "difficulty": str(level.difficulty),
+        "markers": getattr(level, "markers", None), "custom_fields": getattr(level, "custom_fields", None),
+        "metadata": metadata,
+    }, sort_keys=True, default=repr).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class ReplayDesync(Exception):
+    pass
+
+
+class LiveInput:
+    """Input straight from SDL, the clock and the dialogs. This is what the editor uses normally."""
+    replaying = False
+
+    def begin_frame(self, io) -> bool:
+        """Call right after imgui's inputs are processed. Returns False once there's nothing left to replay."""
+        return True
+
+    def poll(self, event) -> bool:
+        return sdl2.SDL_PollEvent(ctypes.byref(event)) != 0
+
+    def end_events(self, io):
+        """Call once the frame's events have been handled."""
+        pass
+
+    def clock(self) -> int:
+        return time.perf_counter_ns()
+
+    def dialog(self, ask) -> str:
+        """Show a file dialog, given as a function that shows it and returns what was picked."""
+        return ask()
+
+    def close(self):
+        pass
+
+
+class InputRecorder(LiveInput):
+    """Takes input like LiveInput, and writes it all to a file as it goes."""
+
+    def __init__(self, filename, startup_file=None):
+        self.filename = filename
+        self.file = gzip.open(filename, "wb")
+        header = {
+            "event_size": EVENT_SIZE,
+            "startup_file": None if startup_file is None else os.path.abspath(startup_file),
+            "startup_hash": None if startup_file is None else file_hash(startup_file),
+            "recorded": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        header = json.dumps(header).encode("utf-8")
+        self.file.write(MAGIC + bytes((VERSION,)) + LENGTH.pack(len(header)) + header)
+
+    def begin_frame(self, io) -> bool:
+        buttons = sum(bool(io.mouse_down[i]) << i for i in range(3))
+        self.file.write(b"F" + FRAME.pack(io.delta_time, *io.mouse_pos, buttons, *io.display_size))
+        return True
+
+    def poll(self, event) -> bool:
+        if not super().poll(event):
+            return False
+        if event.type not in UNRECORDED_EVENTS:
+            self.file.write(b"E" + ctypes.string_at(ctypes.byref(event), EVENT_SIZE))
+        return True
+
+    def end_events(self, io):
+        self.file.write(b"M" + MODS.pack(io.key_ctrl | io.key_shift << 1 | io.key_alt << 2 | io.key_super << 3))
+
+    def clock(self) -> int:
+        now = super().clock()
+        self.file.write(b"C" + CLOCK.pack(now))
+        return now
+
+    def dialog(self, ask) -> str:
+        picked = super().dialog(ask).encode("utf-8")
+        self.file.write(b"D" + LENGTH.pack(len(picked)) + picked)
+        return picked.decode("utf-8")
+
+    def close(self):
+        self.file.close()
+        print(f"Saved the recording to {self.filename}")
+
+
+class InputReplayer(LiveInput):
+    """
+    Feeds a recording back to the editor. Each read has to match what was recorded next,
+    otherwise the session went differently than when it was recorded, and a ReplayDesync is raised.
+    """
+    replaying = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        with gzip.open(filename, "rb") as f:
+            self.data = f.read()
+        assert self.data[:len(MAGIC)] == MAGIC, "This isn't an SSPy recording!"
+        version = self.data[len(MAGIC)]
+        assert version == VERSION, f"Unknown recording version: {version}"
+        pos = len(MAGIC) + 1
+        header_length, = LENGTH.unpack_from(self.data, pos)
+        pos += LENGTH.size
+        self.header = json.loads(self.data[pos:pos + header_length])
+        assert self.header["event_size"] == EVENT_SIZE, "This recording was made with a different version of SDL."
+        self.pos = pos + header_length
+        self.frames = self.data.count(b"F")  # At least as many as there are, for sizing the frame timer
+
+    def startup_file(self):
+        """The map that was open when recording started, if it's still the same file."""
+        filename = self.header["startup_file"]
+        if filename is None:
+            return None
+        if not os.path.exists(filename) or file_hash(filename) != self.header["startup_hash"]:
+            print(f"/!\\ {filename} changed since it was recorded, so the replay might not match.")
+        return filename
+
+    def _next(self, tag, size=0) -> bytes:
+        if self.pos >= len(self.data):
+            raise ReplayDesync(f"The recording ended while the editor was still reading it (expected {tag!r}).")
+        found = self.data[self.pos:self.pos + 1]
+        if found != tag:
+            raise ReplayDesync(f"Expected {tag!r} but the recording has {found!r} at byte {self.pos}. "
+                               "The session went differently than when it was recorded.")
+        start = self.pos + 1
+        self.pos = start + size
+        return self.data[start:self.pos]
+
+    def begin_frame(self, io) -> bool:
+        if self.pos >= len(self.data):
+            return False
+        delta_time, mouse_x, mouse_y, buttons, width, height = FRAME.unpack(self._next(b"F", FRAME.size))
+        io.delta_time = delta_time
+        io.mouse_pos = mouse_x, mouse_y
+        for i in range(3):
+            io.mouse_down[i] = bool(buttons & (1 << i))
+        io.display_size = width, height
+        return True
+
+    def poll(self, event) -> bool:
+        if self.data[self.pos:self.pos + 1] != b"E":
+            return False
+        ctypes.memmove(ctypes.byref(event), self._next(b"E", EVENT_SIZE), EVENT_SIZE)
+        return True
+
+    def end_events(self, io):
+        mods, = MODS.unpack(self._next(b"M", MODS.size))
+        io.key_ctrl, io.key_shift, io.key_alt, io.key_super = (bool(mods & (1 << i)) for i in range(4))
+
+    def clock(self) -> int:
+        return CLOCK.unpack(self._next(b"C", CLOCK.size))[0]
+
+    def dialog(self, ask) -> str:
+        length, = LENGTH.unpack(self._next(b"D", LENGTH.size))
+        start = self.pos
+        self.pos += length
+        return self.data[start:self.pos].decode("utf-8")
+
+
+def replay_profile(timer, level_hash, filename) -> dict:
+    """Sum up how a replay went, from the frame timer that timed it."""
+    phases, durations, frame_ms = timer.history()
+    return {
+        "replay": os.path.abspath(filename),
+        "frames": len(frame_ms),
+        "seconds": float(frame_ms.sum() / 1000),
+        "fps": float(len(frame_ms) / (frame_ms.sum() / 1000)) if frame_ms.sum() else None,
+        "frame_ms": {
+            "mean": float(frame_ms.mean()), "p50": float(np.percentile(frame_ms, 50)),
+            "p95": float(np.percentile(frame_ms, 95)), "p99": float(np.percentile(frame_ms, 99)),
+            "max": float(frame_ms.max()),
+        } if len(frame_ms) else None,
+        "phases_ms": {phase: float(duration) for phase, duration in zip(phases, durations.mean(axis=0))},
+        "level_hash": level_hash,
+    }
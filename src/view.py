@@ -0,0 +1,632 @@
+"""
+Draws the level view: the notes coming in, beat lines, markers, the cursor, and the timeline along the bottom.
+Everything goes through the draw list it's given, and text is measured through methods the editor overrides,
+so this runs without imgui or a window, e.g. against a stub draw list for benchmarking.
+"""
+import math
+
+import numpy as np
+
+import src.beats as beats
+from src.level import SSPMLevel
+from src.notes import NoteWindow
+from src.profiling import FrameTimer
+from src.waveform import WaveformBuild
+
+MAX_TIMELINE_ZOOM = 256
+
+
+class DelayedRect:
+    def __init__(self, box: tuple[int, int, int, int], color: int, filled: bool = True, thickness: float = 1):
+        self.box = box
+        self.color = color
+        self.filled = filled
+        self.thickness = thickness
+
+    def draw(self, draw_list):
+        if self.filled:
+            draw_list.add_rect_filled(*self.box, self.color)
+        else:
+            draw_list.add_rect(*self.box, self.color, self.thickness)
+
+
+class DelayedImage:
+    def __init__(self, texture_id: int, box: tuple[int, int, int, int], uv_a=(0, 0), uv_b=(1, 1)):
+        self.texture_id = texture_id
+        self.box = box
+        self.uv_a = uv_a
+        self.uv_b = uv_b
+
+    def draw(self, draw_list):
+        draw_list.add_image(self.texture_id, self.box[:2], self.box[2:], self.uv_a, self.uv_b)
+
+
+class TimelineStrip:
+    """
+    Part of the timeline drawn into a texture, along with some of either side of it while zoomed in.
+    As the timeline follows the playhead, the texture is only moved, by offsetting its UVs, until the view leaves it.
+    """
+
+    def __init__(self):
+        self.key = None  # What it was drawn for, besides where
+        self.texture = None
+        self.start = 0
+        self.span = 0
+
+    def covers(self, key, start, span) -> bool:
+        return key == self.key and self.start <= start and start + span <= self.start + self.span
+
+    def place(self, key, start, span, width, margin) -> tuple:
+        """
+        Move the strip to cover span milliseconds from start, shown width pixels wide, with margin more milliseconds
+        on either side. Returns where it starts, how many milliseconds it covers and how many pixels wide it is.
+        """
+        self.key = key
+        self.start = start - margin
+        self.span = span + 2 * margin
+        return self.start, self.span, round(width * self.span / span)
+
+    def image(self, start, span, box) -> DelayedImage:
+        """The part of the strip from start, span milliseconds long, drawn over box."""
+        left = (start - self.start) / self.span
+        return DelayedImage(self.texture, box, (left, 0), (left + span / self.span, 1))
+
+
+def bin_ticks(times, colors, start, span, width) -> tuple:
+    """
+    Which of width pixel columns each of the sorted note times falls in, for a timeline showing span milliseconds
+    from start. Returns how many notes are in each column, and the color of the last one (from colors, by index).
+    """
+    counts = np.zeros(width, dtype=np.int64)
+    top = np.zeros(width, dtype=np.uint32)
+    first, last = np.searchsorted(times, (start, start + span), side="left")
+    if width <= 0 or first >= last or span <= 0:
+        return counts, top
+    columns = ((times[first:last] - start) / span * width).astype(np.int64)
+    counts += np.bincount(columns, minlength=width)[:width]
+    # Notes are sorted, so the last one in each column is right before where the next column starts
+    filled = counts > 0
+    ends = np.searchsorted(columns, np.flatnonzero(filled), side="right") - 1
+    palette = np.array(colors, dtype=np.uint32)
+    top[filled] = palette[(first + ends) % len(palette)]
+    return counts, top
+
+
+def tick_alpha(counts, alpha=0x40) -> np.ndarray:
+    """The alpha of counts ticks of the given alpha drawn over each other."""
+    return (255 * (1 - (1 - alpha / 255) ** counts)).astype(np.uint8)
+
+
+# A visible note, as it's handed to render_notes: how far ahead of the current time it is, where it is, and its color
+NOTE_INSTANCE_DTYPE = np.dtype([
+    ("time", np.float32),
+    ("position", np.float32, 2),
+    ("color", np.uint32),  # ABGR, like imgui's, so its bytes are RGBA
+])
+
+
+def rasterize_waveform(low, high, width, height, column_width, color=(0xFF, 0xFF, 0xFF, 0x20)) -> np.ndarray:
+    """
+    Draw a waveform's peaks (from WaveformPyramid.peaks) as an RGBA image, one bar column_width pixels wide per peak,
+    the same as drawing each bar as a rect would.
+    """
+    shown = ~np.isnan(low)
+    scale = 0.8 * (height // 2)
+    tops = np.zeros(len(low), dtype=np.int64)
+    bottoms = np.zeros(len(low), dtype=np.int64)
+    tops[shown] = (high[shown] * scale).astype(np.int64)
+    bottoms[shown] = (low[shown] * scale).astype(np.int64)
+    # Bars go from one peak to the other, whichever way around they are
+    first_row = np.minimum(tops, bottoms) + height // 2
+    last_row = np.maximum(tops, bottoms) + height // 2
+    # A pixel per bar first, then widened, which is much less to compare
+    rows = np.arange(height)[:, None]
+    bars = (rows >= first_row) & (rows < last_row) & shown
+    filled = np.zeros((height, width), dtype=np.uint8)
+    widened = np.repeat(bars, column_width, axis=1)[:, :width]
+    filled[:, :widened.shape[1]] = widened
+    # Every pixel gets the color, and the alpha decides whether there's a bar there
+    image = np.empty((height, width, 4), dtype=np.uint8)
+    image[..., :3] = color[:3]
+    image[..., 3] = filled * np.uint8(color[3])
+    return image
+
+
+class LevelView:
+    """
+    What's needed to draw a level, and the drawing itself. The editor builds on this.
+    """
+    uses_textures = False  # Whether parts that rarely change can be cached in textures, with upload_image
+    gpu_notes = False  # Whether to try render_notes first, turned off if it fails
+
+    def __init__(self):
+        self.level = None
+        self.time = 0
+        self.bpm = 120
+        self.offset = 0
+        self.time_signature = (4, 4)
+        self.swing = 0.5
+        self.beat_divisor = 4
+        self.approach_rate = 1100
+        self.approach_distance = 30
+        self.vis_map_size = 3
+        self.camera_pos = [0, 0]
+        self.parallax = 0
+        self.rounding = 0
+        self.colors = [0xFFFFFFFF]
+        self.preview_mode = False
+        self.draw_notes = True
+        self.draw_audio = False
+        self.bpm_markers = True
+        self.cursor = True
+        self.playtesting = False
+        self.waveform_res = 4
+        self.timeline_height = 50
+        self.timings = np.array((), dtype=np.int64)
+        self.times_to_display = None
+        self.visible_notes = NoteWindow()  # Which of times_to_display are in the level view
+        self.notes_changed = False
+        self.displayed_markers = []
+        self.rects_drawn = 0
+        self.BACKGROUND = None
+        self.background_size = (0, 0)
+        self.waveform = None  # The level's audio as a WaveformPyramid, once it's built
+        self._waveform_audio = None
+        self._waveform_build = None
+        self.timeline_zoom = 1  # 1 shows the whole level on the timeline
+        self._waveform_strip = TimelineStrip()
+        self._tick_strip = TimelineStrip()
+        self._tick_times = None  # The note times the timeline ticks were last binned from
+        self._tick_key = None
+        self._tick_rects = []
+        self.cursor_spline = None
+        self.cursor_positions = [[0, 0]]
+        self.timeline_rects = []
+        self.frame_timer = FrameTimer()
+
+    # The editor measures text with imgui, these are rough guesses for drawing without it
+    def text_size(self, text) -> tuple:
+        return len(text) * 7, 13
+
+    def font_size(self) -> float:
+        return 13
+
+    def set_font_scale(self, scale):
+        pass
+
+    def render_notes(self, instances, box, x, y, w, h) -> int:
+        """
+        Draw the notes into a texture covering the view, from the back one to the front one, and return its id.
+        Only called if gpu_notes is set. If it fails, the notes are drawn with the draw list from then on.
+        """
+        raise NotImplementedError
+
+    def upload_image(self, name, image) -> int:
+        """
+        Put an RGBA image in the texture called name, replacing what was there, and return the texture's id.
+        Only called if uses_textures is set.
+        """
+        raise NotImplementedError
+
+    def adjust_swing(self, beat):
+        return beats.adjust_swing(beat, self.swing)
+
+    def update_waveform(self):
+        """Start building the waveform again if the level's audio changed, and pick it up once it's built."""
+        audio = self.level.audio if self.level is not None else None
+        if audio is not self._waveform_audio:
+            self._waveform_audio = audio
+            self.waveform = None
+            self._waveform_build = None if audio is None else WaveformBuild(audio)
+        build = self._waveform_build
+        if build is not None and build.done:
+            if build.error is not None:
+                print(f"/!\\ Couldn't draw the waveform: {build.error}")
+            self.waveform = build.pyramid
+            self._waveform_build = None
+
+    def zoom_timeline(self, steps):
+        self.timeline_zoom = min(max(self.timeline_zoom * 1.25 ** steps, 1), MAX_TIMELINE_ZOOM)
+
+    def timeline_view(self, timeline_width) -> tuple:
+        """
+        Where the timeline starts, and how many milliseconds it shows, out of timeline_width in total.
+        Zoomed in, it follows the visible area, which always fits.
+        """
+        span = max(timeline_width / self.timeline_zoom, self.approach_rate * 2, 1)
+        if span >= timeline_width:
+            return 0, timeline_width
+        start = self.time + self.approach_rate / 2 - span / 2
+        return min(max(start, 0), timeline_width - span), span
+
+    def timeline_margin(self, timeline_width) -> float:
+        """How much of the timeline to draw on either side of what's shown, so a zoomed in timeline can scroll."""
+        return timeline_width / 2 if self.timeline_zoom > 1 else 0
+
+    def adjust_pos(self, cen, pos, progress):
+        visual_size = 1 / (1 + ((1 - progress) * self.approach_distance))
+        return (cen * visual_size) + (pos * (1 - visual_size))
+
+    def perspective_scale(self, progress):
+        return 1 / (1 + ((1 - progress) * self.approach_distance))
+
+    def note_pos_to_abs_pos(self, note_pos, box, progress):
+        note_pos = [note_pos[0] + self.camera_pos[0], note_pos[1] + self.camera_pos[1]]
+        center = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        spacing = ((box[2] - box[0]) / self.vis_map_size)
+        position = (center[0] + ((note_pos[0] - 1) * spacing),
+                    center[1] + ((note_pos[1] - 1) * spacing))
+        position = (self.adjust_pos(position[0], center[0], progress),
+                    self.adjust_pos(position[1], center[1], progress))
+        return position
+
+    def draw_note(self, draw_list, note_pos, box, progress, color=0xFFFFFF, alpha=0xff, size=1.0):
+        if progress <= 1:
+            spacing = ((box[2] - box[0]) / self.vis_map_size)
+            visual_scale = (spacing / 1.25) * self.perspective_scale(progress)
+            note_size = visual_scale * size
+            position = self.note_pos_to_abs_pos(note_pos, box, progress)
+            draw_list.add_rect(position[0] - note_size // 2, position[1] - note_size // 2,
+                               position[0] + note_size // 2, position[1] + note_size // 2,
+                               (int(alpha * max(progress, 0)) << 24) | color, thickness=max((note_size // 8), 0),
+                               rounding=self.rounding * note_size / 2)
+
+            self.rects_drawn += 1
+
+    def note_instances(self, first, last) -> np.ndarray:
+        """The notes at times_to_display[first:last], back to front, as NOTE_INSTANCE_DTYPE."""
+        if last <= first:
+            return np.zeros(0, dtype=NOTE_INSTANCE_DTYPE)
+        notes = self.level.notes
+        lo, hi = notes.range(self.times_to_display[first], self.times_to_display[last - 1] + 1)
+        data = notes.data[lo:hi]
+        # Colors go by the index of the note's time, like the timeline's
+        indices = np.searchsorted(self.times_to_display, data["time"])
+        palette = np.array(self.colors, dtype=np.uint32)
+        # Latest time first, and notes that share a time in the order they were added
+        order = np.argsort(-data["time"].astype(np.int64), kind="stable")
+        instances = np.zeros(len(data), dtype=NOTE_INSTANCE_DTYPE)
+        instances["time"] = (data["time"][order] - self.time).astype(np.float32)
+        instances["position"][:, 0] = data["x"][order]
+        instances["position"][:, 1] = data["y"][order]
+        instances["color"] = palette[indices[order] % len(palette)]
+        return instances
+
+    def draw_notes_at(self, draw_list, instances, box):
+        """Draw notes from note_instances with the draw list, the same as draw_note would, but worked out all at once."""
+        progress = 1 - (instances["time"].astype(np.float64) / self.approach_rate)
+        instances, progress = instances[progress <= 1], progress[progress <= 1]
+        spacing = ((box[2] - box[0]) / self.vis_map_size)
+        scale = 1 / (1 + ((1 - progress) * self.approach_distance))
+        center_x, center_y = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        xs = center_x + ((instances["position"][:, 0] + self.camera_pos[0] - 1) * spacing)
+        ys = center_y + ((instances["position"][:, 1] + self.camera_pos[1] - 1) * spacing)
+        xs, ys = xs * scale + center_x * (1 - scale), ys * scale + center_y * (1 - scale)
+        note_size = (spacing / 1.25) * scale
+        half = note_size // 2
+        colors = instances["color"]
+        alphas = ((colors >> 24) * np.maximum(progress, 0)).astype(np.uint32)
+        colors = (alphas << 24) | (colors & 0xFFFFFF)
+        thickness = np.maximum(note_size // 8, 0)
+        rounding = self.rounding * note_size / 2
+        for x0, y0, x1, y1, color, line, corner in zip((xs - half).tolist(), (ys - half).tolist(),
+                                                      (xs + half).tolist(), (ys + half).tolist(), colors.tolist(),
+                                                      thickness.tolist(), rounding.tolist()):
+            draw_list.add_rect(x0, y0, x1, y1, color, thickness=line, rounding=corner)
+        self.rects_drawn += len(colors)
+
+    def level_box(self, x, y, w, h) -> tuple:
+        """The square the notes are drawn in, centered in the view, and the length of its sides."""
+        square_side = min(w, h)
+        adjusted_x = (((x + w) / 2) - (square_side / 2))
+        adjusted_y = (((y + h) / 2) - (square_side / 2))
+        return (adjusted_x, adjusted_y, adjusted_x + square_side, adjusted_y + square_side), square_side
+
+    def draw_level(self, draw_list, x, y, w, h, timeline_width, spline_nodes=None, spline_display_notes=None,
+                   timeline_start=0):
+        """
+        Draw the background, the notes and everything that comes in with them, and queue up the timeline,
+        which shows timeline_width milliseconds from timeline_start. The timeline is drawn by draw_overlay,
+        so it ends up on top.
+        """
+        box, square_side = self.level_box(x, y, w, h)
+        self.timeline_rects = timeline_rects = []
+        # Draw the main UI background
+        if self.BACKGROUND is None:
+            draw_list.add_rect_filled(x, y, x + w, y + h, 0xff000000)
+        else:
+            # Adjust width and height for UVs
+            adjusted_w = w / self.background_size[0]
+            adjusted_h = h / self.background_size[1]
+            normalized_w = adjusted_w / max(adjusted_w, adjusted_h)
+            normalized_h = adjusted_h / max(adjusted_w, adjusted_h)
+            draw_list.add_image(self.BACKGROUND, (x, y), (x + w, y + h),
+                                (0.5 - (normalized_w / 2), 0.5 - (normalized_h / 2)),
+                                (0.5 + (normalized_w / 2), 0.5 + (normalized_h / 2)))
+        timeline_rects.append(
+            DelayedRect((x, (y + h) - (0 if self.preview_mode else self.timeline_height), x + w, (y + h)), 0x80404040))
+        self.rects_drawn += 3
+        self.frame_timer.phase("waveform")
+        if ((not self.preview_mode) and self.waveform is not None
+                and self.draw_audio and self.timeline_height > 20):
+            self.draw_waveform(x, y, w, h, timeline_start, timeline_width)
+        self.frame_timer.phase("timeline notes")
+        if not self.preview_mode and self.draw_notes and self.times_to_display is not None:
+            self.draw_ticks(x, y, w, h, timeline_start, timeline_width)
+        self.frame_timer.phase("level view")
+        # Draw currently visible area on timeline
+        start = (self.time - timeline_start) / timeline_width
+        end = (self.time + self.approach_rate - timeline_start) / timeline_width
+        timeline_rects.append(
+            DelayedRect((x + int(w * start), (y + h) - self.timeline_height, x + int(w * end) + 1,
+                         (y + h)), 0x80ffffff, thickness=3, filled=False))
+        self.rects_drawn += 1
+
+        def center_of_view(text):
+            text_width = self.text_size(text)[0]
+            return max(
+                min((((x + int(w * start)) + (x + int(w * end) + 1)) / 2) - (text_width / 2),
+                    w - text_width), text_width / 2)
+
+        # Draw the current time above the visible area
+        if not self.preview_mode:
+            draw_list.add_text(
+                center_of_view(f"{self.time / 1000:.3f}"),
+                y + h - (self.timeline_height + 20), 0x80FFFFFF, f"{self.time / 1000:.3f}")
+            if self.bpm:
+                ms_per_beat = (60000 / self.bpm) * (4 / self.time_signature[1])
+                # Draw the current measure and beat
+                raw_current_beat = (self.time - self.offset) / (ms_per_beat)
+                current_beat = self.adjust_swing(raw_current_beat)
+                m_text = f"Measure {current_beat // self.time_signature[0]:.0f}"
+                draw_list.add_text(
+                    center_of_view(m_text),
+                    y + h - (self.timeline_height + 60), 0x80FFFFFF, m_text)
+                b_text = f"Beat {f'{current_beat % (self.time_signature[0] / (self.time_signature[1] / 4)):.2f}'.rstrip('0').rstrip('.')}"
+                draw_list.add_text(
+                    center_of_view(b_text),
+                    y + h - (self.timeline_height + 40), 0x80FFFFFF, b_text)
+                self.frame_timer.phase("markers")
+                # Draw markers
+                if isinstance(self.level, SSPMLevel):
+                    old_time = -1
+                    offset = 0
+                    self.displayed_markers = []
+                    for marker_type in self.level.markers:
+                        for i, marker in enumerate(self.level.markers[marker_type]):
+                            line_prog = 1 - ((marker["time"] - self.time) / self.approach_rate)
+                            if marker["time"] == old_time:
+                                offset += self.font_size() / 4
+                            else:
+                                offset = 0
+                                old_time = marker["time"]
+                            if self.time <= marker["time"] < (self.time + self.approach_rate):
+                                self.set_font_scale(self.perspective_scale(line_prog) * 4)
+                                draw_list.add_text(
+                                    *self.note_pos_to_abs_pos(
+                                        (self.vis_map_size / -2 + 1,
+                                         (self.vis_map_size / 2 + 1) + (0.05 * offset)),
+                                        box, line_prog),
+                                    0xFFFFFF | (int(0xFF * max(0, line_prog)) << 24),
+                                    f"{marker_type}"
+                                )
+                                self.set_font_scale(1)
+                            progress = (marker["time"] - timeline_start) / timeline_width
+                            timeline_rects.append(
+                                DelayedRect((x + int(w * progress), (y + h) - self.timeline_height * 0.2,
+                                             x + int(w * progress) + 1,
+                                             (y + h) - self.timeline_height * 0.4),
+                                            0x00ff00ff))
+                            if self.time == marker["time"]:
+                                self.displayed_markers.append((marker_type, i, marker))
+                            self.rects_drawn += 1
+
+                self.frame_timer.phase("bpm grid")
+                if self.bpm_markers:
+                    # Draw beat markers on timeline
+                    visible_beats = timeline_width / ms_per_beat
+                    end_beat = (timeline_start + timeline_width) / ms_per_beat
+                    first_beat = max(int((timeline_start - self.offset) / ms_per_beat) - 1, 0)
+                    for beat in range(int(end_beat * self.beat_divisor + 1), first_beat * self.beat_divisor, -1):
+                        beat /= self.beat_divisor
+                        on_measure = not (beat % self.time_signature[0])
+                        on_beat = not (beat % 1)
+                        self.swing = 1 - self.swing  # Invert this because it draws in the wrong place otherwise
+                        swung_beat = self.adjust_swing(beat)
+                        self.swing = 1 - self.swing
+                        beat_time = (swung_beat * ms_per_beat) + self.offset
+                        if (visible_beats < 250 or on_beat) and (
+                                visible_beats < 500 or on_measure) and visible_beats < 2000:
+                            progress = (beat_time - timeline_start) / timeline_width
+                            progress = progress if not math.isnan(progress) else 1
+                            timeline_rects.append(DelayedRect((x + int(w * progress), (y + h) - (
+                                self.timeline_height * (
+                                    0.3 if on_measure else 0.2 if on_beat else 0.1)),
+                                x + int(w * progress) + 1, (y + h)),
+                                0xff0000ff if on_measure else 0x800000ff))
+                            self.rects_drawn += 1
+                        if (self.time <= beat_time < self.time + self.approach_rate):
+                            line_prog = 1 - ((beat_time - self.time) / self.approach_rate)
+                            # Draw beat marker in note space
+                            draw_list.add_rect(
+                                *self.note_pos_to_abs_pos(
+                                    (self.vis_map_size / 2 + 1, self.vis_map_size / 2 + 1),
+                                    box, line_prog),
+                                *self.note_pos_to_abs_pos(
+                                    (self.vis_map_size / -2 + 1, self.vis_map_size / -2 + 1),
+                                    box, line_prog),
+                                0xFF | (int(0xFF * max(0, line_prog) / (
+                                    1 if on_measure else 2 if on_beat else 6))) << 24,
+                                thickness=2 * max(0, line_prog) * (2 if on_measure else 1)
+                            )
+                            self.rects_drawn += 1
+            self.frame_timer.phase("timings")
+            first, last = np.searchsorted(self.timings, (self.time, self.time + self.approach_rate), "left")
+            for timing in self.timings[first:last]:
+                progress = (timing - timeline_start) / timeline_width
+                if progress < 1:
+                    progress = progress if not math.isnan(progress) else 1
+                    line_prog = 1 - ((timing - self.time) / self.approach_rate)
+                    # Draw beat marker in note space
+                    draw_list.add_line(
+                        *self.note_pos_to_abs_pos(
+                            (self.vis_map_size / 2 + 1, self.vis_map_size / -2 + 1),
+                            box, line_prog),
+                        *self.note_pos_to_abs_pos(
+                            (self.vis_map_size / -2 + 1, self.vis_map_size / -2 + 1),
+                            box, line_prog),
+                        0xFF00 | int(0xFF * max(0, line_prog)) << 24,
+                        thickness=2 * max(0, line_prog)
+                    )
+                    self.rects_drawn += 1
+        self.frame_timer.phase("notes")
+        if self.times_to_display is not None:
+            first, last = self.visible_notes.find(self.times_to_display, self.time, self.time + self.approach_rate)
+            instances = self.note_instances(first, last)
+            texture = None
+            if self.gpu_notes and len(instances):
+                try:
+                    texture = self.render_notes(instances, box, x, y, w, h)
+                except Exception as e:  # Old drivers, no GL 3.3, shaders that don't compile...
+                    print(f"/!\\ Couldn't draw notes with the GPU, so they'll be drawn like the rest of the UI: {e}")
+                    self.gpu_notes = False
+            if texture is not None:
+                draw_list.add_image(texture, (x, y), (x + w, y + h))
+                self.rects_drawn += len(instances)
+            else:
+                self.draw_notes_at(draw_list, instances, box)
+        self.frame_timer.phase("level view")
+        # XXX: copy/pasted code :/
+        if spline_nodes is not None and len(spline_display_notes) and len(spline_nodes) > 1:
+            for note_time, note in tuple(spline_nodes.items())[
+                    ::-1]:  # Invert to draw from back to front
+                progress = 1 - ((note_time - self.time) / self.approach_rate)
+                if 0 < progress < 1.01:
+                    handle_size = ((square_side / self.vis_map_size) / 1.25) * (
+                        1 / (1 + ((1 - progress) * self.approach_distance)))
+                    abs_position = self.note_pos_to_abs_pos(note,
+                                                            box,
+                                                            progress)
+                    draw_list.add_circle_filled(*abs_position, handle_size / 8,
+                                                (int(0x80 * progress) << 24) | 0x00FFFF)
+
+            for note_time in tuple(spline_display_notes.keys())[
+                    ::-1]:  # Invert to draw from back to front
+                note = spline_display_notes[note_time]
+                progress = 1 - ((note_time - self.time) / self.approach_rate)
+                self.draw_note(draw_list, note,
+                               box, progress,
+                               color=0xFFFF00, alpha=int(0x80 * progress), size=0.5)
+
+    def draw_waveform(self, x, y, w, h, timeline_start, timeline_width):
+        """
+        Queue up the waveform on the timeline. With textures, it's drawn into a strip that's only redrawn
+        when the song, the zoom or the timeline's size changes, or the timeline scrolls out of it.
+        Otherwise, it's a rect per bar.
+        """
+        width, height = int(w), int(self.timeline_height)
+        box = (x, y + h - height, x + width, y + h)
+        if self.uses_textures:
+            strip = self._waveform_strip
+            key = (self.waveform, timeline_width, width, height, self.waveform_res)
+            if not strip.covers(key, timeline_start, timeline_width):
+                start, span, strip_width = strip.place(key, timeline_start, timeline_width, width,
+                                                       self.timeline_margin(timeline_width))
+                low, high = self.waveform.peaks(start, start + span, strip_width // self.waveform_res)
+                strip.texture = self.upload_image(
+                    "waveform", rasterize_waveform(low, high, strip_width, height, self.waveform_res))
+            self.timeline_rects.append(strip.image(timeline_start, timeline_width, box))
+            self.rects_drawn += 1
+            return
+        low, high = self.waveform.peaks(timeline_start, timeline_start + timeline_width, width // self.waveform_res)
+        # Draw waveform, skipping columns past either end of the song
+        center = (y + h) - (self.timeline_height / 2)
+        shown = np.flatnonzero(~np.isnan(low))
+        scale = 0.8 * (self.timeline_height // 2)
+        lefts = (x + shown * self.waveform_res).tolist()
+        tops = (center + (high[shown] * scale).astype(np.int64)).tolist()
+        bottoms = (center + (low[shown] * scale).astype(np.int64)).tolist()
+        for left, top, bottom in zip(lefts, tops, bottoms):
+            self.timeline_rects.append(DelayedRect((left, top, left + self.waveform_res, bottom), 0x20ffffff))
+        self.rects_drawn += len(shown)
+
+    def draw_ticks(self, x, y, w, h, timeline_start, timeline_width):
+        """
+        Queue up a tick on the timeline for every note, binned into pixel columns, so there are never more than
+        the timeline is wide. With textures, they're drawn into a strip like the waveform's,
+        otherwise they're rebuilt when the notes or the timeline change.
+        """
+        width = int(w)
+        top, bottom = (y + h) - self.timeline_height, (y + h) - (self.timeline_height * 0.8)
+        if self.uses_textures:
+            strip = self._tick_strip
+            key = (timeline_width, width, tuple(self.colors))
+            if self.times_to_display is not self._tick_times or not strip.covers(key, timeline_start, timeline_width):
+                self._tick_times = self.times_to_display
+                start, span, strip_width = strip.place(key, timeline_start, timeline_width, width,
+                                                       self.timeline_margin(timeline_width))
+                counts, colors = bin_ticks(self.times_to_display, self.colors, start, span, strip_width)
+                image = np.empty((1, strip_width, 4), dtype=np.uint8)
+                image[0, :, 0] = colors & 0xFF
+                image[0, :, 1] = (colors >> 8) & 0xFF
+                image[0, :, 2] = (colors >> 16) & 0xFF
+                image[0, :, 3] = tick_alpha(counts)
+                strip.texture = self.upload_image("ticks", image)
+            self.timeline_rects.append(strip.image(timeline_start, timeline_width, (x, top, x + width, bottom)))
+            self.rects_drawn += 1
+            return
+        key = (timeline_start, timeline_width, x, width, top, bottom, tuple(self.colors))
+        if self.times_to_display is not self._tick_times or key != self._tick_key:
+            self._tick_times, self._tick_key = self.times_to_display, key
+            counts, colors = bin_ticks(self.times_to_display, self.colors, timeline_start, timeline_width, width)
+            colors = (colors & 0xFFFFFF) | (tick_alpha(counts).astype(np.uint32) << 24)
+            self._tick_rects = [DelayedRect((x + column, top, x + column + 1, bottom), color)
+                                for column, color in zip(np.flatnonzero(counts).tolist(),
+                                                         colors[counts > 0].tolist())]
+        self.timeline_rects.extend(self._tick_rects)
+        self.rects_drawn += len(self._tick_rects)
+
+    def draw_overlay(self, draw_list, x, y, w, h, cursor_pos, cursor_color=0xFFFFFFFF):
+        """Draw the cursor and the timeline, over everything else."""
+        box, square_side = self.level_box(x, y, w, h)
+
+        def position(pos):
+            return self.note_pos_to_abs_pos(pos, box, 1)
+
+        self.frame_timer.phase("cursor")
+        # Draw cursor
+        if self.cursor and (len(self.level.notes) or self.playtesting):
+            notes = self.level.get_notes()
+            if len(notes):
+                start = notes[0]  # Sorted, so no need to look through all of them
+                end = notes[-1]
+            if self.playtesting or (end - start):
+                if (self.cursor_spline is None or self.notes_changed) and not self.playtesting:
+                    from scipy.interpolate import CubicSpline
+                    node_times, node_positions = self.level.notes.centroids()
+                    self.cursor_spline = CubicSpline(node_times.astype(np.float64), node_positions)
+
+                if self.playtesting:
+                    self.cursor_positions = [cursor_pos] + self.cursor_positions[
+                        :6]  # NOTE: using a .insert breaks because of None
+                else:
+                    self.cursor_positions = [self.cursor_spline(self.time - t) for t in
+                                             range(0, 75, 1)]
+                self.camera_pos = ((self.cursor_positions[0][0] - 1) * self.parallax,
+                                   (self.cursor_positions[0][1] - 1) * self.parallax)
+
+                draw_list.add_circle_filled(*position(self.cursor_positions[0]),
+                                            (square_side / self.vis_map_size) / 20,
+                                            cursor_color,
+                                            num_segments=32)
+            else:
+                self.camera_pos = (0, 0)
+                self.cursor_positions = []
+            draw_list.add_polyline([position(p) for p in self.cursor_positions],
+                                   cursor_color & 0x40FFFFFF,
+                                   thickness=(square_side / self.vis_map_size) / 20)
+        self.frame_timer.phase("timeline")
+        if not self.preview_mode:
+            for rect in self.timeline_rects:
+                rect.draw(draw_list)
+                self.rects_drawn += 1
@@ -0,0 +1,108 @@
+"""
+The song's waveform for the timeline, as peaks at several resolutions, so it can be drawn at any zoom from a few lookups.
+"""
+import math
+import threading
+
+import numpy as np
+
+BLOCK = 64  # Frames summed up by each peak at the finest resolution
+CHUNK = BLOCK * 16384  # Frames read at a time while building, so the whole song is never copied at once
+
+
+class WaveformPyramid:
+    """
+    The lowest and highest sample in every block of BLOCK frames, then in every two of those blocks, and so on,
+    across all channels. Each level has half as many peaks as the one below, so all of them together
+    are still only a small fraction of the size of the samples.
+    """
+
+    def __init__(self, levels, extent, frame_rate, frames):
+        self.levels = levels  # (lowest, highest) arrays, finest first
+        self.extent = extent  # The loudest sample, for scaling
+        self.frame_rate = frame_rate
+        self.frames = frames
+
+    @classmethod
+    def build(cls, samples, channels, frame_rate):
+        """Build from interleaved samples, like pydub's get_array_of_samples()."""
+        frames = len(samples) // channels
+        samples = samples[:frames * channels].reshape(frames, channels)
+        lows, highs = [], []
+        for start in range(0, frames, CHUNK):
+            chunk = samples[start:start + CHUNK]
+            # Channel by channel, since reducing along short rows is much slower
+            low, high = chunk[:, 0].copy(), chunk[:, 0].copy()
+            for channel in range(1, channels):
+                np.minimum(low, chunk[:, channel], out=low)
+                np.maximum(high, chunk[:, channel], out=high)
+            starts = np.arange(0, len(chunk), BLOCK)
+            lows.append(np.minimum.reduceat(low, starts))
+            highs.append(np.maximum.reduceat(high, starts))
+        low = np.concatenate(lows) if lows else np.zeros(0, dtype=samples.dtype)
+        high = np.concatenate(highs) if highs else np.zeros(0, dtype=samples.dtype)
+        levels = [(low, high)]
+        while len(low) > 1:
+            pairs = np.arange(0, len(low), 2)
+            low, high = np.minimum.reduceat(low, pairs), np.maximum.reduceat(high, pairs)
+            levels.append((low, high))
+        # Widened first, since the quietest int16 sample has no positive counterpart
+        extent = max(abs(int(low.min())), abs(int(high.max()))) if len(low) else 0
+        return cls(levels, extent, frame_rate, frames)
+
+    def peaks(self, start, end, columns) -> tuple:
+        """
+        The lowest and highest sample in each of columns even slices of the song from start to end (in milliseconds),
+        from -1 to 1. Slices outside of the song are NaN.
+        """
+        low = np.full(columns, np.nan, dtype=np.float32)
+        high = np.full(columns, np.nan, dtype=np.float32)
+        if columns <= 0 or end <= start or not self.extent:
+            return low, high
+        # The coarsest level that still has at least one peak per column
+        frames_per_column = (end - start) * self.frame_rate / 1000 / columns
+        level = min(max(int(math.log2(max(frames_per_column / BLOCK, 1))), 0), len(self.levels) - 1)
+        lows, highs = self.levels[level]
+        block_ms = (BLOCK << level) * 1000 / self.frame_rate
+        edges = np.floor(np.linspace(start, end, columns + 1) / block_ms).astype(np.int64)
+        first = edges[:-1]
+        valid = (first >= 0) & (first < len(lows))
+        if not valid.any():
+            return low, high
+        # Each column covers the blocks up to where the next one starts, or at least its first block
+        starts = first[valid]
+        stop = min(max(int(edges[1:][valid][-1]), int(starts[-1]) + 1), len(lows))
+        low[valid] = np.minimum.reduceat(lows[:stop], starts) / self.extent
+        high[valid] = np.maximum.reduceat(highs[:stop], starts) / self.extent
+        return low, high
+
+
+def audio_samples(audio) -> np.ndarray:
+    """A pydub AudioSegment's samples, without copying them where possible."""
+    if audio.sample_width in (1, 2, 4):
+        return np.frombuffer(audio.raw_data, dtype=np.dtype(f"<i{audio.sample_width}"))
+    return np.array(audio.get_array_of_samples())
+
+
+class WaveformBuild:
+    """
+    Builds a song's waveform on a worker thread, so loading a song doesn't freeze the editor.
+    """
+
+    def __init__(self, audio):
+        self.audio = audio
+        self.pyramid = None
+        self.error = None
+        self.done = False
+        # A daemon, since there's nothing to lose by quitting before it's done
+        self.thread = threading.Thread(target=self._run, name="SSPy waveform", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.pyramid = WaveformPyramid.build(audio_samples(self.audio), self.audio.channels,
+                                                 self.audio.frame_rate)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
@@ -0,0 +1,27 @@
+import json
+
+import convert
+from benchmarks.generate import METADATA, generate_audio, generate_notes
+from src.core import VulnusLevel
+
+
+def make_vulnus_set(directory, count):
+    """A Vulnus map with count difficulties, d0.json to d{count - 1}.json, sharing one song."""
+    directory.mkdir(parents=True)
+    for i in range(count):
+        level = VulnusLevel("Artist - Song", ["Mapper"], generate_notes(50, seed=i), None, None, f"Difficulty {i}")
+        level.set_audio_data(generate_audio(4096))
+        level.save(str(directory / f"d{i}.json"), *METADATA)
+
+
+def test_convert_vulnus_set_keeps_every_difficulty(tmp_path):
+    make_vulnus_set(tmp_path / "vset" / "song", 8)
+    output = tmp_path / "vout"
+    assert convert.main([str(tmp_path / "vset" / "song"), "--to", "json", "--output", str(output), "-j", "8"]) == 0
+    with open(output / "song" / "meta.json") as f:
+        difficulties = json.load(f)["_difficulties"]
+    assert sorted(difficulties) == [f"d{i}.json" for i in range(8)]
+    for i in range(8):
+        level, _ = VulnusLevel.load(str(output / "song" / f"d{i}.json"))
+        assert len(level.notes) == 50
+        assert level.audio_data == generate_audio(4096)